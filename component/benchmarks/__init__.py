@@ -0,0 +1,19 @@
+"""
+Benchmarks of the Wiser Home component, run by pytest along with the tests.
+They work on synthetic configurations, see the synthetic module.
+
+The *_benchmark_test modules need pytest-benchmark and are skipped without it.
+Runs are saved to and compared against the baselines directory, which holds a
+baseline per machine. Compare a change of the hot path against the latest one:
+
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:25%
+
+Timings only compare on the same machine. Save a baseline of your own before
+the change if the committed one is for another machine, and commit a new one
+when the hot path got faster on purpose:
+
+    python -m pytest benchmarks -k benchmark_test --benchmark-save=baseline
+"""
+import os
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines")
@@ -0,0 +1,82 @@
+"""
+A minimal in-process stand-in for Home Assistant, enough to drive rooms and
+valves without a running instance: service calls are recorded, entity states
+are kept and state changes are dispatched to the tracking callbacks.
+"""
+import typing as T
+
+if T.TYPE_CHECKING:
+    # pylint: disable=unused-import
+    from wiser_home.room import Room
+
+import asyncio
+import collections
+
+from homeassistant.core import State
+
+StateChangeCallback = T.Callable[[str, T.Optional[State], State], T.Awaitable[None]]
+
+
+class FakeServices:
+    """Records service calls instead of executing them."""
+
+    def __init__(self) -> None:
+        self.calls = []  # type: T.List[T.Tuple[str, str, dict]]
+
+    async def async_call(self, domain: str, service: str, data: dict = None, *args: T.Any) -> None:
+        self.calls.append((domain, service, data or {}))
+
+    def async_register(self, domain: str, service: str, *args: T.Any) -> None:
+        pass
+
+
+class FakeStates:
+    """Keeps the current state of entities, notifying trackers of changes."""
+
+    def __init__(self, hass: "FakeHass") -> None:
+        self._hass = hass
+        self._states = {}  # type: T.Dict[str, State]
+
+    def get(self, entity_id: str) -> T.Optional[State]:
+        return self._states.get(entity_id)
+
+    async def async_set(self, entity_id: str, new_state: str, attributes: dict = None) -> None:
+        """Sets the state of an entity and awaits all tracking callbacks."""
+
+        old_state = self._states.get(entity_id)
+        state = State(entity_id, new_state, attributes)
+        self._states[entity_id] = state
+        for action in self._hass.trackers.get(entity_id, ()):
+            await action(entity_id, old_state, state)
+
+
+class FakeHass:
+    """The parts of the hass object used by rooms and valves."""
+
+    def __init__(self) -> None:
+        self.services = FakeServices()
+        self.states = FakeStates(self)
+        self.trackers = collections.defaultdict(list)  # type: T.Dict[str, T.List[StateChangeCallback]]
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_event_loop()
+
+    def track_state_change(self, entity_id: str, action: StateChangeCallback) -> T.Callable[[], None]:
+        """Like homeassistant.helpers.event.async_track_state_change() for a
+        single entity. Returns a function removing the tracker again."""
+
+        self.trackers[entity_id].append(action)
+        return lambda: self.trackers[entity_id].remove(action)
+
+    def attach_room(self, room: "Room") -> T.List[str]:
+        """Connects a room to this hass and tracks the states of its valves,
+        like adding the room to Home Assistant does. Returns the entity ids
+        of the valves."""
+
+        # pylint: disable=protected-access
+        room._hass = self
+        valve_ids = list(room._valves._valves)
+        for entity_id in valve_ids:
+            self.track_state_change(entity_id, room._async_valve_state_change)
+        return valve_ids
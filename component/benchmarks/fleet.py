@@ -0,0 +1,231 @@
+"""
+Load test running many houses, each a WiserHome entity with synthetic rooms
+and valves, on one event loop with a shared FakeHass. Time is simulated minute
+by minute on a VirtualClock: every minute each house runs its control loop and
+valves report new states at a realistic rate. A probe task measures how late
+the event loop gets to run it, which is the longest stretch of work done
+without yielding.
+
+Run as a module to print a report:
+python -m benchmarks.fleet [houses] [rooms per house] [valves per room] [minutes]
+"""
+import typing as T
+
+import asyncio
+import datetime
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from homeassistant.util import dt as dt_util
+
+from wiser_home import config
+from wiser_home.clock import VirtualClock
+
+from . import synthetic
+from .fake_hass import FakeHass
+
+START = datetime.datetime(2020, 1, 6, tzinfo=dt_util.UTC)
+
+# Average number of state reports per valve and minute, TRVs report their
+# temperature every few minutes
+EVENTS_PER_VALVE_MINUTE = 0.2
+
+# Interval of the event loop lag probe, in seconds
+PROBE_INTERVAL = 0.005
+
+
+class FleetReport(T.NamedTuple):
+    """Results of a load test. Times are in seconds."""
+
+    houses: int
+    rooms: int
+    valves: int
+    minutes: int
+    events: int
+    wall: float
+    cpu_per_house_minute: float
+    service_calls_per_minute: float
+    loop_lag_p99: float
+    loop_lag_max: float
+    bytes_per_room: T.Optional[float] = None
+    bytes_per_valve: T.Optional[float] = None
+
+    def __str__(self) -> str:
+        lines = [
+            "{} houses, {} rooms, {} valves, {} simulated minutes in {:.2f}s".format(
+                self.houses, self.rooms, self.valves, self.minutes, self.wall
+            ),
+            "{} valve events, {:.1f} service calls/minute".format(
+                self.events, self.service_calls_per_minute
+            ),
+            "CPU per house and minute: {:.3f} ms".format(self.cpu_per_house_minute * 1e3),
+            "event loop lag: p99 {:.1f} ms, max {:.1f} ms".format(
+                self.loop_lag_p99 * 1e3, self.loop_lag_max * 1e3
+            ),
+        ]
+        if self.bytes_per_room is not None:
+            lines.append("memory: {:.0f} bytes/room, {:.0f} bytes/valve".format(
+                self.bytes_per_room, self.bytes_per_valve
+            ))
+        return "\n".join(lines)
+
+
+class House(T.NamedTuple):
+    """A WiserHome entity with the entity ids of its valves."""
+
+    home: T.Any
+    valve_ids: T.List[str]
+
+
+def build_fleet(
+    hass: FakeHass,
+    clock: VirtualClock,
+    houses: int,
+    rooms: int,
+    valves_per_room: int,
+    seed: int = 0,
+) -> T.List[House]:
+    """Creates WiserHome entities with synthetic rooms, all connected to the
+    given hass and clock."""
+
+    from wiser_home.sensor import WiserHome  # pylint: disable=import-outside-toplevel
+
+    fleet = []
+    for index in range(houses):
+        prefix = "house_{}".format(index)
+        cfg = synthetic.load_config(synthetic.build_raw_config(
+            rooms, seed + index, valves_per_room=valves_per_room, prefix=prefix
+        ))
+        rule_stats = config.intern_config(cfg)
+        built = config.parse_rooms(cfg)
+        home = WiserHome(prefix, prefix, "switch.boiler_{}".format(index), built, rule_stats, clock)
+        home.hass = hass
+        valve_ids = []
+        for room in built:
+            valve_ids.extend(hass.attach_room(room))
+        fleet.append(House(home, valve_ids))
+    return fleet
+
+
+def _percentile(values: T.Sequence[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def _probe_loop_lag(lags: T.List[float], stop: asyncio.Event) -> None:
+    """Records how much later than requested the loop resumes this task."""
+
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def async_run_fleet(
+    houses: int = 100,
+    rooms: int = 10,
+    valves_per_room: int = 2,
+    minutes: int = 60,
+    seed: int = 0,
+) -> FleetReport:
+    """Builds a fleet and runs it for the given number of simulated minutes."""
+
+    # pylint: disable=too-many-locals
+
+    rnd = random.Random(seed)
+    hass = FakeHass()
+    clock = VirtualClock(START)
+    fleet = build_fleet(hass, clock, houses, rooms, valves_per_room, seed)
+    valves = sum(len(house.valve_ids) for house in fleet)
+    temperatures = {}  # type: T.Dict[str, float]
+
+    lags = []  # type: T.List[float]
+    stop = asyncio.Event()
+    probe = asyncio.ensure_future(_probe_loop_lag(lags, stop))
+
+    cpu = 0.0
+    events = 0
+    service_calls = 0
+    started = time.perf_counter()
+    for minute in range(minutes):
+        now = START + datetime.timedelta(minutes=minute)
+        await clock.async_advance_to(now)
+        for house in fleet:
+            cpu_started = time.process_time()
+            await house.home._async_control_heater(now)  # pylint: disable=protected-access
+            for entity_id in house.valve_ids:
+                if rnd.random() >= EVENTS_PER_VALVE_MINUTE:
+                    continue
+                temperature = temperatures.get(entity_id, 19.0) + rnd.choice((-0.5, 0, 0.5))
+                temperatures[entity_id] = min(max(temperature, 14.0), 24.0)
+                await hass.states.async_set(entity_id, "heat", {
+                    "local_temperature": temperatures[entity_id],
+                    "occupied_heating_setpoint": 20,
+                    "boost": "None",
+                })
+                events += 1
+            cpu += time.process_time() - cpu_started
+            # Let other tasks run between houses, like HA does between timers
+            await asyncio.sleep(0)
+        service_calls += len(hass.services.calls)
+        hass.services.calls.clear()
+    wall = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    return FleetReport(
+        houses=houses,
+        rooms=houses * rooms,
+        valves=valves,
+        minutes=minutes,
+        events=events,
+        wall=wall,
+        cpu_per_house_minute=cpu / (houses * minutes),
+        service_calls_per_minute=service_calls / minutes,
+        loop_lag_p99=_percentile(lags, 0.99),
+        loop_lag_max=max(lags, default=0.0),
+    )
+
+
+def run_fleet(*args: T.Any, **kwargs: T.Any) -> FleetReport:
+    """Runs async_run_fleet() in a new event loop."""
+
+    return asyncio.run(async_run_fleet(*args, **kwargs))
+
+
+def measure_fleet_memory(houses: int, rooms: int, valves_per_room: int) -> int:
+    """Returns the bytes still allocated after building a fleet."""
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fleet = build_fleet(FakeHass(), VirtualClock(START), houses, rooms, valves_per_room)
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del fleet
+    return current
+
+
+def measure_memory_per_room_and_valve(houses: int = 10, rooms: int = 10) -> T.Tuple[float, float]:
+    """Returns the bytes used per room, without its valves, and per valve.
+    They are told apart by building fleets with one and two valves per room."""
+
+    one = measure_fleet_memory(houses, rooms, 1)
+    two = measure_fleet_memory(houses, rooms, 2)
+    per_valve = (two - one) / (houses * rooms)
+    return one / (houses * rooms) - per_valve, per_valve
+
+
+if __name__ == "__main__":
+    ARGS = [int(arg) for arg in sys.argv[1:5]]
+    REPORT = run_fleet(*ARGS)
+    PER_ROOM, PER_VALVE = measure_memory_per_room_and_valve()
+    print(REPORT._replace(bytes_per_room=PER_ROOM, bytes_per_valve=PER_VALVE))
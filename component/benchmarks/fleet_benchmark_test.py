@@ -0,0 +1,33 @@
+"""
+Time budgets of the fleet load test, see fleet. They depend on the machine,
+like all benchmarks, and are skipped along with them by --benchmark-skip.
+"""
+import pytest
+
+from . import fleet
+
+pytest.importorskip("pytest_benchmark")
+
+HOUSES = 20
+ROOMS = 5
+VALVES_PER_ROOM = 2
+MINUTES = 10
+
+# Upper bound for the CPU time a house needs per simulated minute
+CPU_BUDGET = 0.005
+
+# Upper bound for the longest time the event loop is blocked
+LOOP_LAG_BUDGET = 0.1
+
+
+def test_fleet_within_budget(benchmark):
+    benchmark.group = "fleet"
+    report = benchmark.pedantic(
+        fleet.run_fleet, args=(HOUSES, ROOMS, VALVES_PER_ROOM, MINUTES), rounds=1)
+    benchmark.extra_info.update(
+        cpu_per_house_minute=report.cpu_per_house_minute,
+        loop_lag_p99=report.loop_lag_p99,
+        loop_lag_max=report.loop_lag_max,
+    )
+    assert report.cpu_per_house_minute < CPU_BUDGET
+    assert report.loop_lag_max < LOOP_LAG_BUDGET
@@ -0,0 +1,40 @@
+"""
+Regression gates for the fleet load test, on a fleet small enough for CI.
+The time budgets are checked by fleet_benchmark_test. Run benchmarks.fleet as
+a module for the full-size numbers.
+"""
+from . import fleet
+from .fake_hass import FakeHass
+
+HOUSES = 5
+ROOMS = 5
+VALVES_PER_ROOM = 2
+MINUTES = 10
+
+# Upper bounds for the memory used per room, without valves, and per valve
+ROOM_MEMORY_BUDGET = 64 * 1024
+VALVE_MEMORY_BUDGET = 4 * 1024
+
+
+def test_build_fleet_separates_houses():
+    hass = FakeHass()
+    houses = fleet.build_fleet(hass, fleet.VirtualClock(fleet.START), 3, ROOMS, VALVES_PER_ROOM)
+    valve_ids = [entity_id for house in houses for entity_id in house.valve_ids]
+    assert len(valve_ids) == 3 * ROOMS * VALVES_PER_ROOM
+    assert len(set(valve_ids)) == len(valve_ids)
+    assert set(hass.trackers) == set(valve_ids)
+    assert len({house.home.boiler_entity_id for house in houses}) == 3
+
+
+def test_run_fleet():
+    report = fleet.run_fleet(HOUSES, ROOMS, VALVES_PER_ROOM, MINUTES)
+    assert report.valves == HOUSES * ROOMS * VALVES_PER_ROOM
+    assert report.events > 0
+    # Every house switches its boiler on every tick
+    assert report.service_calls_per_minute >= HOUSES
+
+
+def test_fleet_memory_within_budget():
+    per_room, per_valve = fleet.measure_memory_per_room_and_valve(houses=4, rooms=ROOMS)
+    assert 0 < per_valve < VALVE_MEMORY_BUDGET
+    assert 0 < per_room < ROOM_MEMORY_BUDGET
@@ -0,0 +1,76 @@
+"""
+Memory used by the schedule data model of a synthetic 100-room config.
+Run as a module to print the numbers: python -m benchmarks.memory_test
+"""
+import datetime
+import gc
+import tracemalloc
+
+import pytest
+
+from wiser_home import schedule
+from wiser_home.room import Room, Valves
+
+from . import synthetic
+
+ROOMS = 100
+
+# Upper bound for the growth of the memory used by rooms, schedules and
+# unfolded paths when doubling the number of rooms. Absolute numbers depend on
+# the interpreter and platform, they are only reported. Shared and interned
+# parts keep the growth below linear, about 1.9 is measured.
+MEMORY_GROWTH_BUDGET = 2.1
+
+
+def measure_model_memory(rooms: int = ROOMS) -> int:
+    """Returns the bytes allocated for building and unfolding the rooms of a
+    synthetic config and still in use afterwards."""
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        built = synthetic.build_rooms(rooms)
+        for room in built:
+            room.schedule.unfolded  # pylint: disable=pointless-statement
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del built
+    return current
+
+
+@pytest.mark.parametrize("obj", [
+    schedule.Rule(value=20),
+    schedule.SubScheduleRule(schedule.Schedule()),
+    schedule.Schedule(),
+    schedule.Schedule(rules=[schedule.Rule(value=20)]).unfolded[0],
+    Room("test", schedule=schedule.Schedule()),
+    Valves(),
+])
+def test_model_has_no_instance_dict(obj):
+    assert not hasattr(obj, "__dict__")
+
+
+def test_model_memory_grows_linearly(record_property):
+    rooms = synthetic.build_rooms(ROOMS)
+    assert len(rooms) == ROOMS
+    assert rooms[0].schedule.evaluate_sync(rooms[0], datetime.datetime(2020, 6, 1, 7, 0))
+    used = measure_model_memory()
+    record_property("model_bytes", used)
+    assert measure_model_memory(2 * ROOMS) < MEMORY_GROWTH_BUDGET * used
+
+
+def test_schedule_rules_immutable():
+    rule = schedule.Rule(value=20)
+    sched = schedule.Schedule(rules=[rule])
+    assert sched.rules == (rule,)
+    assert sched.unfolded[0].last_rule is rule
+    other = schedule.Rule(value=18)
+    sched.rules += (other,)
+    # Paths of the old rules are dropped
+    assert [path.last_rule for path in sched.unfolded] == [rule, other]
+
+
+if __name__ == "__main__":
+    print("{} rooms: {:.1f} KiB".format(ROOMS, measure_model_memory() / 1024))
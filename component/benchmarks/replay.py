@@ -0,0 +1,357 @@
+"""
+Replays recorded Home Assistant history through the component, faster than
+real time, and reports the decisions it would have made.
+
+History is read from an export of the recorder's states table, either as a
+SQLite database (home-assistant_v2.db or a copy of it) or as JSON lines with
+the columns entity_id, state, attributes and last_updated_ts or last_updated.
+Records are streamed in the order of their time, without loading them all.
+Valve states are fed to the rooms through a FakeHass, and in between the
+control loop runs every SCHEDULE_INTERVAL minutes of recorded time. Rooms
+and the WiserHome entity run on a VirtualClock following the recorded time,
+so that their timers, like those ending boosts, fire when they would have.
+
+Run as a module, writing one JSON object per decision to stdout:
+python -m benchmarks.replay config.yaml history.db [--time-zone Europe/Madrid] [--until TIME]
+
+config.yaml holds the platform configuration of the component, either on its
+own or as the entry of a climate: list. It must not contain !include, !secret
+or other tags specific to Home Assistant.
+"""
+import typing as T
+
+import argparse
+import asyncio
+import datetime
+import json
+import sqlite3
+import sys
+
+from homeassistant.util import dt as dt_util
+
+from wiser_home import config
+from wiser_home.clock import VirtualClock
+from wiser_home.const import SCHEDULE_INTERVAL
+from wiser_home.room import Room
+
+from . import synthetic
+from .fake_hass import FakeHass
+
+
+class HistoryRecord(T.NamedTuple):
+    """A state of an entity as recorded by Home Assistant."""
+
+    when: datetime.datetime
+    entity_id: str
+    state: str
+    attributes: T.Dict[str, T.Any]
+
+
+class Decision(T.NamedTuple):
+    """Something the component decided at a point in time: a service it
+    called, or a room's set-point or heat demand changing."""
+
+    when: datetime.datetime
+    kind: str
+    target: str
+    value: T.Any
+
+    def as_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "time": self.when.isoformat(),
+            "kind": self.kind,
+            "target": self.target,
+            "value": self.value,
+        }
+
+
+def parse_time(value: T.Union[str, float, int]) -> datetime.datetime:
+    """Parses a recorded time, a timestamp or an ISO string, naive ones in UTC."""
+
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, dt_util.UTC)
+    when = dt_util.parse_datetime(value)
+    if when is None:
+        raise ValueError("Invalid time: {!r}".format(value))
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=dt_util.UTC)
+    return when
+
+
+def _parse_attributes(value: T.Union[str, dict, None]) -> T.Dict[str, T.Any]:
+    if not value:
+        return {}
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def read_jsonl(
+    lines: T.Iterable[str], entity_ids: T.Container[str] = None
+) -> T.Iterator[HistoryRecord]:
+    """Yields the records of a JSON lines export, which must be ordered by
+    time, only those of the given entities if entity_ids is given."""
+
+    for line in lines:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        entity_id = row["entity_id"]
+        if entity_ids is not None and entity_id not in entity_ids:
+            continue
+        when = row.get("last_updated_ts")
+        if when is None:
+            when = row["last_updated"]
+        yield HistoryRecord(
+            parse_time(when),
+            entity_id,
+            row["state"],
+            _parse_attributes(row.get("attributes") or row.get("shared_attrs")),
+        )
+
+
+def read_sqlite(
+    connection: sqlite3.Connection, entity_ids: T.Collection[str] = None
+) -> T.Iterator[HistoryRecord]:
+    """Yields the records of a recorder database in the order of their time,
+    only those of the given entities if entity_ids is given. Both the
+    current schema, with entity ids and attributes in tables of their own,
+    and older ones, with everything in the states table, are supported."""
+
+    tables = {
+        row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    }
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(states)")}
+
+    joins = []
+    if "states_meta" in tables and "metadata_id" in columns:
+        entity = "states_meta.entity_id"
+        joins.append("LEFT JOIN states_meta ON states.metadata_id = states_meta.metadata_id")
+    else:
+        entity = "states.entity_id"
+    if "state_attributes" in tables and "attributes_id" in columns:
+        attributes = "COALESCE(state_attributes.shared_attrs, states.attributes)"
+        joins.append(
+            "LEFT JOIN state_attributes ON states.attributes_id = state_attributes.attributes_id"
+        )
+    else:
+        attributes = "states.attributes"
+    when = "states.last_updated_ts" if "last_updated_ts" in columns else "states.last_updated"
+
+    query = "SELECT {}, {}, states.state, {} FROM states {}".format(
+        when, entity, attributes, " ".join(joins)
+    )
+    params = ()  # type: T.Tuple[str, ...]
+    if entity_ids is not None:
+        params = tuple(entity_ids)
+        query += " WHERE {} IN ({})".format(entity, ", ".join("?" * len(params)))
+    query += " ORDER BY {}".format(when)
+
+    for row_when, entity_id, state, attrs in connection.execute(query, params):
+        yield HistoryRecord(parse_time(row_when), entity_id, state, _parse_attributes(attrs))
+
+
+def read_history(path: str, entity_ids: T.Collection[str] = None) -> T.Iterator[HistoryRecord]:
+    """Yields the records of a history export, JSON lines if the file name
+    ends with .jsonl, a SQLite database otherwise."""
+
+    if path.endswith(".jsonl"):
+        with open(path) as file:
+            yield from read_jsonl(file, entity_ids)
+    else:
+        connection = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+        try:
+            yield from read_sqlite(connection, entity_ids)
+        finally:
+            connection.close()
+
+
+def load_platform_config(path: str) -> dict:
+    """Reads and validates the component's configuration from a YAML file."""
+
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    with open(path) as file:
+        raw = yaml.safe_load(file)
+    if "climate" in raw:
+        raw = next(
+            entry for entry in raw["climate"] if entry.get("platform") == "wiser_home"
+        )
+    raw = {key: value for key, value in raw.items() if key not in ("platform", "name")}
+    return synthetic.load_config(raw)
+
+
+class ReplayEngine:
+    """Drives rooms, and optionally the WiserHome entity owning them, with
+    recorded history. Without an entity the boiler is switched like
+    WiserHome does, depending on the heat demand of the rooms."""
+
+    def __init__(
+        self,
+        rooms: T.List[Room],
+        boiler: str,
+        home: T.Any = None,
+        interval: datetime.timedelta = datetime.timedelta(minutes=SCHEDULE_INTERVAL),
+        clock: VirtualClock = None,
+    ) -> None:
+        self.rooms = rooms
+        self.boiler = boiler
+        self.home = home
+        self.interval = interval
+        # The entity must have been created with the same clock
+        self.clock = clock or VirtualClock(datetime.datetime.min.replace(tzinfo=dt_util.UTC))
+        self.hass = FakeHass()
+        self._room_states = {}  # type: T.Dict[str, T.Tuple[T.Any, bool]]
+        self._boiler_on = None  # type: T.Optional[bool]
+        for room in rooms:
+            room.clock = self.clock
+            self.hass.attach_room(room)
+        if home is not None:
+            home.hass = self.hass
+
+    @property
+    def entity_ids(self) -> T.Set[str]:
+        """The entities whose history is replayed."""
+
+        return {*self.hass.trackers, self.boiler}
+
+    def _drain_service_calls(self, when: datetime.datetime) -> T.Iterator[Decision]:
+        for domain, service, data in self.hass.services.calls:
+            yield Decision(
+                when,
+                "{}.{}".format(domain, service),
+                str(data.get("entity_id")),
+                {key: value for key, value in data.items() if key != "entity_id"} or None,
+            )
+        self.hass.services.calls.clear()
+
+    async def _async_tick(self, when: datetime.datetime) -> T.List[Decision]:
+        """Runs the control loop once, returning the decisions taken."""
+
+        decisions = []
+        if self.home is not None:
+            await self.home._async_control_heater(when)  # pylint: disable=protected-access
+        else:
+            for room in self.rooms:
+                await room.async_tick(when)
+            service = "turn_on" if any(room.demands_heat() for room in self.rooms) else "turn_off"
+            decisions.append(Decision(when, "homeassistant." + service, self.boiler, None))
+        decisions.extend(self._drain_service_calls(when))
+
+        for room in self.rooms:
+            state = (room.setpoint, room.demands_heat())
+            previous = self._room_states.get(room.name)
+            if previous is None or state[0] != previous[0]:
+                decisions.append(Decision(when, "setpoint", room.name, state[0]))
+            if previous is None or state[1] != previous[1]:
+                decisions.append(Decision(when, "heating", room.name, state[1]))
+            self._room_states[room.name] = state
+        return decisions
+
+    async def async_replay(
+        self, records: T.Iterable[HistoryRecord], until: datetime.datetime = None
+    ) -> T.AsyncIterator[Decision]:
+        """Feeds the records to the rooms, running the control loop at every
+        interval in between, and yields the decisions as they are taken.
+        After the last record, the control loop keeps running up to until,
+        which defaults to the first tick after the last record, so that the
+        last states fed are acted upon.
+        Service calls to the boiler, which the control loop repeats on every
+        tick, are only yielded when they switch it."""
+
+        next_tick = None  # type: T.Optional[datetime.datetime]
+        for record in records:
+            if next_tick is None:
+                next_tick = record.when.replace(second=0, microsecond=0)
+            while next_tick <= record.when:
+                for decision in await self._async_tick_at(next_tick):
+                    yield decision
+                next_tick += self.interval
+            await self.clock.async_advance_to(record.when)
+            await self.hass.states.async_set(record.entity_id, record.state, record.attributes)
+            for decision in self._drain_service_calls(record.when):
+                yield decision
+        if next_tick is None:
+            return
+        if until is None:
+            until = next_tick
+        while next_tick <= until:
+            for decision in await self._async_tick_at(next_tick):
+                yield decision
+            next_tick += self.interval
+
+    async def _async_tick_at(self, when: datetime.datetime) -> T.List[Decision]:
+        """Advances the clock to when and runs the control loop, returning
+        the new decisions."""
+
+        await self.clock.async_advance_to(when)
+        return [decision for decision in await self._async_tick(when) if self._is_new(decision)]
+
+    def _is_new(self, decision: Decision) -> bool:
+        """Returns False for service calls to the boiler that don't switch it."""
+
+        if decision.target != self.boiler:
+            return True
+        boiler_on = decision.kind.endswith("turn_on")
+        new = boiler_on != self._boiler_on
+        self._boiler_on = boiler_on
+        return new
+
+
+async def async_run(
+    rooms: T.List[Room],
+    boiler: str,
+    path: str,
+    output: T.TextIO,
+    home: T.Any = None,
+    clock: VirtualClock = None,
+    until: datetime.datetime = None,
+) -> int:
+    """Replays the history at path, writing the decisions to output as
+    JSON lines. Returns the number of decisions written."""
+
+    engine = ReplayEngine(rooms, boiler, home, clock=clock)
+    count = 0
+    async for decision in engine.async_replay(read_history(path, engine.entity_ids), until):
+        output.write(json.dumps(decision.as_dict()) + "\n")
+        count += 1
+    return count
+
+
+def main(argv: T.Sequence[str] = None) -> None:
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("config", help="YAML file with the platform configuration")
+    parser.add_argument("history", help="recorder database or .jsonl export")
+    parser.add_argument("--time-zone", help="time zone the schedules are in, UTC by default")
+    parser.add_argument(
+        "--until",
+        type=parse_time,
+        help="keep running the control loop up to this time, naive times are in UTC",
+    )
+    parser.add_argument(
+        "--rooms-only",
+        action="store_true",
+        help="drive the rooms without the WiserHome entity",
+    )
+    args = parser.parse_args(argv)
+
+    if args.time_zone:
+        dt_util.set_default_time_zone(dt_util.get_time_zone(args.time_zone))
+    cfg = load_platform_config(args.config)
+    boiler = cfg["boiler"]
+    rule_stats = config.intern_config(cfg)
+    rooms = config.parse_rooms(cfg)
+    clock = VirtualClock(datetime.datetime.min.replace(tzinfo=dt_util.UTC))
+    home = None
+    if not args.rooms_only:
+        from wiser_home.sensor import WiserHome  # pylint: disable=import-outside-toplevel
+
+        home = WiserHome("replay", "replay", boiler, rooms, rule_stats, clock)
+    count = asyncio.run(async_run(rooms, boiler, args.history, sys.stdout, home, clock, args.until))
+    print("{} decisions".format(count), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Replaying recorded history, see replay.
+"""
+import asyncio
+import datetime
+import io
+import json
+import sqlite3
+
+from homeassistant.util import dt as dt_util
+
+from wiser_home import schedule
+from wiser_home.room import Room, Thermostat
+
+from . import replay
+
+START = datetime.datetime(2020, 1, 6, tzinfo=dt_util.UTC)
+
+
+def _rooms():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(start_time=datetime.time(6), end_time=datetime.time(8), value=21),
+        schedule.Rule(value=16),
+    ])
+    return [Room("kitchen", [Thermostat("climate.trv", 1)], sched)]
+
+
+def _states(days=1, step=datetime.timedelta(minutes=15)):
+    when = START
+    index = 0
+    while when < START + datetime.timedelta(days=days):
+        yield when, "climate.trv", "heat", {
+            "local_temperature": 17 + index % 3, "occupied_heating_setpoint": 16, "boost": "None"}
+        yield when, "sensor.outside", "3", {}
+        when += step
+        index += 1
+
+
+def _replay(records, rooms=None, until=None):
+    async def collect():
+        engine = replay.ReplayEngine(rooms or _rooms(), "switch.boiler")
+        return [decision async for decision in engine.async_replay(records, until)]
+
+    return asyncio.run(collect())
+
+
+def test_read_jsonl():
+    lines = [
+        json.dumps({"entity_id": "climate.trv", "state": "heat", "attributes": '{"a": 1}',
+                    "last_updated_ts": START.timestamp()}),
+        "",
+        json.dumps({"entity_id": "sensor.other", "state": "1", "last_updated": "2020-01-06 00:01:00"}),
+        json.dumps({"entity_id": "climate.trv", "state": "off", "attributes": {"a": 2},
+                    "last_updated": "2020-01-06T00:02:00+00:00"}),
+    ]
+    records = list(replay.read_jsonl(lines, {"climate.trv"}))
+    assert records == [
+        replay.HistoryRecord(START, "climate.trv", "heat", {"a": 1}),
+        replay.HistoryRecord(START + datetime.timedelta(minutes=2), "climate.trv", "off", {"a": 2}),
+    ]
+
+
+def test_read_sqlite():
+    connection = sqlite3.connect(":memory:")
+    connection.executescript("""
+        CREATE TABLE states_meta (metadata_id INTEGER PRIMARY KEY, entity_id TEXT);
+        CREATE TABLE state_attributes (attributes_id INTEGER PRIMARY KEY, shared_attrs TEXT);
+        CREATE TABLE states (state_id INTEGER PRIMARY KEY, entity_id TEXT, state TEXT,
+            attributes TEXT, attributes_id INTEGER, metadata_id INTEGER, last_updated_ts REAL);
+        INSERT INTO states_meta VALUES (1, 'climate.trv'), (2, 'sensor.other');
+        INSERT INTO state_attributes VALUES (1, '{"local_temperature": 18}');
+    """)
+    connection.executemany(
+        "INSERT INTO states (state, attributes_id, metadata_id, last_updated_ts) VALUES (?, ?, ?, ?)",
+        [("off", 1, 1, START.timestamp() + 60), ("1", None, 2, START.timestamp()),
+         ("heat", None, 1, START.timestamp())],
+    )
+    records = list(replay.read_sqlite(connection, ["climate.trv"]))
+    assert records == [
+        replay.HistoryRecord(START, "climate.trv", "heat", {}),
+        replay.HistoryRecord(
+            START + datetime.timedelta(minutes=1), "climate.trv", "off", {"local_temperature": 18}),
+    ]
+
+
+def test_replay_decisions():
+    decisions = _replay(
+        replay.HistoryRecord(*state) for state in _states() if state[1] == "climate.trv")
+    changes = [(d.when.hour, d.kind, d.target, d.value) for d in decisions if d.kind != "climate.set_temperature"]
+    assert changes == [
+        (0, "homeassistant.turn_off", "switch.boiler", None),
+        (0, "setpoint", "kitchen", 16),
+        (0, "heating", "kitchen", False),
+        (6, "homeassistant.turn_on", "switch.boiler", None),
+        (6, "setpoint", "kitchen", 21),
+        (6, "heating", "kitchen", True),
+        (8, "homeassistant.turn_off", "switch.boiler", None),
+        (8, "setpoint", "kitchen", 16),
+        (8, "heating", "kitchen", False),
+    ]
+    assert any(d.kind == "climate.set_temperature" for d in decisions)
+
+
+def test_replay_ticks_until():
+    records = [replay.HistoryRecord(START, "climate.trv", "heat", {
+        "local_temperature": 17, "occupied_heating_setpoint": 16, "boost": "None"})]
+    decisions = _replay(records)
+    assert {d.when for d in decisions} == {START}
+    decisions = _replay(records, until=START + datetime.timedelta(hours=9))
+    changes = [(d.when.hour, d.kind, d.value) for d in decisions if d.kind == "setpoint"]
+    assert changes == [(0, "setpoint", 16), (6, "setpoint", 21), (8, "setpoint", 16)]
+
+
+def test_replay_ticks_after_last_record():
+    records = [
+        replay.HistoryRecord(START, "climate.trv", "heat", {
+            "local_temperature": 17, "occupied_heating_setpoint": 16, "boost": "None"}),
+        replay.HistoryRecord(START + datetime.timedelta(minutes=5, seconds=30), "climate.trv", "heat", {
+            "local_temperature": 14, "occupied_heating_setpoint": 16, "boost": "None"}),
+    ]
+    decisions = _replay(records)
+    heating = [(d.when, d.value) for d in decisions if d.kind == "heating"]
+    assert heating == [(START, False), (START + datetime.timedelta(minutes=6), True)]
+
+
+def test_replay_week_runs_fast():
+    started = datetime.datetime.now()
+    decisions = _replay(
+        replay.HistoryRecord(*state) for state in _states(days=7) if state[1] == "climate.trv")
+    assert len([d for d in decisions if d.kind == "setpoint"]) == 1 + 2 * 7
+    assert datetime.datetime.now() - started < datetime.timedelta(seconds=30)
+
+
+def test_async_run_jsonl(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text("".join(
+        json.dumps({"entity_id": entity_id, "state": state, "attributes": attributes,
+                    "last_updated_ts": when.timestamp()}) + "\n"
+        for when, entity_id, state, attributes in _states()
+    ))
+    output = io.StringIO()
+    count = asyncio.run(replay.async_run(_rooms(), "switch.boiler", str(path), output))
+    lines = output.getvalue().splitlines()
+    assert len(lines) == count
+    assert json.loads(lines[0])["kind"] == "homeassistant.turn_off"
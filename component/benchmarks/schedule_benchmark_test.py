@@ -0,0 +1,63 @@
+"""
+Benchmarks of schedule evaluation for schedules of different shapes and sizes,
+see synthetic.SHAPES.
+"""
+import glob
+import itertools
+import json
+import os
+
+import pytest
+
+from wiser_home.room import Room
+
+from . import BASELINES, synthetic
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = (5, 50)
+
+shapes = pytest.mark.parametrize("shape", sorted(synthetic.SHAPES))
+sizes = pytest.mark.parametrize("size", SIZES)
+
+
+@shapes
+@sizes
+def test_evaluate(benchmark, shape, size):
+    sched = synthetic.SHAPES[shape](size)
+    room = Room("benchmark", schedule=sched)
+    times = itertools.cycle(synthetic.datetimes(1000))
+    benchmark.group = "evaluate-{}".format(shape)
+    result = benchmark(lambda: sched.evaluate_sync(room, next(times)))
+    assert result is None or result[0] is not None
+
+
+@shapes
+@sizes
+def test_get_next_scheduling_datetime(benchmark, shape, size):
+    sched = synthetic.SHAPES[shape](size)
+    times = itertools.cycle(synthetic.datetimes(1000))
+    benchmark.group = "next-scheduling-{}".format(shape)
+    assert benchmark(lambda: sched.get_next_scheduling_datetime(next(times)))
+
+
+@shapes
+@sizes
+def test_unfolded(benchmark, shape, size):
+    benchmark.group = "unfolded-{}".format(shape)
+    paths = benchmark.pedantic(
+        lambda sched: sched.unfolded,
+        setup=lambda: ((synthetic.SHAPES[shape](size),), {}),
+        rounds=20,
+    )
+    assert paths
+
+
+def test_baselines_cover_benchmarks():
+    names = set()
+    for path in glob.glob(os.path.join(BASELINES, "*", "*.json")):
+        with open(path) as file:
+            names.update(bench["name"] for bench in json.load(file)["benchmarks"])
+    for test in ("test_evaluate", "test_get_next_scheduling_datetime", "test_unfolded"):
+        for shape, size in itertools.product(synthetic.SHAPES, SIZES):
+            assert "{}[{}-{}]".format(test, size, shape) in names
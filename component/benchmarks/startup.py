@@ -0,0 +1,179 @@
+"""
+Measures the stages of loading a configuration at start-up separately, each
+with its time and peak memory:
+
+* validate: running CONFIG_SCHEMA over the raw configuration, which includes
+  building the rules and validating the rule paths as they are interleaved
+  with the schema validation
+* build_rules: building the rules from the validated rule definitions alone
+* validate_paths: validating the rule paths of all schedules alone
+* parse_rooms: interning the rules and creating the rooms
+
+Each stage starts with an empty expression compile memo, as it would at
+start-up, rather than one warmed by the stages before.
+
+Run as a module to print a report:
+python -m benchmarks.startup [rooms] [depth] [snippets]
+"""
+import typing as T
+
+import sys
+import time
+import tracemalloc
+
+from wiser_home import config, schedule, util
+from wiser_home.const import (
+    CONF_END,
+    CONF_EXPR,
+    CONF_ROOMS,
+    CONF_RULES,
+    CONF_SCHEDULE,
+    CONF_SCH_APPEND,
+    CONF_SCH_PREPEND,
+    CONF_SCH_SNIPPETS,
+    CONF_START,
+    CONF_VALUE,
+)
+
+from . import synthetic
+
+
+STAGES = ("validate", "build_rules", "validate_paths", "parse_rooms")
+
+
+class StageReport(T.NamedTuple):
+    """Time in seconds and peak of memory allocated in bytes of one stage."""
+
+    stage: str
+    seconds: float
+    peak_bytes: int
+
+    def __str__(self) -> str:
+        return "{:<16}{:>10.1f} ms{:>10.0f} KiB".format(
+            self.stage, self.seconds * 1e3, self.peak_bytes / 1024
+        )
+
+
+def clear_compiled_expressions() -> None:
+    """Empties the process-wide memo of util.compile_expression(), so that
+    the next stage compiles its expressions again."""
+
+    util._COMPILED_EXPRESSIONS.clear()  # pylint: disable=protected-access
+
+
+def get_schedules(cfg: dict) -> T.List[schedule.Schedule]:
+    """Returns the top-level schedules of a validated configuration."""
+
+    return [
+        cfg[CONF_SCH_PREPEND],
+        cfg[CONF_SCH_APPEND],
+        *cfg[CONF_SCH_SNIPPETS].values(),
+        *(room_data[CONF_SCHEDULE] for room_data in cfg[CONF_ROOMS].values()),
+    ]
+
+
+def get_rule_definitions(cfg: dict) -> T.List[dict]:
+    """Returns definitions of all rules of a validated configuration, as
+    they are passed to config.build_schedule_rule()."""
+
+    definitions = []
+    pending = get_schedules(cfg)
+    while pending:
+        for rule in pending.pop().rules:
+            definition = dict(rule.constraints)  # type: T.Dict[str, T.Any]
+            definition[CONF_START] = (rule.start_time, rule.start_plus_days)
+            definition[CONF_END] = (rule.end_time, rule.end_plus_days)
+            if rule.expr_raw is not None:
+                definition[CONF_EXPR] = rule.expr_raw
+            # A value of a constant expression is found again by folding it
+            if rule.expr_raw is None or rule.expr is not None:
+                definition[CONF_VALUE] = rule.value
+            if isinstance(rule, schedule.SubScheduleRule):
+                definition[CONF_RULES] = rule.sub_schedule
+                pending.append(rule.sub_schedule)
+            definitions.append(definition)
+    return definitions
+
+
+def _run_stages(raw: dict, measure: T.Callable[[str, T.Callable[[], T.Any]], T.Any]) -> None:
+    """Runs all stages, passing each to measure() together with its name.
+    The compile memo is emptied before each of them."""
+
+    def measure_cold(stage: str, func: T.Callable[[], T.Any]) -> T.Any:
+        clear_compiled_expressions()
+        return measure(stage, func)
+
+    cfg = measure_cold("validate", lambda: synthetic.load_config(raw))
+
+    definitions = get_rule_definitions(cfg)
+    measure_cold(
+        "build_rules",
+        lambda: [config.build_schedule_rule(definition) for definition in definitions],
+    )
+
+    # Fresh schedules, so that no rule paths have been cached yet
+    schedules = [schedule.Schedule(rules=sched.rules) for sched in get_schedules(cfg)]
+    measure_cold(
+        "validate_paths",
+        lambda: [config.validate_rule_paths(sched) for sched in schedules],
+    )
+
+    def parse_rooms() -> T.Any:
+        config.intern_config(cfg)
+        return config.parse_rooms(cfg)
+
+    measure_cold("parse_rooms", parse_rooms)
+
+
+def time_stages(raw: dict) -> T.Dict[str, float]:
+    """Returns the time in seconds each stage takes for the given raw
+    configuration."""
+
+    times = {}  # type: T.Dict[str, float]
+
+    def measure(stage: str, func: T.Callable[[], T.Any]) -> T.Any:
+        started = time.perf_counter()
+        result = func()
+        times[stage] = time.perf_counter() - started
+        return result
+
+    _run_stages(raw, measure)
+    return times
+
+
+def trace_stages(raw: dict) -> T.Dict[str, int]:
+    """Returns the peak of memory allocated during each stage in bytes.
+    This is a separate run, since tracing allocations slows down everything."""
+
+    peaks = {}  # type: T.Dict[str, int]
+
+    def measure(stage: str, func: T.Callable[[], T.Any]) -> T.Any:
+        tracemalloc.start()
+        try:
+            result = func()
+            peaks[stage] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return result
+
+    _run_stages(raw, measure)
+    return peaks
+
+
+def profile_startup(raw: dict, rounds: int = 5) -> T.List[StageReport]:
+    """Returns a report for each stage, with the best time of the given
+    number of rounds."""
+
+    best = {}  # type: T.Dict[str, float]
+    for _ in range(rounds):
+        for stage, seconds in time_stages(raw).items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+    peaks = trace_stages(raw)
+    return [StageReport(stage, best[stage], peaks[stage]) for stage in STAGES]
+
+
+if __name__ == "__main__":
+    RAW = synthetic.build_large_config(*(int(arg) for arg in sys.argv[1:4]))
+    print("{} bytes of YAML".format(len(synthetic.to_yaml(RAW))))
+    for REPORT in profile_startup(RAW):
+        print(REPORT)
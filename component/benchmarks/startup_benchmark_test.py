@@ -0,0 +1,81 @@
+"""
+Time of the start-up stages for a large synthetic configuration, see startup.
+"""
+from wiser_home import config, schedule
+
+import pytest
+
+from . import startup, synthetic
+
+pytest.importorskip("pytest_benchmark")
+
+RAW = synthetic.build_large_config(rooms=50, depth=3, snippets=10)
+
+
+@pytest.fixture(scope="module")
+def peaks():
+    return startup.trace_stages(RAW)
+
+
+def _cold(setup):
+    """Wraps a pedantic setup function, so that each round starts with an
+    empty compile memo."""
+
+    def wrapped():
+        args = setup()
+        startup.clear_compiled_expressions()
+        return args
+
+    return wrapped
+
+
+def _fresh_config():
+    return (synthetic.load_config(RAW),), {}
+
+
+def _parse_rooms(cfg):
+    config.intern_config(cfg)
+    return config.parse_rooms(cfg)
+
+
+def test_validate(benchmark, peaks):
+    benchmark.group = "startup"
+    benchmark.extra_info["peak_bytes"] = peaks["validate"]
+    cfg = benchmark.pedantic(
+        synthetic.load_config, setup=_cold(lambda: ((RAW,), {})), rounds=5
+    )
+    assert len(cfg["rooms"]) == 50
+
+
+def test_build_rules(benchmark, peaks):
+    benchmark.group = "startup"
+    benchmark.extra_info["peak_bytes"] = peaks["build_rules"]
+    definitions = startup.get_rule_definitions(synthetic.load_config(RAW))
+    rules = benchmark.pedantic(
+        lambda: [config.build_schedule_rule(d) for d in definitions],
+        setup=_cold(lambda: None),
+        rounds=10,
+    )
+    assert len(rules) == len(definitions)
+
+
+def test_validate_paths(benchmark, peaks):
+    benchmark.group = "startup"
+    benchmark.extra_info["peak_bytes"] = peaks["validate_paths"]
+    schedules = startup.get_schedules(synthetic.load_config(RAW))
+
+    def setup():
+        return ([schedule.Schedule(rules=sched.rules) for sched in schedules],), {}
+
+    benchmark.pedantic(
+        lambda fresh: [config.validate_rule_paths(sched) for sched in fresh],
+        setup=_cold(setup),
+        rounds=10,
+    )
+
+
+def test_parse_rooms(benchmark, peaks):
+    benchmark.group = "startup"
+    benchmark.extra_info["peak_bytes"] = peaks["parse_rooms"]
+    rooms = benchmark.pedantic(_parse_rooms, setup=_cold(_fresh_config), rounds=5)
+    assert len(rooms) == 50
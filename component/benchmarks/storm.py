@@ -0,0 +1,119 @@
+"""
+Drives storms of synthetic valve state changes through rooms connected to a
+FakeHass and reports the throughput.
+Run as a module to print a report: python -m benchmarks.storm [rooms] [valves] [events]
+"""
+import typing as T
+
+import asyncio
+import random
+import sys
+import time
+
+from wiser_home import schedule
+from wiser_home.room import Room, Thermostat
+
+from .fake_hass import FakeHass
+
+
+class StormReport(T.NamedTuple):
+    """Results of a valve event storm. Latencies are in seconds."""
+
+    events: int
+    seconds: float
+    service_calls: int
+    p50: float
+    p99: float
+
+    @property
+    def events_per_second(self) -> float:
+        return self.events / self.seconds
+
+    @property
+    def calls_per_event(self) -> float:
+        return self.service_calls / self.events
+
+    def __str__(self) -> str:
+        return (
+            "{} events in {:.3f}s: {:.0f} events/s, {:.3f} service calls/event, "
+            "latency p50 {:.1f}us, p99 {:.1f}us".format(
+                self.events,
+                self.seconds,
+                self.events_per_second,
+                self.calls_per_event,
+                self.p50 * 1e6,
+                self.p99 * 1e6,
+            )
+        )
+
+
+def percentile(values: T.Sequence[float], fraction: float) -> float:
+    """Returns the value below which the given fraction of values lies."""
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def build_rooms(hass: FakeHass, rooms: int, valves_per_room: int) -> T.List[Room]:
+    """Creates rooms with the given number of valves each, tracking the
+    valves' states through hass."""
+
+    built = []
+    for room_index in range(rooms):
+        valves = [
+            Thermostat("climate.trv_{}_{}".format(room_index, index), 1)
+            for index in range(valves_per_room)
+        ]
+        room = Room("room_{}".format(room_index), valves, schedule.Schedule())
+        hass.attach_room(room)
+        built.append(room)
+    return built
+
+
+async def async_run_storm(
+    rooms: int = 20, valves_per_room: int = 10, events: int = 5000, seed: int = 0
+) -> StormReport:
+    """Sends the given number of state changes of random valves, with
+    changing temperatures and set-points, and measures their handling."""
+
+    rnd = random.Random(seed)
+    hass = FakeHass()
+    built = build_rooms(hass, rooms, valves_per_room)
+    entity_ids = list(hass.trackers)
+    for entity_id in entity_ids:
+        await hass.states.async_set(entity_id, "heat", {
+            "local_temperature": 20, "occupied_heating_setpoint": 20, "boost": "None"})
+    hass.services.calls.clear()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(events):
+        entity_id = rnd.choice(entity_ids)
+        attributes = {
+            "local_temperature": round(rnd.uniform(15, 24), 1),
+            "occupied_heating_setpoint": rnd.choice((20, 20, 20, 21)),
+            "boost": "None",
+        }
+        before = time.perf_counter()
+        await hass.states.async_set(entity_id, "heat", attributes)
+        latencies.append(time.perf_counter() - before)
+    seconds = time.perf_counter() - started
+
+    assert len(built) == rooms
+    return StormReport(
+        events=events,
+        seconds=seconds,
+        service_calls=len(hass.services.calls),
+        p50=percentile(latencies, 0.5),
+        p99=percentile(latencies, 0.99),
+    )
+
+
+def run_storm(*args: T.Any, **kwargs: T.Any) -> StormReport:
+    """Runs async_run_storm() in a new event loop."""
+
+    return asyncio.run(async_run_storm(*args, **kwargs))
+
+
+if __name__ == "__main__":
+    print(run_storm(*(int(arg) for arg in sys.argv[1:4])))
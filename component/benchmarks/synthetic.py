@@ -0,0 +1,300 @@
+"""
+Generates synthetic Wiser Home configurations of arbitrary size, shaped like
+real ones: shared snippets, a prepended override, and per-room schedules with
+weekday/weekend variants, nested rules and a few expressions.
+Schedules of specific shapes can be generated as well, see SHAPES.
+"""
+import typing as T
+
+import datetime
+import random
+
+import voluptuous as vol
+
+from wiser_home import config, expression, schedule, util
+from wiser_home.room import Room
+from wiser_home.util import RangingSet
+
+
+def _hhmm(minutes: int) -> str:
+    return "{:02d}:{:02d}".format(minutes // 60 % 24, minutes % 60)
+
+
+def _day_rules(rnd: random.Random, comfort: float, eco: float) -> T.List[dict]:
+    """Returns rules for a morning and an evening heating period."""
+
+    morning = rnd.choice(range(5 * 60, 8 * 60, 15))
+    evening = rnd.choice(range(16 * 60, 19 * 60, 15))
+    return [
+        {"start": _hhmm(morning), "end": _hhmm(morning + 150), "value": comfort},
+        {"start": _hhmm(evening), "end": _hhmm(evening + 300), "value": comfort + 1},
+        {"value": eco},
+    ]
+
+
+def build_raw_config(
+    rooms: int = 100, seed: int = 0, valves_per_room: int = None, prefix: str = "room"
+) -> dict:
+    """Returns an unvalidated configuration with the given number of rooms,
+    as it would be read from configuration.yaml. Rooms have one or two
+    valves unless valves_per_room is given. Valve entity ids start with
+    climate.<prefix>, so that those of several configs can be told apart."""
+
+    rnd = random.Random(seed)
+    snippets = {
+        "workday": _day_rules(rnd, 20, 16),
+        "weekend": _day_rules(rnd, 21, 17),
+        "holidays": [
+            {"months": "12", "days": "24-31", "value": 21},
+            {"months": "1", "days": "1-6", "value": 21},
+        ],
+    }
+    raw_rooms = {}
+    for index in range(rooms):
+        rules = []  # type: T.List[dict]
+        kind = rnd.randrange(4)
+        if kind == 0:
+            # Rooms following the shared snippets
+            rules.append({"weekdays": "1-5", "rules": snippets["workday"]})
+            rules.append({"weekdays": "6-7", "rules": snippets["weekend"]})
+        elif kind == 1:
+            # Rooms with an individual schedule
+            rules.append({"weekdays": "1-5", "rules": _day_rules(rnd, 20, 15)})
+            rules.append({"rules": _day_rules(rnd, 21, 16)})
+        elif kind == 2:
+            # Rooms with a bit of everything
+            rules.append({"rules": snippets["holidays"]})
+            rules.append({
+                "weeks": "*/2",
+                "rules": [
+                    {"weekdays": "1-5", "rules": _day_rules(rnd, 19, 15)},
+                    {"rules": snippets["weekend"]},
+                ],
+            })
+            rules.append({"rules": snippets["workday"]})
+        else:
+            # Rooms using expressions
+            rules.append({
+                "start": "22:00",
+                "end": "06:00",
+                "expression": "Add(-1) if date.month in (12, 1, 2) else Next()",
+            })
+            rules.append({"expression": "18 if now.hour < 12 else 19"})
+        valves = 1 + rnd.randrange(2)
+        raw_rooms["room_{}".format(index)] = {
+            "thermostat": [
+                {"entity_id": "climate.{}_{}_{}".format(prefix, index, therm)}
+                for therm in range(valves if valves_per_room is None else valves_per_room)
+            ],
+            "schedule": rules,
+        }
+
+    return {
+        "boiler": "switch.boiler",
+        "unique_id": "synthetic",
+        "rooms": raw_rooms,
+        "schedule_prepend": [{"years": "1970", "value": "OFF"}],
+        "schedule_snippets": snippets,
+    }
+
+
+def _nested_rules(rnd: random.Random, depth: int, snippet_names: T.Sequence[str]) -> T.List[dict]:
+    """Returns rules nested depth levels deep, every level restricted by some
+    date constraint and including a snippet now and then."""
+
+    if depth <= 0:
+        return _day_rules(rnd, rnd.choice((19, 20, 21)), rnd.choice((15, 16)))
+    rules = [
+        {
+            "weekdays": rnd.choice(("1-5", "6,7", "1-3,5")),
+            "rules": _nested_rules(rnd, depth - 1, snippet_names),
+        },
+        {
+            "months": rnd.choice(("1-3,10-12", "4-9", "*/2")),
+            "days": rnd.choice(("1-15", "16-31", "*")),
+            "start": "{}-1d".format(_hhmm(rnd.randrange(20 * 60, 24 * 60, 15))),
+            "end": "{}+1d".format(_hhmm(rnd.randrange(0, 6 * 60, 15))),
+            "rules": _nested_rules(rnd, depth - 1, snippet_names),
+        },
+    ]
+    if snippet_names:
+        rules.append({
+            "x": 'IncludeSchedule(schedule_snippets["{}"])'.format(rnd.choice(snippet_names)),
+        })
+    return rules
+
+
+def build_large_config(
+    rooms: int = 100, depth: int = 3, snippets: int = 20, seed: int = 0
+) -> dict:
+    """Returns an unvalidated configuration with the given number of rooms,
+    whose schedules are nested depth levels deep and include some of the
+    given number of schedule snippets, which are nested as well."""
+
+    rnd = random.Random(seed)
+    snippet_names = ["snippet_{}".format(index) for index in range(snippets)]
+    raw_snippets = {
+        name: _nested_rules(rnd, depth - 1, ()) for name in snippet_names
+    }
+    raw_rooms = {}
+    for index in range(rooms):
+        raw_rooms["room_{}".format(index)] = {
+            "thermostat": [
+                {"entity_id": "climate.room_{}_{}".format(index, therm), "weight": 1}
+                for therm in range(1 + rnd.randrange(3))
+            ],
+            "schedule": _nested_rules(rnd, depth, snippet_names) + [{"v": 16}],
+        }
+
+    return {
+        "boiler": "switch.boiler",
+        "unique_id": "synthetic",
+        "rooms": raw_rooms,
+        "schedule_prepend": [
+            {"years": "1970", "value": "OFF"},
+            {"start_date": {"month": 12, "day": 24}, "end_date": {"month": 1, "day": 6}, "v": 21},
+        ],
+        "schedule_append": [{"value": 16}],
+        "schedule_snippets": raw_snippets,
+    }
+
+
+def to_yaml(raw: dict) -> str:
+    """Dumps a raw configuration as it would appear in configuration.yaml."""
+
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    return yaml.safe_dump({"climate": [dict(platform="wiser_home", **raw)]}, sort_keys=False)
+
+
+def load_config(raw: dict) -> dict:
+    """Validates a raw configuration like the platform schema does."""
+
+    return vol.Schema(config.CONFIG_SCHEMA)(raw)
+
+
+def build_rooms(rooms: int = 100, seed: int = 0, **kwargs: T.Any) -> T.List[Room]:
+    """Builds the rooms of a synthetic configuration the way the platform
+    set-up does. Further arguments are passed to build_raw_config()."""
+
+    cfg = load_config(build_raw_config(rooms, seed, **kwargs))
+    config.intern_config(cfg)
+    return config.parse_rooms(cfg)
+
+
+def _time(minutes: int) -> datetime.time:
+    return datetime.time(minutes // 60 % 24, minutes % 60)
+
+
+def _period_rule(rnd: random.Random, value: T.Any, **kwargs: T.Any) -> schedule.Rule:
+    start = rnd.randrange(0, 24 * 60, 15)
+    return schedule.Rule(
+        start_time=_time(start),
+        end_time=_time(start + rnd.randrange(30, 6 * 60, 15)),
+        value=value,
+        **kwargs
+    )
+
+
+def _expr_rule(expr_raw: str, **kwargs: T.Any) -> schedule.Rule:
+    return schedule.Rule(expr=util.compile_expression(expr_raw), expr_raw=expr_raw, **kwargs)
+
+
+def flat_schedule(size: int, seed: int = 0) -> schedule.Schedule:
+    """A list of time periods with values, followed by a fallback value."""
+
+    rnd = random.Random(seed)
+    rules = [_period_rule(rnd, rnd.choice((18, 19, 20, 21))) for _ in range(size)]
+    rules.append(schedule.Rule(value=16))
+    return schedule.Schedule(name="flat", rules=rules)
+
+
+def nested_schedule(size: int, seed: int = 0) -> schedule.Schedule:
+    """Sub-schedules nested size levels deep, each level with a period of
+    its own, the innermost one providing the values."""
+
+    rnd = random.Random(seed)
+    sched = schedule.Schedule(rules=[_period_rule(rnd, 21), schedule.Rule(value=18)])
+    for _ in range(size):
+        sched = schedule.Schedule(rules=[
+            schedule.SubScheduleRule(sched),
+            _period_rule(rnd, 17),
+        ])
+    sched.rules += (schedule.Rule(value=16),)
+    sched.name = "nested"
+    return sched
+
+
+def constrained_schedule(size: int, seed: int = 0) -> schedule.Schedule:
+    """Periods restricted by all kinds of date constraints."""
+
+    rnd = random.Random(seed)
+    rules = []  # type: T.List[schedule.Rule]
+    for _ in range(size):
+        constraints = {
+            "weekdays": RangingSet(rnd.sample(range(1, 8), rnd.randint(1, 6))),
+            "months": RangingSet(rnd.sample(range(1, 13), rnd.randint(3, 11))),
+            "days": RangingSet(rnd.sample(range(1, 32), rnd.randint(10, 30))),
+        }
+        if rnd.random() < 0.3:
+            constraints["weeks"] = util.expand_range_spec("*/2", 1, 53)
+        if rnd.random() < 0.3:
+            constraints["start_date"] = {"month": rnd.randint(1, 12), "day": 1}
+            constraints["end_date"] = {"month": rnd.randint(1, 12), "day": 28}
+        rules.append(_period_rule(rnd, rnd.choice((18, 19, 20, 21)), constraints=constraints))
+    rules.append(schedule.Rule(value=16))
+    return schedule.Schedule(name="constrained", rules=rules)
+
+
+def control_schedule(size: int, seed: int = 0) -> schedule.Schedule:
+    """Sub-schedules using Break(), Inherit() and IncludeSchedule()."""
+
+    rnd = random.Random(seed)
+    included = flat_schedule(3, seed)
+    rules = []  # type: T.List[schedule.Rule]
+    for _ in range(size):
+        sub = schedule.Schedule(rules=[
+            _expr_rule("Break() if now.minute < 20 else Next()"),
+            _period_rule(rnd, expression.types.Inherit()),
+            _period_rule(rnd, expression.types.IncludeSchedule(included)),
+            _expr_rule("Next()"),
+        ])
+        rules.append(schedule.SubScheduleRule(sub, value=rnd.choice((18, 20))))
+    rules.append(schedule.Rule(value=16))
+    return schedule.Schedule(name="control", rules=rules)
+
+
+def postprocessor_schedule(size: int, seed: int = 0) -> schedule.Schedule:
+    """Chains of postprocessors in front of the values."""
+
+    rnd = random.Random(seed)
+    rules = []  # type: T.List[schedule.Rule]
+    for index in range(size):
+        if index % 3 == 0:
+            rules.append(_period_rule(rnd, expression.types.Multiply(1.01)))
+        elif index % 3 == 1:
+            rules.append(_period_rule(rnd, expression.types.Add(0.5)))
+        else:
+            rules.append(_expr_rule("Add(-0.5) if now.hour < 6 else Next()"))
+    rules.append(schedule.Rule(value=18))
+    return schedule.Schedule(name="postprocessor", rules=rules)
+
+
+SHAPES = {
+    "flat": flat_schedule,
+    "nested": nested_schedule,
+    "constrained": constrained_schedule,
+    "control": control_schedule,
+    "postprocessor": postprocessor_schedule,
+}  # type: T.Dict[str, T.Callable[..., schedule.Schedule]]
+
+
+def datetimes(count: int, seed: int = 0) -> T.List[datetime.datetime]:
+    """Returns random points in time, spread over a year."""
+
+    rnd = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    return [
+        start + datetime.timedelta(minutes=rnd.randrange(366 * 24 * 60))
+        for _ in range(count)
+    ]
@@ -0,0 +1,47 @@
+"""
+Throughput of valve event handling, driven through a FakeHass, see storm.
+"""
+from homeassistant.core import State
+
+from wiser_home.const import VALVE_EVENTS_THROTTLE
+from wiser_home.room import Valves
+
+import pytest
+
+from . import storm
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.mark.parametrize("rooms,valves_per_room", [(10, 2), (20, 10), (50, 10)])
+def test_valve_event_storm(benchmark, rooms, valves_per_room):
+    benchmark.group = "valve-storm"
+    report = benchmark.pedantic(
+        storm.run_storm, args=(rooms, valves_per_room, 2000), rounds=3)
+    benchmark.extra_info.update(
+        events_per_second=report.events_per_second,
+        calls_per_event=report.calls_per_event,
+        p50_us=report.p50 * 1e6,
+        p99_us=report.p99 * 1e6,
+    )
+    assert 0 < report.calls_per_event <= 1 / VALVE_EVENTS_THROTTLE + 0.05
+
+
+def test_valves_update_state(benchmark):
+    valves = Valves({"climate.trv_{}".format(index): 1 for index in range(300)})
+    states = [
+        ("climate.trv_{}".format(index % 300), State("climate.trv", "heat", {
+            "local_temperature": 15 + index % 10,
+            "occupied_heating_setpoint": 20,
+            "boost": "None",
+        }))
+        for index in range(1000)
+    ]
+    benchmark.group = "valve-update"
+
+    def update_all():
+        for entity_id, state in states:
+            valves.update_state(entity_id, state)
+
+    benchmark(update_all)
+    assert 15 <= valves.room_temp <= 25
@@ -0,0 +1,64 @@
+"""
+Helpers shared by the tests, kept out of the wiser_home package so that they
+aren't shipped with it: random schedules, for comparing the ways of
+evaluating them, and a room that is just enough for evaluating them.
+"""
+import datetime
+import logging
+import random
+
+from wiser_home import schedule
+from wiser_home.util import RangingSet, RateLimitedLogger
+
+
+class Room:
+    """A room accepting any value, for evaluating schedules without one."""
+
+    def __init__(self):
+        self.log_limited = RateLimitedLogger(logging.getLogger(__name__))
+
+    def validate_value(self, value):
+        return value
+
+
+def random_time(rnd):
+    if rnd.random() < 0.3:
+        return None
+    return datetime.time(rnd.randrange(24), rnd.choice((0, 15, 30, 45)))
+
+
+def random_constraints(rnd):
+    constraints = {}
+    if rnd.random() < 0.4:
+        constraints["weekdays"] = RangingSet(rnd.sample(range(1, 8), rnd.randint(1, 6)))
+    if rnd.random() < 0.2:
+        constraints["months"] = RangingSet(rnd.sample(range(1, 13), rnd.randint(1, 11)))
+    if rnd.random() < 0.2:
+        constraints["days"] = RangingSet(rnd.sample(range(1, 32), rnd.randint(5, 30)))
+    return constraints
+
+
+def random_rules(rnd, depth):
+    rules = []
+    for _ in range(rnd.randint(1, 4)):
+        kwargs = dict(
+            start_time=random_time(rnd),
+            end_time=random_time(rnd),
+            end_plus_days=rnd.choice((None, None, None, 1, 2)),
+            start_plus_days=rnd.choice((None, None, None, -1, 1)),
+            constraints=random_constraints(rnd),
+        )
+        if depth < 3 and rnd.random() < 0.3:
+            sub = schedule.Schedule(rules=random_rules(rnd, depth + 1))
+            value = rnd.choice((None, 17))
+            rules.append(schedule.SubScheduleRule(sub, value=value, **kwargs))
+        else:
+            rules.append(schedule.Rule(value=rnd.choice((16, 18, 20, 21, "OFF")), **kwargs))
+    return rules
+
+
+def random_schedule(seed):
+    rnd = random.Random(seed)
+    rules = random_rules(rnd, 0)
+    rules.append(schedule.Rule(value=5))
+    return schedule.Schedule(name=str(seed), rules=rules)
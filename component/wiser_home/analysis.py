@@ -0,0 +1,78 @@
+"""
+This module finds rule paths of a schedule that can never provide a result.
+A path is dead when its constraints can't all be fulfilled on any date, or
+when it's preceded by a path that always provides a plain value, as long as
+no path before could skip that one by breaking out of its sub-schedule.
+Dead paths are left out when evaluating the schedule, see Schedule.reachable.
+"""
+import typing as T
+
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    from .schedule import RulePath, Schedule
+
+import functools
+import operator
+
+from . import codegen, expression
+
+# Maximum number of days per month, including February 29th
+MONTH_DAYS = (31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# Constraints whose values are sets of allowed numbers
+SET_CONSTRAINTS = ("years", "months", "days", "weeks", "weekdays")
+
+
+def can_be_fulfilled(path: "RulePath") -> bool:
+    """Returns whether the constraints of all rules along the given path
+    can be fulfilled on the same date. This is a conservative check, the
+    start_date and end_date constraints aren't considered."""
+
+    allowed = {}  # type: T.Dict[str, T.AbstractSet[int]]
+    for name in SET_CONSTRAINTS:
+        values = [
+            rule.constraints[name] for rule in path.rules if name in rule.constraints
+        ]
+        if values:
+            allowed[name] = functools.reduce(operator.and_, values)
+            if not allowed[name]:
+                return False
+
+    months = allowed.get("months")
+    days = allowed.get("days")
+    if months is not None and days is not None:
+        return any(
+            day <= MONTH_DAYS[month - 1]
+            for month in months
+            if 1 <= month <= 12
+            for day in days
+        )
+    return True
+
+
+def find_dead_paths(schedule: "Schedule") -> T.List[T.Tuple["RulePath", str]]:
+    """Returns the paths of the given schedule that can never provide a
+    result when evaluating it, each together with the reason."""
+
+    dead = []  # type: T.List[T.Tuple[RulePath, str]]
+    shadowed_by = None  # type: T.Optional[RulePath]
+    # Whether an earlier path may return a control result like Break(),
+    # which could skip a path that would otherwise always win
+    may_skip = False
+    for path in schedule.unfolded:
+        if shadowed_by is not None:
+            dead.append((path, "shadowed by {}".format(shadowed_by)))
+            continue
+        if not can_be_fulfilled(path):
+            dead.append((path, "constraints can't be fulfilled"))
+            continue
+        if not path.is_final:
+            continue
+        rules = path.rules_with_expr_or_value
+        value = rules[-1].value if rules and rules[-1].expr is None else None
+        if codegen.is_plain_value(value):
+            if path.is_always_active and not may_skip:
+                shadowed_by = path
+        elif not isinstance(value, expression.types.Postprocessor):
+            may_skip = True
+    return dead
@@ -0,0 +1,59 @@
+import datetime
+
+from . import analysis, expression, schedule, util
+from .schedule_test import Room
+from .util import RangingSet
+
+
+def dead_rules(sched):
+    return [path.rules[-1] for path, _ in analysis.find_dead_paths(sched)]
+
+
+def test_rules_after_all_day_value_are_dead():
+    fallback = schedule.Rule(value=16)
+    late = schedule.Rule(value=20, start_time=datetime.time(6, 0), end_time=datetime.time(8, 0))
+    sub = schedule.SubScheduleRule(schedule.Schedule(rules=[schedule.Rule(value=18)]))
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(value=21, constraints={"weekdays": RangingSet({6, 7})}),
+        fallback,
+        late,
+        sub,
+    ])
+    assert dead_rules(sched) == [late, sub, sub.sub_schedule.rules[0]]
+    assert [path.rules[-1] for path in sched.reachable] == list(sched.rules[:2])
+    assert len(sched.unfolded) == 5
+
+
+def test_unsatisfiable_constraints_are_dead():
+    sub = schedule.Schedule(rules=[
+        schedule.Rule(value=20, constraints={"days": RangingSet({30, 31})}),
+        schedule.Rule(value=18, constraints={"days": RangingSet({29})}),
+        schedule.Rule(value=17, constraints={"weekdays": RangingSet({1})}),
+    ])
+    sched = schedule.Schedule(rules=[
+        schedule.SubScheduleRule(sub, constraints={
+            "months": RangingSet({2}), "weekdays": RangingSet({2, 3})}),
+        schedule.Rule(value=16),
+    ])
+    assert dead_rules(sched) == [sub.rules[0], sub.rules[2]]
+
+
+def test_no_shadowing_after_possible_break():
+    sched = schedule.Schedule(rules=[
+        schedule.SubScheduleRule(schedule.Schedule(rules=[
+            schedule.Rule(expr=util.compile_expression("Break()"), expr_raw="Break()"),
+            schedule.Rule(value=20),
+        ])),
+        schedule.Rule(value=16),
+    ])
+    assert dead_rules(sched) == []
+    assert sched.evaluate_sync(Room(), datetime.datetime(2020, 6, 1, 7, 0))[0] == 16
+
+
+def test_postprocessor_before_all_day_value_still_shadows():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(value=expression.types.Add(1)),
+        schedule.Rule(value=16),
+        schedule.Rule(value=20),
+    ])
+    assert dead_rules(sched) == [sched.rules[2]]
@@ -0,0 +1,140 @@
+"""
+This module provides the time to rooms and the WiserHome entity, and runs
+their timers. Clock is the real time, with timers run by Home Assistant.
+VirtualClock is advanced explicitly, running the timers that became due on
+the way without waiting, so that simulations and tests can run days of
+scheduled behaviour in milliseconds, deterministically.
+
+Clock gives aware times in Home Assistant's time zone. A VirtualClock gives
+times like the one it was started at, naive times are taken to be in Home
+Assistant's time zone by rooms and the HouseScheduler.
+"""
+import typing as T
+
+import datetime
+import heapq
+import itertools
+
+from homeassistant.helpers.event import async_track_point_in_time, async_track_time_interval
+from homeassistant.util import dt as dt_util
+
+TimerAction = T.Callable[[datetime.datetime], T.Awaitable[None]]
+
+
+class Clock:
+    """The real time. Timers are run by Home Assistant."""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "<Clock>"
+
+    def now(self) -> datetime.datetime:
+        """Returns the current time in Home Assistant's time zone."""
+
+        return dt_util.now()
+
+    def track_time_interval(
+        self, hass: T.Any, action: TimerAction, interval: datetime.timedelta
+    ) -> T.Callable[[], None]:
+        """Calls action every interval from now on, like
+        homeassistant.helpers.event.async_track_time_interval() does.
+        Returns a function cancelling the timer."""
+
+        return async_track_time_interval(hass, action, interval)
+
+    def track_point_in_time(
+        self, hass: T.Any, action: TimerAction, when: datetime.datetime
+    ) -> T.Callable[[], None]:
+        """Calls action once at the given time, or as soon as possible if it
+        has passed, like homeassistant.helpers.event.async_track_point_in_time()
+        does. Returns a function cancelling the timer."""
+
+        return async_track_point_in_time(hass, action, when)
+
+
+# Clock used unless another one is given
+SYSTEM_CLOCK = Clock()
+
+
+class _Timer:
+    """A timer of a VirtualClock, cancelled by calling it. Timers without
+    an interval only run once."""
+
+    __slots__ = ("action", "interval", "cancelled")
+
+    def __init__(self, action: TimerAction, interval: T.Optional[datetime.timedelta]) -> None:
+        self.action = action
+        self.interval = interval
+        self.cancelled = False
+
+    def __call__(self) -> None:
+        self.cancelled = True
+
+
+class VirtualClock(Clock):
+    """A clock that only advances when told to. Timers becoming due on the
+    way are run in the order of their due times, with the clock set to
+    these times."""
+
+    __slots__ = ("_now", "_timers", "_counter")
+
+    def __init__(self, start: datetime.datetime) -> None:
+        self._now = start
+        # (due, sequence number, timer), the sequence number keeps timers due
+        # at the same time in the order they were started
+        self._timers = []  # type: T.List[T.Tuple[datetime.datetime, int, _Timer]]
+        self._counter = itertools.count()
+
+    def __repr__(self) -> str:
+        return "<VirtualClock at {}>".format(self._now)
+
+    def now(self) -> datetime.datetime:
+        return self._now
+
+    def track_time_interval(
+        self, hass: T.Any, action: TimerAction, interval: datetime.timedelta
+    ) -> T.Callable[[], None]:
+        if interval <= datetime.timedelta(0):
+            raise ValueError("interval must be positive, not {!r}".format(interval))
+        timer = _Timer(action, interval)
+        heapq.heappush(self._timers, (self._now + interval, next(self._counter), timer))
+        return timer
+
+    def track_point_in_time(
+        self, hass: T.Any, action: TimerAction, when: datetime.datetime
+    ) -> T.Callable[[], None]:
+        timer = _Timer(action, None)
+        heapq.heappush(self._timers, (max(self._now, when), next(self._counter), timer))
+        return timer
+
+    @property
+    def next_due(self) -> T.Optional[datetime.datetime]:
+        """The time the next timer is due at, None if there is none."""
+
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        return self._timers[0][0] if self._timers else None
+
+    async def async_advance_to(self, until: datetime.datetime) -> int:
+        """Advances the clock to the given time, running all timers due
+        until then, including it. Returns the number of timer calls."""
+
+        calls = 0
+        while True:
+            due = self.next_due
+            if due is None or due > until:
+                break
+            _, _, timer = heapq.heappop(self._timers)
+            self._now = max(self._now, due)
+            if timer.interval is not None:
+                heapq.heappush(self._timers, (due + timer.interval, next(self._counter), timer))
+            await timer.action(self._now)
+            calls += 1
+        self._now = max(self._now, until)
+        return calls
+
+    async def async_advance(self, delta: datetime.timedelta) -> int:
+        """Advances the clock by the given time, see async_advance_to()."""
+
+        return await self.async_advance_to(self._now + delta)
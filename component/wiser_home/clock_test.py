@@ -0,0 +1,93 @@
+import datetime
+
+import pytest
+
+from homeassistant.util import dt as dt_util
+
+from .clock import SYSTEM_CLOCK, VirtualClock
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def _recorder(calls, name):
+    async def action(now):
+        calls.append((name, now))
+    return action
+
+
+def test_system_clock_in_home_assistant_time_zone():
+    assert SYSTEM_CLOCK.now().tzinfo is dt_util.DEFAULT_TIME_ZONE
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_advance():
+    clock = VirtualClock(START)
+    assert clock.now() == START
+    assert await clock.async_advance(datetime.timedelta(days=2)) == 0
+    assert clock.now() == START + datetime.timedelta(days=2)
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_timers_in_order():
+    clock = VirtualClock(START)
+    calls = []
+    clock.track_time_interval(None, _recorder(calls, "hourly"), datetime.timedelta(hours=1))
+    clock.track_time_interval(None, _recorder(calls, "half"), datetime.timedelta(minutes=30))
+    assert clock.next_due == START + datetime.timedelta(minutes=30)
+    assert await clock.async_advance(datetime.timedelta(hours=1)) == 3
+    assert calls == [
+        ("half", START + datetime.timedelta(minutes=30)),
+        ("hourly", START + datetime.timedelta(hours=1)),
+        ("half", START + datetime.timedelta(hours=1)),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_cancel():
+    clock = VirtualClock(START)
+    calls = []
+    remove = clock.track_time_interval(None, _recorder(calls, "a"), datetime.timedelta(minutes=1))
+    await clock.async_advance(datetime.timedelta(minutes=2))
+    remove()
+    await clock.async_advance(datetime.timedelta(minutes=2))
+    assert len(calls) == 2
+    assert clock.next_due is None
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_cancel_from_action():
+    clock = VirtualClock(START)
+    calls = []
+
+    async def once(now):
+        calls.append(now)
+        remove()
+
+    remove = clock.track_time_interval(None, once, datetime.timedelta(hours=1))
+    await clock.async_advance(datetime.timedelta(days=1))
+    assert calls == [START + datetime.timedelta(hours=1)]
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_days_quickly():
+    clock = VirtualClock(START)
+    calls = []
+    clock.track_time_interval(None, _recorder(calls, "tick"), datetime.timedelta(minutes=1))
+    assert await clock.async_advance(datetime.timedelta(days=7)) == 7 * 24 * 60
+    assert calls[-1] == ("tick", START + datetime.timedelta(days=7))
+
+
+def test_virtual_clock_rejects_empty_interval():
+    with pytest.raises(ValueError):
+        VirtualClock(START).track_time_interval(None, None, datetime.timedelta(0))
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_point_in_time():
+    clock = VirtualClock(START)
+    calls = []
+    clock.track_point_in_time(None, _recorder(calls, "once"), START + datetime.timedelta(minutes=5))
+    clock.track_point_in_time(None, _recorder(calls, "past"), START - datetime.timedelta(minutes=5))
+    assert await clock.async_advance(datetime.timedelta(hours=1)) == 2
+    assert calls == [("past", START), ("once", START + datetime.timedelta(minutes=5))]
+    assert clock.next_due is None
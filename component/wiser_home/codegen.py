@@ -0,0 +1,162 @@
+"""
+This module compiles schedules into Python functions.
+Evaluating a schedule means checking its rule paths one after the other until
+an active one provides a value. For schedules whose paths all end in plain
+values, that is just a sequence of time and constraint checks, which is
+generated as straight-line Python code and compiled once.
+"""
+import typing as T
+
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    from .room import Room
+    from .schedule import Rule, RulePath, Schedule, ScheduleEvaluationResultType
+
+import datetime
+
+from . import expression
+
+
+class CompiledSchedule:
+    """A schedule compiled into a function returning the index of the first
+    active leaf path for a given point in time."""
+
+    __slots__ = ("source", "_func", "_leaves", "_results")
+
+    def __init__(
+        self,
+        source: str,
+        func: T.Callable[[datetime.datetime], int],
+        leaves: T.Sequence["RulePath"],
+    ) -> None:
+        self.source = source
+        self._func = func
+        self._leaves = tuple(leaves)
+        self._results = tuple(
+            (path.rules_with_expr_or_value[-1].value, path.rules[-1])
+            for path in leaves
+        )
+
+    def __repr__(self) -> str:
+        return "<CompiledSchedule of {} paths>".format(len(self._leaves))
+
+    def evaluate(
+        self, room: "Room", when: datetime.datetime
+    ) -> T.Tuple[
+        T.Optional["ScheduleEvaluationResultType"], T.Tuple["RulePath", ...]
+    ]:
+        """Evaluates the schedule like Schedule._interpret() does, returning
+        the result and the paths that were checked for activity."""
+
+        index = self._func(when)
+        if index < 0:
+            return None, self._leaves
+        tested_paths = self._leaves[: index + 1]
+        value, rule = self._results[index]
+        value = room.validate_value(value)
+        if value is None:
+            return None, tested_paths
+        return (value, set(), rule), tested_paths
+
+
+def is_plain_value(value: T.Any) -> bool:
+    """Returns whether the given rule value is used as the result as it is."""
+
+    return value is not None and not isinstance(
+        value,
+        (
+            expression.types.ControlResult,
+            expression.types.Postprocessor,
+            Exception,
+        ),
+    )
+
+
+def get_leaves(schedule: "Schedule") -> T.Optional[T.List["RulePath"]]:
+    """Returns the leaf paths of the given schedule, or None if one of them
+    doesn't end in a plain value."""
+
+    leaves = []
+    for path in schedule.reachable:
+        if not path.is_final:
+            continue
+        rules = path.rules_with_expr_or_value
+        if not rules or rules[-1].expr is not None or not is_plain_value(rules[-1].value):
+            return None
+        leaves.append(path)
+    return leaves
+
+
+def compile_schedule(schedule: "Schedule") -> T.Optional[CompiledSchedule]:
+    """Compiles the given schedule. None is returned when the schedule
+    contains expressions or values that aren't plain, which need the
+    interpreter."""
+
+    # pylint: disable=too-many-locals
+
+    leaves = get_leaves(schedule)
+    if leaves is None:
+        return None
+
+    namespace = {"timedelta": datetime.timedelta}  # type: T.Dict[str, T.Any]
+    names = {}  # type: T.Dict[T.Tuple[str, int], str]
+
+    def name_of(prefix: str, obj: T.Any) -> str:
+        """Returns the name under which obj is available to the generated code."""
+
+        key = (prefix, id(obj))
+        if key not in names:
+            names[key] = "{}{}".format(prefix, len(names))
+            namespace[names[key]] = obj
+        return names[key]
+
+    def date_name(offset: int) -> str:
+        """Returns the name of the variable holding today's date minus offset days."""
+
+        return "d_{}{}".format("m" if offset < 0 else "", abs(offset))
+
+    offsets = set()  # type: T.Set[int]
+    body = []  # type: T.List[str]
+    for index, path in enumerate(leaves):
+        if path.is_always_active:
+            body.append("    return {}".format(index))
+            break
+
+        start_time, start_plus_days, end_time, end_plus_days = path.times
+        start_name = name_of("t", start_time)
+        end_name = name_of("t", end_time)
+        constrained = [rule for rule in path.rules if rule.constraints]
+
+        # Same logic as RulePath.is_active(): the path is active when it started
+        # days_back days ago and its constraints are fulfilled at that date.
+        alternatives = []
+        for days_back in range(end_plus_days + 1):
+            tests = []
+            if days_back == end_plus_days:
+                tests.append("t < {}".format(end_name))
+            if days_back == 0:
+                tests.append("t >= {}".format(start_name))
+            offset = days_back + start_plus_days
+            for rule in constrained:
+                offsets.add(offset)
+                tests.append(
+                    "{}({})".format(name_of("c", rule.check_constraints), date_name(offset))
+                )
+            alternatives.append("({})".format(" and ".join(tests) or "True"))
+        body.append("    if {}:".format(" or ".join(alternatives)))
+        body.append("        return {}".format(index))
+    else:
+        body.append("    return -1")
+
+    lines = ["def evaluate(when):", "    t = when.time()", "    d_0 = when.date()"]
+    for offset in sorted(offsets):
+        if offset:
+            lines.append(
+                "    {} = d_0 - timedelta(days={})".format(date_name(offset), offset)
+            )
+    lines.extend(body)
+    source = "\n".join(lines) + "\n"
+
+    code = compile(source, "<compiled {!r}>".format(schedule), "exec", dont_inherit=True)
+    exec(code, namespace)  # pylint: disable=exec-used
+    return CompiledSchedule(source, namespace["evaluate"], leaves)
@@ -0,0 +1,38 @@
+import datetime
+import random
+
+import pytest
+
+from testing import Room, random_schedule
+
+from . import codegen, expression, schedule, util
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_compiled_matches_interpreter(seed):
+    sched = random_schedule(seed)
+    assert sched.compiled is not None
+    rnd = random.Random(seed)
+    start = datetime.datetime(2019, 12, 20)
+    room = Room()
+    for _ in range(300):
+        when = start + datetime.timedelta(minutes=rnd.randrange(60 * 24 * 400))
+        compiled_result, compiled_tested = sched.compiled.evaluate(room, when)
+        result, tested = sched._interpret(room, when)
+        assert compiled_result == result, sched.compiled.source
+        assert list(compiled_tested) == tested
+
+
+def test_compile_schedule_with_expression():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(expr=util.compile_expression("now.hour"), expr_raw="now.hour"),
+    ])
+    assert codegen.compile_schedule(sched) is None
+
+
+def test_compile_schedule_with_postprocessor():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(value=expression.types.Add(2)),
+        schedule.Rule(value=20),
+    ])
+    assert sched.compiled is None
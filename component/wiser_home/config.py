@@ -5,7 +5,12 @@ Modified from hass-apps (https://github.com/efficiosoft/hass-apps)
 import logging
 import typing as T
 
+if T.TYPE_CHECKING:
+    # pylint: disable=unused-import
+    import types
+
 import datetime
+import sys
 import traceback
 from collections import OrderedDict
 
@@ -17,11 +22,12 @@ from homeassistant.const import (
     CONF_ENTITY_ID,
     CONF_UNIQUE_ID)
 
-from . import schedule, util
+from . import expression, schedule, util
 from .const import (
     CONF_AT_STARTUP,
     CONF_BOILER,
     CONF_DAYS,
+    CONF_DIAGNOSTICS,
     CONF_END,
     CONF_END_DATE,
     CONF_EVENTS,
@@ -59,6 +65,7 @@ def build_schedule_rule(rule: dict) -> schedule.Rule:
             constraints[name] = value
 
     expr = None
+    value = rule.get(CONF_VALUE)
     expr_raw = rule.get(CONF_EXPR)
     if expr_raw is not None:
         expr_raw = expr_raw.strip()
@@ -67,6 +74,10 @@ def build_schedule_rule(rule: dict) -> schedule.Rule:
         except SyntaxError:
             traceback.print_exc(limit=0)
             raise vol.Invalid("Couldn't compile expression: {}".format(repr(expr_raw)))
+        if value is None and expression.is_constant(expr):
+            value = fold_constant_expression(expr)
+            if value is not None:
+                expr = None
 
     kwargs = {
         "start_time": rule[CONF_START][0],
@@ -76,7 +87,7 @@ def build_schedule_rule(rule: dict) -> schedule.Rule:
         "constraints": constraints,
         "expr": expr,
         "expr_raw": expr_raw,
-        CONF_VALUE: rule.get(CONF_VALUE),
+        CONF_VALUE: value,
     }
 
     if CONF_RULES in rule:
@@ -84,13 +95,46 @@ def build_schedule_rule(rule: dict) -> schedule.Rule:
     return schedule.Rule(**kwargs)
 
 
+def fold_constant_expression(expr: "types.CodeType") -> T.Any:
+    """Evaluates an expression that doesn't depend on time or state once,
+    so that its result can be used as the rule's value. None is returned
+    when the expression fails, it's then evaluated like any other expression
+    and the error is reported at that time. The built-in names are used, see
+    unfold_constant_expressions() for configs that override them."""
+
+    try:
+        return expression.eval_constant(expr)
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def unfold_constant_expressions(cfg: dict) -> None:
+    """Turns the values of folded constant expressions back into expressions
+    when an expression_environment script is configured, since it may give
+    the names they use another meaning. Rules are validated, and folded, before
+    the script is known."""
+
+    if cfg.get(CONF_EXPR_ENV) is None:
+        return
+    pending = [
+        cfg[CONF_SCH_PREPEND],
+        cfg[CONF_SCH_APPEND],
+        *cfg[CONF_SCH_SNIPPETS].values(),
+        *(room_data[CONF_SCHEDULE] for room_data in cfg[CONF_ROOMS].values()),
+    ]
+    while pending:
+        for rule in pending.pop().rules:
+            if rule.expr is None and rule.expr_raw is not None:
+                rule.expr = util.compile_expression(rule.expr_raw)
+                rule.value = None
+            if isinstance(rule, schedule.SubScheduleRule):
+                pending.append(rule.sub_schedule)
+
+
 def build_schedule(rules: T.Iterable[schedule.Rule]) -> schedule.Schedule:
     """Returns a Scheedule containing the given Rule objects."""
 
-    sched = schedule.Schedule()
-    for rule in rules:
-        sched.rules.append(rule)
-    return sched
+    return schedule.Schedule(rules=rules)
 
 
 def parse_rooms(cfg: dict) -> dict:
@@ -98,11 +142,21 @@ def parse_rooms(cfg: dict) -> dict:
 
     # pylint: disable=too-many-locals
 
-    # name schedule snippets
+    unfold_constant_expressions(cfg)
+
+    # name schedule snippets, they are shared by all rooms
     cfg[CONF_SCH_PREPEND].name = "prepend"
     cfg[CONF_SCH_APPEND].name = "append"
+    shared = [cfg[CONF_SCH_PREPEND], cfg[CONF_SCH_APPEND]]
     for name, sched in cfg[CONF_SCH_SNIPPETS].items():
         sched.name = name
+        shared.append(sched)
+    # The expression_environment script may define or replace any name, so
+    # results of shared schedules are only reused between rooms without one
+    memoize = cfg.get(CONF_EXPR_ENV) is None
+    for sched in shared:
+        sched.shared = True
+        sched.memoize = memoize
 
     # Build Room objects.
     rooms = []
@@ -129,6 +183,8 @@ def parse_rooms(cfg: dict) -> dict:
         del room_data[CONF_SCHEDULE]
 
         room = Room(room_name, therms, sched)
+        # after the room may have added the default schedule
+        eliminate_dead_paths(room.schedule)
         rooms.append(room)
 
     return rooms
@@ -157,6 +213,204 @@ def validate_rule_paths(sched: schedule.Schedule) -> schedule.Schedule:
     return sched
 
 
+def eliminate_dead_paths(sched: schedule.Schedule) -> schedule.Schedule:
+    """Determines the paths of a complete room schedule that can never provide
+    a result and logs them. They are skipped when evaluating the schedule, but
+    kept in its unfolded paths for diagnostics."""
+
+    for path, reason in sched.find_dead_paths():
+        if path.is_final:
+            _LOGGER.info("Rule path %s can never be used: %s", path, reason)
+    _LOGGER.debug(
+        "Schedule %s: %d of %d rule paths reachable",
+        sched.name,
+        len(sched.reachable),
+        len(sched.unfolded),
+    )
+    return sched
+
+
+class InternStats:
+    """Statistics of interning the rules of a config."""
+
+    def __init__(self) -> None:
+        self.rules_seen = 0
+        self.constraints_seen = 0
+        self.schedules_seen = 0
+        self.bytes_saved = 0
+        self.rules = []  # type: T.List[schedule.Rule]
+        self.constraints = 0
+        self.schedules = 0
+
+    def __repr__(self) -> str:
+        return (
+            "<InternStats rules {}/{}, constraint sets {}/{}, schedules {}/{}, "
+            "~{} bytes saved>".format(
+                len(self.rules),
+                self.rules_seen,
+                self.constraints,
+                self.constraints_seen,
+                self.schedules,
+                self.schedules_seen,
+                self.bytes_saved,
+            )
+        )
+
+    def cache_info(self) -> T.Tuple[int, int]:
+        """Returns (hits, misses) of the constraint check caches of all
+        interned rules."""
+
+        hits = misses = 0
+        for rule in self.rules:
+            if rule.constraints:
+                info = rule.check_constraints.cache_info()
+                hits += info.hits
+                misses += info.misses
+        return hits, misses
+
+    def as_dict(self) -> T.Dict[str, T.Any]:
+        """Returns the statistics for use as state attributes. They don't
+        change after interning, the hits and misses of the constraint check
+        caches are reported with the diagnostics instead."""
+
+        return {
+            "rules": len(self.rules),
+            "rules_configured": self.rules_seen,
+            "constraint_sets": self.constraints,
+            "constraint_sets_configured": self.constraints_seen,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+class RuleInterner:
+    """Shares structurally identical rules, anonymous sub-schedules and constraint
+    sets between all schedules of a config, so that they are stored, and their
+    constraint checks cached, only once. Identical rules within the same schedule
+    are kept apart, since rule paths are told apart by the identity of their
+    rules."""
+
+    def __init__(self) -> None:
+        self.stats = InternStats()
+        self._constraints = {}  # type: T.Dict[T.Any, T.Any]
+        self._rules = {}  # type: T.Dict[T.Any, schedule.Rule]
+        self._schedules = {}  # type: T.Dict[T.Any, schedule.Schedule]
+
+    @staticmethod
+    def _sizeof(rule: schedule.Rule) -> int:
+        """Approximates the memory used by a rule and its constraints."""
+
+        size = sys.getsizeof(rule) + sys.getsizeof(rule.check_constraints)
+        size += sys.getsizeof(rule.constraints)
+        for value in rule.constraints.values():
+            size += sys.getsizeof(value)
+        return size
+
+    def intern_constraint(self, value: T.Any) -> T.Any:
+        """Returns the shared instance of a constraint value."""
+
+        self.stats.constraints_seen += 1
+        if isinstance(value, dict):
+            key = (dict, tuple(sorted(value.items())))
+        elif isinstance(value, util.RangingSet):
+            key = (util.RangingSet, value.mask)
+        else:
+            key = (type(value), frozenset(value))
+        try:
+            return self._constraints[key]
+        except KeyError:
+            self._constraints[key] = value
+            self.stats.constraints += 1
+            return value
+
+    def intern_rule(
+        self, rule: schedule.Rule, siblings: T.Sequence[schedule.Rule] = ()
+    ) -> schedule.Rule:
+        """Returns the shared instance of a rule. If that instance is one of
+        siblings, the rule itself is returned."""
+
+        self.stats.rules_seen += 1
+        for name, value in rule.constraints.items():
+            rule.constraints[name] = self.intern_constraint(value)
+        sub_schedule = None
+        if isinstance(rule, schedule.SubScheduleRule):
+            rule.sub_schedule = sub_schedule = self.intern_schedule(rule.sub_schedule)
+        try:
+            key = (
+                type(rule),
+                rule.name,
+                rule.start_time,
+                rule.start_plus_days,
+                rule.end_time,
+                rule.end_plus_days,
+                tuple(sorted((n, id(v)) for n, v in rule.constraints.items())),
+                rule.expr_raw,
+                # values of folded expressions are determined by expr_raw
+                None if rule.expr_raw is not None else (type(rule.value), rule.value),
+                id(sub_schedule),
+            )
+            interned = self._rules.setdefault(key, rule)
+        except TypeError:
+            # unhashable value
+            interned = rule
+        if any(interned is sibling for sibling in siblings):
+            interned = rule
+        if interned is rule:
+            self.stats.rules.append(rule)
+        else:
+            self.stats.bytes_saved += self._sizeof(rule)
+        return interned
+
+    def intern_schedule(
+        self, sched: schedule.Schedule, top_level: bool = False
+    ) -> schedule.Schedule:
+        """Interns the rules of the given schedule in place. Anonymous schedules
+        are shared as a whole when structurally identical. Top-level schedules,
+        which parse_rooms() names later on, are neither shared nor used in
+        place of identical sub-schedules."""
+
+        self.stats.schedules_seen += 1
+        rules = []  # type: T.List[schedule.Rule]
+        for rule in sched.rules:
+            rules.append(self.intern_rule(rule, rules))
+        sched.rules = rules  # type: ignore
+
+        if top_level or sched.name is not None:
+            self.stats.schedules += 1
+            return sched
+        key = tuple(id(rule) for rule in rules)
+        interned_sched = self._schedules.setdefault(key, sched)
+        if interned_sched is sched:
+            self.stats.schedules += 1
+        else:
+            # Included from several places now
+            interned_sched.shared = True
+        return interned_sched
+
+    def intern_config(self, cfg: dict) -> InternStats:
+        """Interns all schedules of a validated config."""
+
+        self.intern_schedule(cfg[CONF_SCH_PREPEND], top_level=True)
+        self.intern_schedule(cfg[CONF_SCH_APPEND], top_level=True)
+        for sched in cfg[CONF_SCH_SNIPPETS].values():
+            self.intern_schedule(sched, top_level=True)
+        for room_data in cfg[CONF_ROOMS].values():
+            self.intern_schedule(room_data[CONF_SCHEDULE], top_level=True)
+        if cfg.get(CONF_EXPR_ENV) is not None:
+            # See parse_rooms()
+            for sched in self._schedules.values():
+                sched.memoize = False
+        return self.stats
+
+
+def intern_config(cfg: dict) -> InternStats:
+    """Shares identical rules and constraint sets between all schedules of
+    the given validated config and returns statistics about it."""
+
+    stats = RuleInterner().intern_config(cfg)
+    _LOGGER.info("Interned schedule rules: %s", stats)
+    return stats
+
+
 ########## MISCELLANEOUS
 
 
@@ -289,6 +543,7 @@ CONFIG_SCHEMA = {
                 ),
     vol.Optional(CONF_AT_STARTUP, default=False): bool,
     vol.Optional(CONF_EVENTS, default=False): bool,
+    vol.Optional(CONF_DIAGNOSTICS, default=False): bool,
     vol.Optional(CONF_EXPR_ENV, default=None): vol.Any(
         str, None
     ),
@@ -0,0 +1,163 @@
+import copy
+import datetime
+
+import pytest
+import voluptuous as vol
+
+from . import config, expression
+
+
+def room_config(entity_id):
+    return {
+        "thermostat": [{"entity_id": entity_id}],
+        "schedule": [
+            {"weekdays": "1-5", "rules": [
+                {"start": "06:15", "end": "07:30", "v": 20},
+                {"start": "17:00", "end": "22:00", "v": 21},
+            ]},
+            {"weekdays": "1-5", "v": 16},
+            {"v": "OFF"},
+        ],
+    }
+
+
+@pytest.fixture
+def cfg():
+    raw = {
+        "boiler": "switch.boiler",
+        "unique_id": "test",
+        "rooms": {
+            "kitchen": room_config("climate.kitchen"),
+            "bedroom": room_config("climate.bedroom"),
+        },
+    }
+    return vol.Schema(config.CONFIG_SCHEMA)(copy.deepcopy(raw))
+
+
+def test_intern_config_shares_rules(cfg):
+    stats = config.intern_config(cfg)
+    kitchen = cfg["rooms"]["kitchen"]["schedule"]
+    bedroom = cfg["rooms"]["bedroom"]["schedule"]
+    assert kitchen is not bedroom
+    for kitchen_rule, bedroom_rule in zip(kitchen.rules, bedroom.rules):
+        assert kitchen_rule is bedroom_rule
+    assert stats.rules_seen == 10
+    assert len(stats.rules) == 5
+
+
+def test_intern_config_shares_constraint_sets(cfg):
+    stats = config.intern_config(cfg)
+    rules = cfg["rooms"]["kitchen"]["schedule"].rules
+    assert rules[0].constraints["weekdays"] is rules[1].constraints["weekdays"]
+    assert stats.constraints == 1
+
+
+def test_intern_config_keeps_duplicates_within_schedule(cfg):
+    cfg["rooms"]["kitchen"]["schedule"].rules += (config.SCHEDULE_RULE_SCHEMA({"v": "OFF"}),)
+    config.intern_config(cfg)
+    rules = cfg["rooms"]["kitchen"]["schedule"].rules
+    assert rules[-1] is not rules[-2]
+
+
+def test_intern_config_keeps_top_level_schedules_apart(cfg):
+    # The bedroom's nested schedule is identical to the kitchen's schedule
+    kitchen = cfg["rooms"]["kitchen"]["schedule"]
+    bedroom = cfg["rooms"]["bedroom"]["schedule"]
+    bedroom.rules = [config.SCHEDULE_RULE_SCHEMA({"weekdays": "6-7", "rules": [
+        {"weekdays": "1-5", "rules": [
+            {"start": "06:15", "end": "07:30", "v": 20},
+            {"start": "17:00", "end": "22:00", "v": 21},
+        ]},
+        {"weekdays": "1-5", "v": 16},
+        {"v": "OFF"},
+    ]})]
+    config.intern_config(cfg)
+    assert bedroom.rules[0].sub_schedule is not kitchen
+    assert not kitchen.shared
+    assert not bedroom.rules[0].sub_schedule.shared
+    rooms = config.parse_rooms(cfg)
+    assert rooms[0].schedule.rules[0].sub_schedule.name == "room-individual"
+    assert bedroom.rules[0].sub_schedule.name is None
+
+
+def test_intern_stats_cache_info(cfg):
+    stats = config.intern_config(cfg)
+    assert stats.cache_info() == (0, 0)
+    assert stats.as_dict()["bytes_saved"] > 0
+    rule = cfg["rooms"]["kitchen"]["schedule"].rules[1]
+    rule.check_constraints(datetime.date(2020, 6, 1))
+    rule.check_constraints(datetime.date(2020, 6, 1))
+    assert stats.cache_info() == (1, 1)
+
+
+@pytest.mark.parametrize("expr_raw,expected", [
+    ("20", 20),
+    ("Add(2)", expression.types.Add(2)),
+    ("Mark(18, Mark.OVERLAY)", expression.types.Mark(18, "OVERLAY")),
+    ("Break(max(1, 2))", expression.types.Break(2)),
+])
+def test_constant_expression_folded(expr_raw, expected):
+    rule = config.SCHEDULE_RULE_SCHEMA({"x": expr_raw})
+    assert rule.expr is None
+    assert rule.expr_raw == expr_raw
+    assert rule.value == expected
+
+
+@pytest.mark.parametrize("expr_raw", [
+    "now.hour",
+    "Add(len(room_name))",
+    "Postprocess(lambda result: result + now.hour)",
+    "1 / 0",
+    "None",
+])
+def test_non_constant_expression_not_folded(expr_raw):
+    rule = config.SCHEDULE_RULE_SCHEMA({"x": expr_raw})
+    assert rule.expr is not None
+    assert rule.value is None
+
+
+def test_constant_expression_unfolded_with_environment(cfg):
+    kitchen = cfg["rooms"]["kitchen"]["schedule"]
+    kitchen.rules = (config.SCHEDULE_RULE_SCHEMA({"x": "Add(2)"}), *kitchen.rules)
+    rules = kitchen.rules
+    assert rules[0].expr is None
+    cfg["expression_environment"] = "def Add(value):\n    return value\n"
+    config.parse_rooms(cfg)
+    assert rules[0].expr is not None
+    assert rules[0].value is None
+
+
+@pytest.mark.parametrize("env", [None, "def room_temp():\n    return 20\n"])
+def test_shared_results_not_reused_with_environment(cfg, env):
+    cfg["expression_environment"] = env
+    cfg["schedule_prepend"].rules = [config.SCHEDULE_RULE_SCHEMA({"x": "room_temp()"})]
+    config.intern_config(cfg)
+    rooms = config.parse_rooms(cfg)
+    nested = rooms[0].schedule.rules[0].sub_schedule
+    assert nested.shared
+    assert cfg["schedule_prepend"].shared
+    assert nested.memoize is (env is None)
+    assert cfg["schedule_prepend"].memoize is (env is None)
+
+
+def test_constant_expression_kept_without_environment(cfg):
+    kitchen = cfg["rooms"]["kitchen"]["schedule"]
+    kitchen.rules = (config.SCHEDULE_RULE_SCHEMA({"x": "Add(2)"}), *kitchen.rules)
+    rules = kitchen.rules
+    config.parse_rooms(cfg)
+    assert rules[0].expr is None
+    assert rules[0].value == expression.types.Add(2)
+
+
+def test_parse_rooms_skips_dead_paths(cfg, caplog):
+    kitchen = cfg["rooms"]["kitchen"]["schedule"]
+    kitchen.rules += (config.SCHEDULE_RULE_SCHEMA({"v": 18}),)
+    rules = kitchen.rules
+    caplog.set_level("INFO")
+    kitchen = config.parse_rooms(cfg)[0]
+    assert kitchen.name == "kitchen"
+    dead = [path for path, _ in kitchen.schedule.find_dead_paths()]
+    assert [path.rules[-1] for path in dead] == [rules[-1]]
+    assert dead[0] not in kitchen.schedule.reachable
+    assert dead[0] in kitchen.schedule.unfolded
+    assert "can never be used" in caplog.text
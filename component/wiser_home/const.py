@@ -12,6 +12,7 @@ VALVE_EVENTS_THROTTLE = 10
 CONF_AT_STARTUP = "reset_at_startup"
 CONF_BOILER = "boiler"
 CONF_DAYS = "days"
+CONF_DIAGNOSTICS = "diagnostics"
 CONF_END = "end"
 CONF_END_DATE = "end_date"
 CONF_EVENTS = "expressions_from_events"
@@ -34,8 +35,19 @@ CONF_YEARS = "years"
 CONF_WEIGHT = "weight"
 
 ATTR_AWAY_MODE = "away_mode"
+ATTR_COUNT = "count"
+ATTR_ENABLED = "enabled"
+ATTR_ROOM = "room"
+ATTR_SIZE = "size"
+
+EVENT_DIAGNOSTICS = "wiser_home_diagnostics"
+EVENT_TRACES = "wiser_home_traces"
 
 SERVICE_SET_AWAY_TEMP = "set_away_temp"
 SERVICE_SET_AWAY_MODE = "set_away_mode"
 SERVICE_BOOST_ALL = "boost_all"
 SERVICE_CANCEL_OVERRIDES = "cancel_overrides"
+SERVICE_SET_DIAGNOSTICS = "set_diagnostics"
+SERVICE_GET_DIAGNOSTICS = "get_diagnostics"
+SERVICE_SET_TRACE = "set_trace"
+SERVICE_GET_TRACES = "get_traces"
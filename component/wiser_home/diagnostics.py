@@ -0,0 +1,161 @@
+"""
+This module collects diagnostics about the work done on every tick: the time
+taken by the whole tick, by evaluating the schedule of each room and by
+executing expressions, the number of rule paths visited and the latency of
+service calls. Values are aggregated into histograms with fixed buckets, so
+that memory use stays constant however long collection is enabled.
+Collection is disabled by default. Instrumented code only checks whether a
+Diagnostics object is attached and does nothing else when it isn't.
+"""
+import typing as T
+
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    import types
+    from .config import InternStats
+
+import bisect
+import time
+
+from . import expression
+
+# Upper bounds of the buckets for durations, in seconds
+TIME_BUCKETS = (
+    0.00001, 0.00003, 0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0
+)
+
+# Upper bounds of the buckets for counts
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """Counts values in buckets with fixed upper bounds, plus one bucket for
+    values above the largest bound."""
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds: T.Sequence[float] = TIME_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self) -> str:
+        return "<Histogram of {} values>".format(self.count)
+
+    def add(self, value: float) -> None:
+        """Counts the given value."""
+
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction: float) -> T.Optional[float]:
+        """Returns the upper bound of the bucket the given fraction of values
+        falls into, or the maximum for the overflow bucket. None is returned
+        when no values have been counted."""
+
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> T.Dict[str, T.Any]:
+        """Returns the histogram for use as event data."""
+
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": dict(
+                zip([*("<={}".format(bound) for bound in self.bounds), "more"], self.counts)
+            ),
+        }
+
+
+class Diagnostics:
+    """Histograms of the work done, by name. Durations are in seconds.
+    The instrumented parts of WiserHome and Room call the methods of this
+    class instead of doing the work themselves while it is attached."""
+
+    def __init__(self) -> None:
+        self.histograms = {}  # type: T.Dict[str, Histogram]
+
+    def __repr__(self) -> str:
+        return "<Diagnostics of {} histograms>".format(len(self.histograms))
+
+    def add(self, name: str, value: float, bounds: T.Sequence[float] = TIME_BUCKETS) -> None:
+        """Counts value in the histogram of the given name, which is created
+        with the given bounds if it doesn't exist yet."""
+
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+        histogram.add(value)
+
+    def add_evaluation(self, room_name: str, duration: float, tested_count: T.Optional[int]) -> None:
+        """Counts a schedule evaluation of the given room and the number of
+        paths it visited, which isn't known after an expression was evaluated."""
+
+        self.add("evaluate.{}".format(room_name), duration)
+        if tested_count is not None:
+            self.add("paths_visited", tested_count, COUNT_BUCKETS)
+
+    def eval_expr(self, expr: "types.CodeType", env: T.Dict[str, T.Any]) -> T.Any:
+        """Evaluates an expression, counting its duration."""
+
+        started = time.perf_counter()
+        try:
+            return expression.eval_expr(expr, env)
+        finally:
+            self.add("expression", time.perf_counter() - started)
+
+    async def async_call(
+        self, hass: T.Any, domain: str, service: str, data: T.Dict[str, T.Any]
+    ) -> None:
+        """Calls a service, counting its latency."""
+
+        started = time.perf_counter()
+        try:
+            await hass.services.async_call(domain, service, data)
+        finally:
+            self.add("service_call", time.perf_counter() - started)
+
+    def slowest_room(self) -> T.Optional[str]:
+        """Returns the name of the room whose schedule evaluations took the
+        longest in total."""
+
+        totals = {
+            name[len("evaluate."):]: histogram.total
+            for name, histogram in self.histograms.items()
+            if name.startswith("evaluate.")
+        }
+        return max(totals, key=totals.__getitem__) if totals else None
+
+    def as_dict(self, rule_stats: "InternStats" = None) -> T.Dict[str, T.Any]:
+        """Returns the diagnostics for use as event data. The hits and
+        misses of the constraint check caches are taken from rule_stats."""
+
+        result = {
+            name: histogram.as_dict()
+            for name, histogram in sorted(self.histograms.items())
+        }  # type: T.Dict[str, T.Any]
+        result["slowest_room"] = self.slowest_room()
+        if rule_stats is not None:
+            hits, misses = rule_stats.cache_info()
+            result["constraint_cache"] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            }
+        return result
@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+
+from . import diagnostics, schedule, tracing, util
+from .room import Room
+
+
+def test_histogram_buckets():
+    histogram = diagnostics.Histogram((1, 10))
+    for value in (0.5, 1, 5, 20):
+        histogram.add(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.total == 26.5
+    assert histogram.max == 20
+
+
+def test_histogram_percentile():
+    histogram = diagnostics.Histogram((1, 10))
+    assert histogram.percentile(0.5) is None
+    for value in (0.5, 0.5, 5, 20):
+        histogram.add(value)
+    assert histogram.percentile(0.5) == 1
+    assert histogram.percentile(0.75) == 10
+    assert histogram.percentile(0.99) == 20
+
+
+def test_histogram_percentile_below_bound():
+    histogram = diagnostics.Histogram((1, 10))
+    histogram.add(2)
+    assert histogram.percentile(0.5) == 2
+
+
+def test_histogram_as_dict():
+    histogram = diagnostics.Histogram((1,))
+    histogram.add(3)
+    assert histogram.as_dict() == {
+        "count": 1,
+        "mean": 3,
+        "p50": 3,
+        "p99": 3,
+        "max": 3,
+        "buckets": {"<=1": 0, "more": 1},
+    }
+
+
+def test_evaluate_schedule():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(start_time=datetime.time(6), end_time=datetime.time(8), value=21),
+        schedule.Rule(value=18),
+    ])
+    room = Room(name="kitchen", schedule=sched)
+    room.diagnostics = diagnostics.Diagnostics()
+    when = datetime.datetime(2020, 1, 1, 7)
+    assert room.evaluate_schedule(when) == sched.evaluate_sync(room, when)
+    assert room.diagnostics.histograms["evaluate.kitchen"].count == 1
+    assert room.diagnostics.histograms["paths_visited"].total == 1
+    assert room.diagnostics.slowest_room() == "kitchen"
+
+
+def test_evaluate_schedule_traced():
+    sched = schedule.Schedule(rules=[schedule.Rule(value=18)])
+    room = Room(name="kitchen", schedule=sched)
+    room.diagnostics = diagnostics.Diagnostics()
+    room.tracer = tracing.TraceBuffer()
+    room.evaluate_schedule(datetime.datetime(2020, 1, 1))
+    assert room.diagnostics.histograms["evaluate.kitchen"].count == 1
+    assert room.diagnostics.histograms["paths_visited"].total == 1
+    assert len(room.tracer.get_latest()) == 1
+
+
+def test_evaluate_schedule_expression():
+    sched = schedule.Schedule(rules=[schedule.Rule(expr=util.compile_expression("18"), expr_raw="18")])
+    room = Room(name="kitchen", schedule=sched)
+    room.diagnostics = diagnostics.Diagnostics()
+    room.evaluate_schedule(datetime.datetime(2020, 1, 1))
+    assert room.diagnostics.histograms["evaluate.kitchen"].count == 1
+    assert "paths_visited" not in room.diagnostics.histograms
+
+
+def test_eval_expr():
+    room = Room(name="kitchen", schedule=schedule.Schedule())
+    room.diagnostics = diagnostics.Diagnostics()
+    assert room.eval_expr(util.compile_expression("1 + 1"), {}) == 2
+    assert isinstance(room.eval_expr(util.compile_expression("1 / 0"), {}), ZeroDivisionError)
+    assert room.diagnostics.histograms["expression"].count == 2
+
+
+def test_async_call():
+    class Services:
+        def __init__(self):
+            self.calls = []
+
+        async def async_call(self, *args):
+            self.calls.append(args)
+
+    class Hass:
+        services = Services()
+
+    diags = diagnostics.Diagnostics()
+    asyncio.run(diags.async_call(Hass, "climate", "set_temperature", {}))
+    assert Hass.services.calls == [("climate", "set_temperature", {})]
+    assert diags.histograms["service_call"].count == 1
+
+
+def test_as_dict():
+    diags = diagnostics.Diagnostics()
+    diags.add("evaluate.a", 0.1)
+    diags.add("evaluate.b", 0.3)
+    result = diags.as_dict()
+    assert result["slowest_room"] == "b"
+    assert result["evaluate.a"]["count"] == 1
+    assert "constraint_cache" not in result
+
+
+def test_as_dict_constraint_cache():
+    class RuleStats:
+        def cache_info(self):
+            return 1, 3
+
+    result = diagnostics.Diagnostics().as_dict(RuleStats())
+    assert result["constraint_cache"] == {"hits": 1, "misses": 3, "hit_rate": 0.25}
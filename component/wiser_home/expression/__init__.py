@@ -8,13 +8,86 @@ import typing as T
 if T.TYPE_CHECKING:
     # pylint: disable=cyclic-import,unused-import
     from .. import schedule
+    from ..room import Room
 
+import copy
 import datetime
+import dis
+import functools
 import inspect
+import logging
 
 from . import helpers
 from . import types  # pylint: disable=reimported
 
+_log = logging.getLogger(__name__)
+
+# Names from the evaluation environment whose values are the same for all rooms
+# at a given point in time
+ROOM_INDEPENDENT_NAMES = frozenset(
+    (
+        *types.__all__,
+        # Builtins without side effects or access to the environment; eval,
+        # globals, vars, __import__ and the like are left out deliberately
+        "abs",
+        "all",
+        "any",
+        "bool",
+        "dict",
+        "divmod",
+        "enumerate",
+        "filter",
+        "float",
+        "frozenset",
+        "int",
+        "isinstance",
+        "len",
+        "list",
+        "map",
+        "max",
+        "min",
+        "range",
+        "reversed",
+        "round",
+        "set",
+        "sorted",
+        "str",
+        "sum",
+        "tuple",
+        "zip",
+        "datetime",
+        "now",
+        "date",
+        "time",
+        "is_empty",
+        "round_to_step",
+        "pattern",
+    )
+)
+
+# Names from the evaluation environment whose values never change. Expressions
+# only reading these always evaluate to the same result.
+CONSTANT_NAMES = frozenset(
+    (
+        *types.__all__,
+        "abs",
+        "bool",
+        "dict",
+        "float",
+        "int",
+        "len",
+        "list",
+        "max",
+        "min",
+        "range",
+        "round",
+        "set",
+        "str",
+        "sum",
+        "tuple",
+    )
+)
+
 
 def build_expr_env(room: "Room", now: datetime.datetime) -> T.Dict[str, T.Any]:
     """This function builds and returns an environment usable as globals
@@ -37,16 +110,15 @@ def build_expr_env(room: "Room", now: datetime.datetime) -> T.Dict[str, T.Any]:
         ):
             helper_types.append(member)
 
-    assert room.app.actor_type is not None
-    helper_types.extend(room.app.actor_type.expression_helpers)
+    actor_type = getattr(getattr(room, "app", None), "actor_type", None)
+    if actor_type is not None:
+        helper_types.extend(actor_type.expression_helpers)
 
     helper_types.sort(key=lambda t: t.order)
     for helper_type in helper_types:
-        room.log(
-            "Initializing expression helper: {}, order = {}".format(
-                helper_type.__name__, helper_type.order
-            ),
-            level="DEBUG",
+        _log.debug(
+            "Initializing expression helper: %s, order = %s",
+            helper_type.__name__, helper_type.order
         )
         helper = helper_type(room, now, env)
         helper.update_environment()
@@ -54,6 +126,37 @@ def build_expr_env(room: "Room", now: datetime.datetime) -> T.Dict[str, T.Any]:
     return env
 
 
+def rebase_expr_env(
+    env: T.Dict[str, T.Any], room: "Room", now: datetime.datetime
+) -> T.Dict[str, T.Any]:
+    """Returns an environment like one built by build_expr_env() for the
+    given point in time, derived from env which was built for the same room
+    at another point in time. This is cheaper than building it from scratch
+    and meant for evaluating a room's expressions at many points in time.
+    The environment is built anew when the room's app adds helpers or a
+    custom environment script, which could depend on the time as well."""
+
+    app = getattr(room, "app", None)
+    if (
+        getattr(app, "actor_type", None) is not None
+        or getattr(app, "expression_environment_script", None) is not None
+    ):
+        return build_expr_env(room, now)
+
+    new_env = {**env}
+    new_env["now"] = now
+    new_env["date"] = now.date()
+    new_env["time"] = now.time()
+    for name, value in env.items():
+        if isinstance(value, helpers.HelperBase):
+            helper = copy.copy(value)
+            # pylint: disable=protected-access
+            helper._now = now
+            helper._env = new_env
+            new_env[name] = helper
+    return new_env
+
+
 def eval_expr(expr: _types.CodeType, env: T.Dict[str, T.Any]) -> T.Any:
     """This method evaluates the given expression. The evaluation result
     is returned. The items of the env dict are added to the globals
@@ -62,3 +165,44 @@ def eval_expr(expr: _types.CodeType, env: T.Dict[str, T.Any]) -> T.Any:
     env = {**env}
     exec(expr, env)  # pylint: disable=exec-used
     return env.get("result")
+
+
+@functools.lru_cache(maxsize=None)
+def get_env_names(expr: _types.CodeType) -> T.FrozenSet[str]:
+    """Returns the names the given expression reads from its environment.
+    Names the expression assigns itself are not included."""
+
+    loaded = set()
+    stored = set()
+    codes = [expr]
+    while codes:
+        code = codes.pop()
+        for instruction in dis.get_instructions(code):
+            if instruction.opname in ("LOAD_NAME", "LOAD_GLOBAL"):
+                loaded.add(instruction.argval)
+            elif instruction.opname in ("STORE_NAME", "STORE_GLOBAL"):
+                stored.add(instruction.argval)
+        codes.extend(c for c in code.co_consts if isinstance(c, _types.CodeType))
+    return frozenset(loaded - stored)
+
+
+def is_room_independent(expr: _types.CodeType) -> bool:
+    """Returns whether the given expression evaluates to the same result for
+    all rooms at a given point in time."""
+
+    return get_env_names(expr) <= ROOM_INDEPENDENT_NAMES
+
+
+def is_constant(expr: _types.CodeType) -> bool:
+    """Returns whether the given expression always evaluates to the same
+    result, no matter when and for which room."""
+
+    return get_env_names(expr) <= CONSTANT_NAMES
+
+
+def eval_constant(expr: _types.CodeType) -> T.Any:
+    """Evaluates an expression for which is_constant() is True, using an
+    environment with just the expression types."""
+
+    env = {member_name: getattr(types, member_name) for member_name in types.__all__}
+    return eval_expr(expr, env)
@@ -12,6 +12,9 @@ if T.TYPE_CHECKING:
 import datetime
 import inspect
 import itertools
+import logging
+
+_log = logging.getLogger(__name__)
 
 
 class HelperBase:
@@ -27,7 +30,7 @@ class HelperBase:
         self, room: "Room", now: datetime.datetime, env: T.Dict[str, T.Any]
     ) -> None:
         self._room = room
-        self._app = room.app
+        self._app = getattr(room, "app", None)
         self._now = now
         self._env = env
 
@@ -59,7 +62,9 @@ class BasicHelper(HelperBase):
         self.date = self._now.date()
         self.time = self._now.time()
 
-        self.schedule_snippets = self._app.cfg["schedule_snippets"]
+        self.schedule_snippets = (
+            self._app.cfg["schedule_snippets"] if self._app is not None else {}
+        )
 
     @staticmethod
     def is_empty(iterable: T.Iterable) -> bool:
@@ -103,11 +108,9 @@ class CustomEnvironmentHelper(HelperBase):
     def update_environment(self) -> None:
         """Executes the expression_environment script."""
 
-        script = self._app.expression_environment_script
+        script = getattr(self._app, "expression_environment_script", None)
         if script is not None:
-            self._room.log(
-                "Executing the expression_environment script.", level="DEBUG"
-            )
+            _log.debug("Executing the expression_environment script.")
             exec(script, self._env)  # pylint: disable=exec-used
 
 
@@ -206,7 +209,7 @@ class ScheduleHelper(HelperBase):
         """Evaluates the given schedule for the given point in time."""
 
         when = when or self._now
-        return schedule.evaluate(self._room, when)
+        return schedule.evaluate_sync(self._room, when)
 
     def next_results(
         self,
@@ -227,7 +230,7 @@ class ScheduleHelper(HelperBase):
         when = start or self._now  # type: T.Optional[datetime.datetime]
         last_result = None
         while when and (not end or end > when):
-            result = schedule.evaluate(self._room, when)
+            result = schedule.evaluate_sync(self._room, when)
             if result and result != last_result:
                 yield when, result
                 last_result = result
@@ -7,6 +7,7 @@ from collections import namedtuple
 import datetime
 from enum import Enum, auto
 import sys
+import time as _time
 from pprint import pprint
 
 from homeassistant.components.climate.const import (
@@ -18,11 +19,8 @@ from homeassistant.const import (
     ATTR_TEMPERATURE,
 )
 from homeassistant.core import callback, State
-from homeassistant.helpers.event import (
-    async_track_state_change,
-    async_track_time_interval,
-)
-from homeassistant.util.dt import as_local
+from homeassistant.helpers.event import async_track_state_change
+from homeassistant.util.dt import as_local, parse_datetime
 
 from .const import (
     CONF_WEEKDAYS,
@@ -31,7 +29,9 @@ from .const import (
     VALVE_EVENTS_THROTTLE,
     TEMP_HYSTERESIS,
 )
-from .schedule import Schedule, Rule
+from . import expression, util
+from .clock import SYSTEM_CLOCK
+from .schedule import Schedule, Rule, SubScheduleRule
 from .util import RangingSet
 
 _log = logging.getLogger(__name__)
@@ -49,6 +49,70 @@ boost_delta = {
     BOOST_DOWN: -2,
 }
 
+_WEEK_DAYS = RangingSet(range(1, 6))
+_WEEKEND_DAYS = RangingSet({6, 7})
+
+# The schedule of rooms without rules of their own. It is shared by all those
+# rooms and must not be modified.
+DEFAULT_SCHEDULE = Schedule(
+    name="default",
+    rules=(
+        # Week days
+        Rule(
+            value=20,
+            name="wd morning",
+            start_time=datetime.time(6, 0),
+            end_time=datetime.time(8, 30),
+            constraints={CONF_WEEKDAYS: _WEEK_DAYS}
+        ),
+        Rule(
+            value=16,
+            name="wd day",
+            start_time=datetime.time(8, 30),
+            end_time=datetime.time(16, 30),
+            constraints={CONF_WEEKDAYS: _WEEK_DAYS}
+        ),
+        Rule(
+            value=21,
+            name="wd evening",
+            start_time=datetime.time(16, 30),
+            end_time=datetime.time(22, 30),
+            constraints={CONF_WEEKDAYS: _WEEK_DAYS}
+        ),
+        # Weekends
+        Rule(
+            value=20,
+            name="we morning",
+            start_time=datetime.time(7, 0),
+            end_time=datetime.time(9, 0),
+            constraints={CONF_WEEKDAYS: _WEEKEND_DAYS}
+        ),
+        Rule(
+            value=18,
+            name="we day",
+            start_time=datetime.time(9, 0),
+            end_time=datetime.time(16, 0),
+            constraints={CONF_WEEKDAYS: _WEEKEND_DAYS}
+        ),
+        Rule(
+            value=21,
+            name="evening",
+            start_time=datetime.time(16, 0),
+            end_time=datetime.time(23, 0),
+            constraints={CONF_WEEKDAYS: _WEEKEND_DAYS}
+        ),
+        # Default
+        Rule(
+            value=OFF_VALUE,
+            name="sleep",
+        ),
+    ),
+    shared=True,
+)
+DEFAULT_SCHEDULE_RULE = SubScheduleRule(DEFAULT_SCHEDULE, name="default")
+# Unfold the paths once, up front
+DEFAULT_SCHEDULE.unfolded  # pylint: disable=pointless-statement
+
 
 class TempDirection(Enum):
     NONE = 0
@@ -80,12 +144,45 @@ class Room:
         10:30 pm    Off*            11:00 pm    Off*
 
     * Only frost protection is active
+
+    Times are taken as aware datetimes in Home Assistant's time zone. Naive
+    times, like those of a VirtualClock started without time zone, are in
+    that time zone, as homeassistant.util.dt.as_local() assumes.
     """
 
-    def __init__(self, name=None, valves=None, schedule: Schedule = None):
+    __slots__ = (
+        "_hass",
+        "schedule",
+        "_away_temp",
+        "_boost_all_temp",
+        "_manual_temp",
+        "_setpoint",
+        "_name",
+        "_heating",
+        "_valves",
+        "_valve_boost_timer_remove",
+        "_room_boost_timer_remove",
+        "_boost_end",
+        "_event_cnt",
+        "_schedule_result",
+        "_schedule_evaluated_at",
+        "_schedule_valid_until",
+        "_state",
+        "_temp_lock",
+        "diagnostics",
+        "tracer",
+        "log_limited",
+        "_clock",
+    )
+
+    def __init__(self, name=None, valves=None, schedule: Schedule = None, clock=None):
         if valves is None:
             valves = []
         self._hass = None
+        # Messages repeated on every tick, suppressed ones are counted per room
+        self.log_limited = util.RateLimitedLogger(_log)
+        # Provides the time and runs timers, see the clock module
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
         self.schedule = schedule
         self._away_temp = DEFAULT_AWAY_TEMP
         self._boost_all_temp = None
@@ -93,77 +190,36 @@ class Room:
         self._setpoint = 20
         self._name = name
         self._heating = False
-        self._valves = Valves(valves={v.entity_id: v.weight for v in valves})
+        self._valves = Valves(valves={v.entity_id: v.weight for v in valves}, log_limited=self.log_limited)
         self._valve_boost_timer_remove = None
         self._room_boost_timer_remove = None
         self._boost_end = None
         self._event_cnt = 0
+        self._schedule_result = None
+        self._schedule_evaluated_at = None
+        self._schedule_valid_until = None
         self._state = Auto()
         self._temp_lock = asyncio.Lock()
-        if not self.schedule.rules:   # Create default rules
-            # Week days
-            self.schedule.rules.append(
-                Rule(
-                    value=20,
-                    name="wd morning",
-                    start_time=datetime.time(6, 0),
-                    end_time=datetime.time(8, 30),
-                    constraints={CONF_WEEKDAYS: RangingSet(range(1, 6))}
-                )
-            )
-            self.schedule.rules.append(
-                Rule(
-                    value=16,
-                    name="wd day",
-                    start_time=datetime.time(8, 30),
-                    end_time=datetime.time(16, 30),
-                    constraints={CONF_WEEKDAYS: RangingSet(range(1, 6))}
-                )
-            )
-            self.schedule.rules.append(
-                Rule(
-                    value=21,
-                    name="wd evening",
-                    start_time=datetime.time(16, 30),
-                    end_time=datetime.time(22, 30),
-                    constraints={CONF_WEEKDAYS: RangingSet(range(1, 6))}
-                )
-            )
-            # Weekends
-            self.schedule.rules.append(
-                Rule(
-                    value=20,
-                    name="we morning",
-                    start_time=datetime.time(7, 0),
-                    end_time=datetime.time(9, 0),
-                    constraints={CONF_WEEKDAYS: RangingSet({6, 7})}
-                )
-            )
-            self.schedule.rules.append(
-                Rule(
-                    value=18,
-                    name="we day",
-                    start_time=datetime.time(9, 0),
-                    end_time=datetime.time(16, 0),
-                    constraints={CONF_WEEKDAYS: RangingSet({6, 7})}
-                )
-            )
-            self.schedule.rules.append(
-                Rule(
-                    value=21,
-                    name="evening",
-                    start_time=datetime.time(16, 0),
-                    end_time=datetime.time(23, 0),
-                    constraints={CONF_WEEKDAYS: RangingSet({6, 7})}
-                )
-            )
-            # Default
-            self.schedule.rules.append(
-                Rule(
-                    value=OFF_VALUE,
-                    name="sleep",
-                )
-            )
+        # A diagnostics.Diagnostics object while diagnostics are collected
+        self.diagnostics = None
+        # A tracing.TraceBuffer while schedule evaluations are traced
+        self.tracer = None
+        if not self.schedule.rules:   # Use the default rules
+            self.schedule.rules = (DEFAULT_SCHEDULE_RULE,)
+
+    @property
+    def clock(self):
+        """The clock providing the time and running the timers of this room."""
+        return self._clock
+
+    @clock.setter
+    def clock(self, clock):
+        self._clock = clock
+        self.log_limited.clock = clock
+
+    def _now(self):
+        """The current time of the clock, in Home Assistant's time zone."""
+        return as_local(self.clock.now())
 
     def __str__(self):
         return f'{self._name}@{self._state}, sp={self._setpoint}'
@@ -194,6 +250,15 @@ class Room:
     def boost_all_temp(self):
         return self._boost_all_temp
 
+    @property
+    def manual_temp(self):
+        return self._manual_temp
+
+    @property
+    def schedule_valid_until(self):
+        """The time the last schedule evaluation result stays valid until, None if unknown."""
+        return self._schedule_valid_until
+
     def format_room_temp(self):
         return f'{self.room_temp:.1f}'
 
@@ -226,6 +291,53 @@ class Room:
     def validate_value(self, value):
         return value
 
+    @callback
+    def eval_expr(self, expr, env):
+        """
+        Evaluate a schedule expression in the given environment. Errors are logged and the exception is returned as
+        the result, so that the schedule can skip the rule.
+        """
+        try:
+            if self.diagnostics is not None:
+                return self.diagnostics.eval_expr(expr, env)
+            return expression.eval_expr(expr, env)
+        except Exception as err:  # pylint: disable=broad-except
+            self.log_limited.error("Room %s failed evaluating expression: %r", self._name, err, key=(self._name, expr))
+            return err
+
+    @callback
+    def invalidate_schedule(self):
+        """Forget the cached schedule result, forcing re-evaluation on the next tick."""
+        self._schedule_evaluated_at = None
+
+    @callback
+    def evaluate_schedule(self, time):
+        """
+        Evaluate the room's schedule at the given time. The result is reused, without evaluating the schedule
+        again, until the time the schedule reported it to stay valid, or until the cache is invalidated.
+        :param time: the time to evaluate the schedule at.
+        :return: the schedule evaluation result
+        """
+        evaluated_at = self._schedule_evaluated_at
+        if evaluated_at is not None and evaluated_at <= time and \
+                (self._schedule_valid_until is None or time < self._schedule_valid_until):
+            if self.tracer is not None:
+                self.tracer.add_reused(time, self._schedule_result)
+            return self._schedule_result
+        diagnostics = self.diagnostics
+        if diagnostics is not None:
+            started = _time.perf_counter()
+        if self.tracer is not None:
+            result, valid_until, tested_count = self.tracer.evaluate_schedule(self, time)
+        else:
+            result, valid_until, tested_count = self.schedule._evaluate_with_validity(self, time)  # pylint: disable=protected-access
+        if diagnostics is not None:
+            diagnostics.add_evaluation(self.name, _time.perf_counter() - started, tested_count)
+        self._schedule_result = result
+        self._schedule_evaluated_at = time
+        self._schedule_valid_until = valid_until
+        return result
+
     @callback
     def valve_boost_set_point(self):
         _, temp = self._valves.has_boost()
@@ -258,12 +370,14 @@ class Room:
                 if room['name'] == self._name:
                     self._setpoint = room['setpoint']
                     self._heating = room['heating']
-                    now = datetime.datetime.now()
+                    now = self._now()
                     if room['boost_end'] is None:
                         self._boost_end = now
                     else:
-                        self._boost_end = datetime.datetime.strptime(room['boost_end'], "%Y-%m-%dT%H:%M:%S.%f")
+                        # Ends saved before times were made aware are naive
+                        self._boost_end = as_local(parse_datetime(room['boost_end']))
                     self._state = getattr(sys.modules[__name__], room['state'])()
+                    self.invalidate_schedule()
                     self._valves.restore(room['setpoint'], room['valve_boost'])
                     duration_in_s = (self._boost_end - now).total_seconds()
                     if duration_in_s < 0:
@@ -271,11 +385,11 @@ class Room:
                     _log.debug("restore boost end %s: %s", self._name, self._boost_end)
                     _log.debug("restore boost duration %s: %s", self._name, divmod(duration_in_s, 60)[0])
                     if isinstance(self._state, ValveBoost):         # TODO RoomBoost
-                        self._valve_boost_timer_remove = async_track_time_interval(
+                        self._valve_boost_timer_remove = self.clock.track_time_interval(
                             self._hass,
                             self.async_valve_boost_end,
                             datetime.timedelta(minutes=divmod(duration_in_s, 60)[0]))
-                        await self._async_determine_heating(as_local(datetime.datetime.now()))
+                        await self._async_determine_heating(self._now())
                     return
         except KeyError:
             _log.warning("No room information to restore")
@@ -293,13 +407,13 @@ class Room:
                     _log.info("Room %s has valve boost", self.name)
                     await self._async_cancel_boost_timer()
                     self._state = self._state.on_event(Event.VALVE_BOOST)
-                    self._valve_boost_timer_remove = async_track_time_interval(
+                    self._valve_boost_timer_remove = self.clock.track_time_interval(
                         self._hass,
                         self.async_valve_boost_end,
                         datetime.timedelta(hours=1))
-                    await self._async_determine_heating(as_local(datetime.datetime.now()))
-                    self._boost_end = datetime.datetime.now() + datetime.timedelta(hours=1)
-                    _log.debug("boost end %s: %s -> %s", self._name, datetime.datetime.now(), self._boost_end)
+                    await self._async_determine_heating(self._now())
+                    self._boost_end = self._now() + datetime.timedelta(hours=1)
+                    _log.debug("boost end %s: %s", self._name, self._boost_end)
             if self._event_cnt % VALVE_EVENTS_THROTTLE == 0:
                 self._event_cnt = 0
                 await self._async_send_set_point(entity_id)
@@ -314,7 +428,10 @@ class Room:
                 ATTR_ENTITY_ID: entity_id,
                 ATTR_TEMPERATURE: self._setpoint
             }
-            await self._hass.services.async_call(CLIMATE_DOMAIN, SERVICE_SET_TEMPERATURE, data)
+            if self.diagnostics is not None:
+                await self.diagnostics.async_call(self._hass, CLIMATE_DOMAIN, SERVICE_SET_TEMPERATURE, data)
+            else:
+                await self._hass.services.async_call(CLIMATE_DOMAIN, SERVICE_SET_TEMPERATURE, data)
 
     async def async_tick(self, time):
         """
@@ -338,16 +455,21 @@ class Room:
         temperature
         :param time: the current time.
         """
-        new_setpoint = await self._state.setpoint(self,  as_local(time))
-        _log.debug("determine_heating %s, new_sp = %s, time = %s", self, new_setpoint, as_local(time))
+        time = as_local(time)
+        new_setpoint = self._state.setpoint(self, time)
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("determine_heating %s, new_sp = %s, time = %s", self, new_setpoint, time)
         if new_setpoint is not None:
             old_setpoint = self._setpoint
+            old_heating = self._heating
             self._setpoint = new_setpoint
             if old_setpoint != new_setpoint:
                 _log.debug("schedule_setpoint")
                 self._valves.schedule_setpoint(new_setpoint)
             self._heating = self._valves.determine_heating(self._setpoint)
-            _log.info("Room %s demands heat: %s", self, self._heating)
+            # Only changes are logged, this runs on every tick
+            if self._heating != old_heating or old_setpoint != new_setpoint:
+                _log.info("Room %s demands heat: %s", self, self._heating)
 
     async def async_away_mode_event(self, away, set_point):
         """
@@ -358,7 +480,7 @@ class Room:
         _log.info("Room %s away mode: %s", self, set_point)
         self._away_temp = set_point
         self._state = self._state.on_event(Event.AWAY_ON if away else Event.AWAY_OFF)
-        await self._async_determine_heating(as_local(datetime.datetime.now()))
+        await self._async_determine_heating(self._now())
 
     async def async_boost_all_mode_event(self, boost):
         """
@@ -369,7 +491,7 @@ class Room:
         _log.info("Room %s boost all mode: %s", self, boost)
         self._boost_all_temp = self.room_temp + (2 if boost else 0)
         self._state = self._state.on_event(Event.BOOST_ALL if boost else Event.CANCEL_ALL)
-        await self._async_determine_heating(as_local(datetime.datetime.now()))
+        await self._async_determine_heating(self._now())
 
     async def async_manual_temp_event(self, manual, set_point):
         """
@@ -381,7 +503,7 @@ class Room:
         _log.info("Room %s manual temp: %s", self, set_point)
         self._manual_temp = set_point
         self._state = self._state.on_event(Event.MANUAL if manual else Event.AUTO)
-        await self._async_determine_heating(as_local(datetime.datetime.now()))
+        await self._async_determine_heating(self._now())
 
     async def async_boost_room_event(self, set_point, duration):
         """
@@ -395,12 +517,12 @@ class Room:
         else:
             self._valve_boost_timer_remove = None   # Cancel valve boost
             self._manual_temp = set_point
-            self._room_boost_timer_remove = async_track_time_interval(
+            self._room_boost_timer_remove = self.clock.track_time_interval(
                 self._hass,
                 self.async_room_boost_end,
                 datetime.timedelta(minutes=duration))
             self._state = self._state.on_event(Event.ROOM_BOOST)
-        await self._async_determine_heating(as_local(datetime.datetime.now()))
+        await self._async_determine_heating(self._now())
 
     async def async_auto_mode_event(self):
         """
@@ -408,8 +530,9 @@ class Room:
         """
         _log.info("Room %s auto mode", self)
         self._setpoint = self.room_temp
+        self.invalidate_schedule()
         self._state = self._state.on_event(Event.AUTO)
-        await self._async_determine_heating(as_local(datetime.datetime.now()))
+        await self._async_determine_heating(self._now())
 
     async def async_valve_boost_end(self, *args):
         """
@@ -422,7 +545,7 @@ class Room:
         self._valve_boost_timer_remove = None
         self._state = self._state.on_event(Event.AUTO)
         self._valves.end_boost()
-        await self._async_determine_heating(as_local(datetime.datetime.now()))
+        await self._async_determine_heating(self._now())
 
     async def async_room_boost_end(self, *args):
         """
@@ -433,7 +556,7 @@ class Room:
         _log.debug("async_room_boost_end")
         await self._async_cancel_boost_timer()
         self._state = self._state.on_event(Event.AUTO)
-        await self._async_determine_heating(as_local(datetime.datetime.now()))
+        await self._async_determine_heating(self._now())
 
 
 class Valves:
@@ -442,9 +565,26 @@ class Valves:
     all the valves in the group
     """
 
-    def __init__(self, valves=None, temp_direction=TempDirection.NONE, room_temp=20):
+    __slots__ = (
+        "_valves",
+        "_room_temp",
+        "_temp_direction",
+        "_weight_sum",
+        "_valve_set_point",
+        "_waiting_synch",
+        "_waiting_synch_setpoint",
+        "_valve_boost",
+        "_valve_boost_dir",
+        "_valve_boost_temp",
+        "_schedule_changed",
+        "log_limited",
+    )
+
+    def __init__(self, valves=None, temp_direction=TempDirection.NONE, room_temp=20, log_limited=None):
         if valves is None:
             valves = {}
+        # The room's RateLimitedLogger, so that suppressed messages count towards it
+        self.log_limited = log_limited if log_limited is not None else util.RateLimitedLogger(_log)
         self._valves = valves
         self._room_temp = room_temp
         self._temp_direction = temp_direction
@@ -486,7 +626,8 @@ class Valves:
             try:
                 local_temp = state.attributes["local_temperature"]
             except KeyError:
-                _log.warning("Valve state does not has local temperature information")
+                self.log_limited.warning("Valve %s state does not has local temperature information", entity_id,
+                                      key=entity_id)
                 return False
             else:
                 prev_temp = self._room_temp
@@ -504,7 +645,8 @@ class Valves:
             try:
                 valve_set_point = state.attributes["occupied_heating_setpoint"]
             except KeyError:
-                _log.warning("Valve state does not has occupied heating setpoint information")
+                self.log_limited.warning("Valve %s state does not has occupied heating setpoint information", entity_id,
+                                      key=entity_id)
                 return False
             else:
                 _log.debug("synched?  %s vs %s", valve_set_point, self._waiting_synch_setpoint)
@@ -516,7 +658,7 @@ class Valves:
             try:
                 self._valve_boost[entity_id] = state.attributes["boost"]
             except KeyError:
-                _log.warning("Unable to store valve boost state")
+                self.log_limited.warning("Unable to store valve %s boost state", entity_id, key=entity_id)
         return True
 
     @callback
@@ -600,7 +742,7 @@ class RoomState(object):
     """
 
     def __init__(self):
-        _log.debug('Entering state %s', str(self))
+        _log.debug('Entering state %s', self)
 
     def on_event(self, event):
         """
@@ -608,7 +750,7 @@ class RoomState(object):
         """
         _log.debug('State on_event %s', event)
 
-    async def setpoint(self, room, time):
+    def setpoint(self, room, time):
         """
         Determines the target temperature. The target temperature is calculated
         differently for each state.
@@ -648,13 +790,14 @@ class Auto(RoomState):
             return RoomBoost()
         return self
 
-    async def setpoint(self, room, time):
+    def setpoint(self, room, time):
         result = None
         if room.schedule is not None:
-            result = await room.schedule.evaluate(room, time)
+            result = room.evaluate_schedule(time)
         if result is None:
-            _log.warning("No suitable value found in schedule. Not changing set-points.")
-            result = room.set_point
+            room.log_limited.warning("No suitable value found in schedule of room %s. Not changing set-points.",
+                                     room.name, key=room.name)
+            result = room.setpoint
         else:
             new_scheduled_value, _ = result[:2]
             result = new_scheduled_value if new_scheduled_value != OFF_VALUE else 5
@@ -672,7 +815,7 @@ class Away(RoomState):
             return Auto()
         return self
 
-    async def setpoint(self, room, time):
+    def setpoint(self, room, time):
         return room.away_temp
 
 
@@ -693,7 +836,7 @@ class HouseBoost(RoomState):
             return RoomBoost()
         return self
 
-    async def setpoint(self, room, time):
+    def setpoint(self, room, time):
         return room.boost_all_temp
 
 
@@ -710,7 +853,7 @@ class ValveBoost(RoomState):
             return Manual()
         return self
 
-    async def setpoint(self, room, time):
+    def setpoint(self, room, time):
         return room.valve_boost_set_point()
 
 
@@ -731,7 +874,7 @@ class Manual(RoomState):
             return Auto()
         return self
 
-    async def setpoint(self, room, time):
+    def setpoint(self, room, time):
         return room.manual_temp
 
 
@@ -747,5 +890,5 @@ class RoomBoost(RoomState):
         elif event == Event.VALVE_BOOST:
             return ValveBoost()
 
-    async def setpoint(self, room, time):
+    def setpoint(self, room, time):
         return room.manual_temp
@@ -2,10 +2,12 @@ import collections
 import datetime
 import pytest
 
+from homeassistant.core import State as HAState
 from homeassistant.util.dt import as_local
 
-from .room import Room, Away, Auto, HouseBoost, ValveBoost
+from .room import Room, Away, Auto, HouseBoost, RoomBoost, ValveBoost
 from . import schedule
+from .clock import VirtualClock
 
 Valve = collections.namedtuple('Valve', ['entity_id', 'weight'])
 State = collections.namedtuple('State', 'attributes')
@@ -36,6 +38,13 @@ def test_name():
     assert r.name == "test"
 
 
+def test_default_schedule_shared():
+    r1 = Room(name="r1", schedule=schedule.Schedule(name="r1", rules=[]))
+    r2 = Room(name="r2", schedule=schedule.Schedule(name="r2", rules=[]))
+    assert r1.schedule.rules == r2.schedule.rules
+    assert r1.schedule.rules[0].sub_schedule is r2.schedule.rules[0].sub_schedule
+
+
 def test_default_room_temp():
     sched = schedule.Schedule(name="test", rules=[])
     r = Room(name="test", schedule=sched)
@@ -122,17 +131,108 @@ class MockServices:
         print('async_listen', args)
 
 
+def _valve_state(setpoint, boost):
+    return HAState("climate.e1", "heat", {
+        'local_temperature': 20,
+        'occupied_heating_setpoint': setpoint,
+        'boost': boost})
+
+
 @pytest.mark.asyncio
 async def test_boost_from_room(one_valve):
     Hass = collections.namedtuple('Hass', ['services', 'bus'])
-    sched = schedule.Schedule(name="test", rules=[])
-    r = Room(name="test", schedule=sched, valves=one_valve)
-    # FIXME Monkeypatch r._hass
+    clock = VirtualClock(datetime.datetime(2020, 6, 1, 12, 0))
+    sched = schedule.Schedule(name="test", rules=[schedule.Rule(value=20)])
+    r = Room(name="test", schedule=sched, valves=one_valve, clock=clock)
     r._hass = Hass(MockServices(), MockServices())
-    state = State(attributes={
-        'local_temperature': 20,
-        'occupied_heating_setpoint': 22,
-        'boost': 'Up'})
-    await r._async_valve_state_change("e1", None, state)
-    await r.async_tick(as_local(datetime.datetime.now()))
+    await r.async_tick(clock.now())
+    await r._async_valve_state_change("e1", _valve_state(20, 'None'), _valve_state(22, 'Up'))
+    assert type(r._state) is ValveBoost
+    assert r._boost_end == as_local(datetime.datetime(2020, 6, 1, 13, 0))
+    await clock.async_advance(datetime.timedelta(minutes=59))
+    assert type(r._state) is ValveBoost
+    await clock.async_advance(datetime.timedelta(minutes=1))
+    assert type(r._state) is Auto
+
+
+@pytest.mark.asyncio
+async def test_room_boost_ends(one_valve):
+    Hass = collections.namedtuple('Hass', ['services', 'bus'])
+    clock = VirtualClock(datetime.datetime(2020, 6, 1, 12, 0))
+    sched = schedule.Schedule(name="test", rules=[schedule.Rule(value=20)])
+    r = Room(name="test", schedule=sched, valves=one_valve, clock=clock)
+    r._hass = Hass(MockServices(), MockServices())
+    await r.async_boost_room_event(23, 30)
+    assert type(r._state) is RoomBoost
+    assert r.setpoint == 23
+    await clock.async_advance(datetime.timedelta(minutes=30))
+    assert type(r._state) is Auto
+    assert r.setpoint == 20
+    # The timer was cancelled when the boost ended
+    assert clock.next_due is None
+
+
+@pytest.mark.asyncio
+async def test_restore_naive_boost_end(one_valve):
+    Hass = collections.namedtuple('Hass', ['services', 'bus'])
+    clock = VirtualClock(as_local(datetime.datetime(2020, 6, 1, 12, 0)))
+    sched = schedule.Schedule(name="test", rules=[schedule.Rule(value=20)])
+    r = Room(name="test", schedule=sched, valves=one_valve, clock=clock)
+    r._hass = Hass(MockServices(), MockServices())
+    await r.restore({'rooms': [{
+        'name': "test", 'setpoint': 22, 'heating': True, 'valve_boost': "+", 'state': "ValveBoost",
+        'boost_end': "2020-06-01T12:30:00.000000"}]})
+    assert r._boost_end == as_local(datetime.datetime(2020, 6, 1, 12, 30))
     assert type(r._state) is ValveBoost
+    await clock.async_advance(datetime.timedelta(minutes=30))
+    assert type(r._state) is Auto
+
+
+@pytest.mark.asyncio
+async def test_schedule_result_reused_while_valid(monkeypatch):
+    sched = schedule.Schedule(name="test", rules=[])
+    r = Room(name="test", schedule=sched)
+    calls = []
+    evaluate = schedule.Schedule._evaluate_with_validity
+
+    def counting_evaluate(*args, **kwargs):
+        calls.append(args)
+        return evaluate(*args, **kwargs)
+
+    monkeypatch.setattr(schedule.Schedule, "_evaluate_with_validity", counting_evaluate)
+    # 2020-06-01 is a Monday, the default schedule changes at 8:30
+    when = as_local(datetime.datetime(2020, 6, 1, 7, 0))
+    await r.async_tick(when)
+    await r.async_tick(when + datetime.timedelta(minutes=1))
+    assert len(calls) == 1
+    assert r.setpoint == 20
+    await r.async_tick(when + datetime.timedelta(hours=2))
+    assert len(calls) == 2
+    assert r.setpoint == 16
+    r.invalidate_schedule()
+    await r.async_tick(when + datetime.timedelta(hours=2, minutes=1))
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_events_use_clock():
+    # 2020-06-01 is a Monday, the default schedule changes at 8:30
+    clock = VirtualClock(datetime.datetime(2020, 6, 1, 7, 0))
+    r = Room(name="test", schedule=schedule.Schedule(name="test", rules=[]), clock=clock)
+    await r.async_away_mode_event(False, 16)
+    assert r.setpoint == 20
+    await clock.async_advance(datetime.timedelta(hours=2))
+    await r.async_away_mode_event(False, 16)
+    assert r.setpoint == 16
+
+
+def test_suppressed_logs_counted_per_room():
+    clock = VirtualClock(datetime.datetime(2020, 1, 1))
+    kitchen = Room(name="kitchen", valves=[Valve('e1', 1)], schedule=schedule.Schedule(name="test", rules=[]))
+    bath = Room(name="bath", valves=[Valve('e2', 1)], schedule=schedule.Schedule(name="test", rules=[]))
+    kitchen.clock = clock
+    assert kitchen.log_limited.clock is clock
+    for _ in range(3):
+        kitchen._valves.update_state('e1', State({}))
+    assert sum(kitchen.log_limited.suppressed.values()) > 0
+    assert not bath.log_limited.suppressed
@@ -8,23 +8,57 @@ if T.TYPE_CHECKING:
     # pylint: disable=cyclic-import,unused-import
     import types
 
+import array
 import logging
+import copy
 import datetime
 import functools
-
-from cached_property import cached_property
+import itertools
 
 from . import util
+from . import analysis
+from . import codegen
 from . import expression
+from . import tracing
 
 _log = logging.getLogger(__name__)
 
 ScheduleEvaluationResultType = T.Tuple[T.Any, T.Set[str], "Rule"]
+ScheduleValidityType = T.Optional[datetime.datetime]
+
+# Marks lazily computed attributes that haven't been computed yet
+_UNSET = object()
+
+_MIDNIGHT = datetime.time(0, 0)
+# (start_ordinal, end_ordinal, wraps) of a rule's date range in a given year
+_DateBounds = T.Tuple[int, int, bool]
+# (start_time, start_plus_days, end_time, end_plus_days) of a rule without times
+_NO_TIMES = (None, None, None, None)  # type: T.Tuple[T.Any, ...]
+
+
+def _check_no_constraints(date: datetime.date) -> bool:  # pylint: disable=unused-argument
+    """Constraint check of rules without constraints."""
+
+    return True
 
 
 class Rule:
     """A rule that can be added to a schedule."""
 
+    __slots__ = (
+        "name",
+        "start_time",
+        "start_plus_days",
+        "end_time",
+        "end_plus_days",
+        "constraints",
+        "expr",
+        "expr_raw",
+        "value",
+        "check_constraints",
+        "_date_bounds",
+    )
+
     # names of schedule rule constraints to be fetched from a rule definition
     CONSTRAINTS = (
         "years",
@@ -48,9 +82,8 @@ class Rule:
         expr_raw: str = None,
         value: T.Any = None,
     ) -> None:
-        _checks = [expr is None, expr_raw is None]
-        if any(_checks) and not all(_checks):
-            raise ValueError("expr and expr_raw may only be passed together")
+        if expr is not None and expr_raw is None:
+            raise ValueError("expr may only be passed together with expr_raw")
         if expr is not None and value is not None:
             raise ValueError("specify only one of expr and value, not both")
 
@@ -65,14 +98,22 @@ class Rule:
             constraints = {}
         self.constraints = constraints
 
+        # expr_raw without expr is the source of a constant expression whose
+        # result has been stored as value
         self.expr = expr
         self.expr_raw = expr_raw
         self.value = value
 
-        # We cache constraint check results for the latest-checked 64 days
-        self.check_constraints = functools.lru_cache(maxsize=64)(
-            self._check_constraints
-        )
+        # We cache constraint check results for the latest-checked 64 days,
+        # rules without constraints need no cache
+        if constraints:
+            self.check_constraints = functools.lru_cache(maxsize=64)(
+                self._check_constraints
+            )
+        else:
+            self.check_constraints = _check_no_constraints
+        # start_date/end_date resolved to ordinals, by year
+        self._date_bounds = None  # type: T.Optional[T.Dict[int, T.Optional[_DateBounds]]]
 
     def __repr__(self) -> str:
         return "<Rule {}{}>".format(
@@ -152,23 +193,207 @@ class Rule:
             "days": lambda a: date.day in a,
             "weeks": lambda a: week in a,
             "weekdays": lambda a: weekday in a,
-            "start_date": lambda a: date >= util.build_date_from_constraint(a, date, 1),
-            "end_date": lambda a: date <= util.build_date_from_constraint(a, date, -1),
         }
         # _log.debug("_check_constraints %s", self.constraints)
+        date_range = False
         for constraint, allowed in self.constraints.items():
-            if not checks[constraint](allowed):  # type: ignore
+            check = checks.get(constraint)
+            if check is None:
+                # start_date or end_date, both are checked at once below
+                date_range = True
+            elif not check(allowed):  # type: ignore
                 return False
-        return True
+        return not date_range or self._check_date_range(date)
+
+    def _check_date_range(self, date: datetime.date) -> bool:
+        """Checks the start_date and end_date constraints against the given
+        date. When both are given without a year and the start lies after the
+        end, the range wraps around the new year."""
+
+        year = date.year
+        if self._date_bounds is None:
+            self._date_bounds = {}
+        try:
+            bounds = self._date_bounds[year]
+        except KeyError:
+            bounds = self._date_bounds[year] = self._get_date_bounds(year)
+
+        if bounds is None:
+            # Missing fields are taken from the date itself
+            start = self.constraints.get("start_date")
+            end = self.constraints.get("end_date")
+            return (
+                start is None or date >= util.build_date_from_constraint(start, date, 1)
+            ) and (
+                end is None or date <= util.build_date_from_constraint(end, date, -1)
+            )
+
+        ordinal = date.toordinal()
+        start_ordinal, end_ordinal, wraps = bounds
+        if wraps:
+            return ordinal >= start_ordinal or ordinal <= end_ordinal
+        return start_ordinal <= ordinal <= end_ordinal
+
+    def _get_date_bounds(self, year: int) -> T.Optional["_DateBounds"]:
+        """Resolves the start_date and end_date constraints for the given year
+        to (start_ordinal, end_ordinal, wraps). Invalid dates like Feb 29 move
+        inwards, as with util.build_date_from_constraint(). None is returned
+        when a constraint lacks the month or day, the bounds then depend on
+        the date checked."""
+
+        start = self.constraints.get("start_date")
+        end = self.constraints.get("end_date")
+        for constraint in (start, end):
+            if constraint is not None and not (
+                "month" in constraint and "day" in constraint
+            ):
+                return None
+
+        default_date = datetime.date(year, 1, 1)
+        start_ordinal = 1
+        end_ordinal = datetime.date.max.toordinal()
+        if start is not None:
+            start_ordinal = util.build_date_from_constraint(
+                start, default_date, 1
+            ).toordinal()
+        if end is not None:
+            end_ordinal = util.build_date_from_constraint(
+                end, default_date, -1
+            ).toordinal()
+        wraps = (
+            start is not None
+            and end is not None
+            and "year" not in start
+            and "year" not in end
+            and (start["month"], start["day"]) > (end["month"], end["day"])
+        )
+        return start_ordinal, end_ordinal, wraps
+
+
+class _PathNode:
+    """An immutable node of a rule path, pointing to the node of the path's
+    prefix. Everything derived from the rules of a path is computed from the
+    parent node in constant time when the node is created, so that paths sharing
+    a prefix share both the nodes and the work."""
+
+    __slots__ = (
+        "parent",
+        "rule",
+        "depth",
+        "raw_times",
+        "times",
+        "constrained_rules",
+        "is_transparent",
+        "is_always_active",
+    )
+
+    def __init__(self, parent: T.Optional["_PathNode"], rule: Rule) -> None:
+        self.parent = parent
+        self.rule = rule
+
+        own = (rule.start_time, rule.start_plus_days, rule.end_time, rule.end_plus_days)
+        if parent is None:
+            self.depth = 1
+            raw_times = _NO_TIMES  # type: T.Tuple[T.Any, ...]
+            constrained_rules = ()  # type: T.Tuple[Rule, ...]
+            is_transparent = True
+        else:
+            self.depth = parent.depth + 1
+            raw_times = parent.raw_times
+            constrained_rules = parent.constrained_rules
+            is_transparent = parent.is_transparent
+
+        if rule.constraints:
+            constrained_rules += (rule,)
+        self.constrained_rules = constrained_rules
+        self.is_transparent = (
+            is_transparent
+            and not rule.constraints
+            and rule.expr is None
+            and rule.value is None
+            and own == _NO_TIMES
+        )
+
+        if parent is not None and own == _NO_TIMES:
+            # Nothing changes, the tuples are shared with the parent
+            self.raw_times = raw_times
+            self.times = parent.times
+        else:
+            # Times are searched from right to left, so the rule's own ones
+            # win over the inherited ones
+            self.raw_times = raw_times = tuple(
+                inherited if value is None else value
+                for value, inherited in zip(own, raw_times)
+            )
+            self.times = self._resolve_times(raw_times)
+        end_time, end_plus_days = self.times[2:]
+        self.is_always_active = not constrained_rules and bool(
+            end_plus_days > 1 or end_plus_days == 1 and end_time >= self.times[0]
+        )
+
+    @staticmethod
+    def _resolve_times(
+        raw_times: T.Tuple[T.Any, ...]
+    ) -> T.Tuple[datetime.time, int, datetime.time, int]:
+        """Fills in defaults for times not set by any rule of a path.
+        Missing times are assumed to be midnight. If not set explicitly,
+        end_plus_days is 1 if start <= end else 0."""
+
+        start_time, start_plus_days, end_time, end_plus_days = raw_times
+        if start_time is None:
+            start_time = _MIDNIGHT
+        if start_plus_days is None:
+            start_plus_days = 0
+        if end_time is None:
+            end_time = _MIDNIGHT
+        if end_plus_days is None:
+            end_plus_days = 1 if start_time >= end_time else 0
+        return start_time, start_plus_days, end_time, end_plus_days
+
+    def iter_rules(self) -> T.Iterator[Rule]:
+        """Yields the rules from this node up to the root of the path."""
+
+        node = self  # type: T.Optional[_PathNode]
+        while node is not None:
+            yield node.rule
+            node = node.parent
+
+    def ancestor(self, depth: int) -> T.Optional["_PathNode"]:
+        """Returns the node at the given depth on the way to the root, None
+        for depth 0 or if this node isn't that deep."""
+
+        node = self  # type: T.Optional[_PathNode]
+        while node is not None and node.depth > depth:
+            node = node.parent
+        return node if node is not None and node.depth == depth else None
+
+    @property
+    def rules(self) -> T.Tuple[Rule, ...]:
+        """The rules from the root of the path up to this node. They aren't
+        cached, since a tuple per node would take memory quadratic in the
+        depth of nested schedules."""
+
+        rules = list(self.iter_rules())
+        rules.reverse()
+        return tuple(rules)
+
+    @property
+    def rules_with_expr_or_value(self) -> T.Tuple[Rule, ...]:
+        """The rules containing an expression or value, from left to right."""
+
+        return tuple(filter(lambda r: r.expr is not None or r.value is not None, self.rules))
 
 
 class RulePath:
     """A chain of rules starting from a root schedule through sub-schedule
-    rules."""
+    rules. The chain is stored as a linked list of immutable nodes, so copying
+    a path or adding a rule to it takes constant time."""
+
+    __slots__ = ("root_schedule", "_node")
 
-    def __init__(self, root_schedule: "Schedule") -> None:
+    def __init__(self, root_schedule: "Schedule", node: _PathNode = None) -> None:
         self.root_schedule = root_schedule
-        self.rules = []  # type: T.List[Rule]
+        self._node = node
 
     def __add__(self, other: "RulePath") -> "RulePath":
         """Creates a new RulePath with rules of self and another path.
@@ -177,9 +402,8 @@ class RulePath:
 
         if (
             not isinstance(other, RulePath)
-            or not self.rules
-            or not isinstance(self.rules[-1], SubScheduleRule)
-            or self.rules[-1].sub_schedule is not other.root_schedule
+            or not isinstance(self.last_rule, SubScheduleRule)
+            or self.last_rule.sub_schedule is not other.root_schedule
         ):
             raise ValueError("{!r} and {!r} don't fit together".format(self, other))
 
@@ -209,72 +433,80 @@ class RulePath:
             rule,  # pylint: disable=undefined-loop-variable
         )
 
-    def _clear_cache(self) -> None:
-        """Clears out all cached properties. For internal use only."""
+    def child(self, rule: Rule) -> "RulePath":
+        """Returns a new path made of this path and the given rule, which
+        has to be a rule of the sub schedule this path leads to. Unlike
+        append(), no checks are made."""
 
-        for attr in ("is_always_active", "rules_with_expr_or_value", "times"):
-            try:
-                del self.__dict__[attr]
-            except KeyError:
-                pass
+        return RulePath(self.root_schedule, _PathNode(self._node, rule))
 
-    def append(self, rule: Rule, clear_cache: bool = True) -> None:
+    def append(self, rule: Rule) -> None:
         """Add's a rule to the end of the path.
         A ValueError is raised when the previous rule is a final rule."""
 
-        if self.rules and not isinstance(self.rules[-1], SubScheduleRule):
+        node = self._node
+        if node is not None and not isinstance(node.rule, SubScheduleRule):
             raise ValueError(
                 "The previous rule in the path ({}) is no SubScheduleRule.".format(
-                    self.rules[-1]
+                    node.rule
                 )
             )
 
-        self.rules.append(rule)
-
-        if clear_cache:
-            self._clear_cache()
+        self._node = _PathNode(node, rule)
 
     def copy(self) -> "RulePath":
         """Returns a mutable copy of this path."""
 
-        path = type(self)(self.root_schedule)
-        path.extend(self.rules)
-        return path
+        return RulePath(self.root_schedule, self._node)
 
     def extend(self, rules: T.Iterable[Rule]) -> None:
         """Appends each of the supplied rules to the path.
         If append() raises a ValueError for one of the rules to add, all rules already
-        appended successfully are removed again before the exception is re-raised.
-        Note: This method is not thread-safe!"""
+        appended successfully are removed again before the exception is re-raised."""
 
-        added = 0
+        node = self._node
         try:
             for rule in rules:
-                self.append(rule, clear_cache=False)
-                added += 1
+                self.append(rule)
         except ValueError:
-            for _ in range(added):
-                self.pop(clear_cache=False)
-            added = 0
+            self._node = node
             raise
-        finally:
-            if added:
-                self._clear_cache()
 
     def includes_schedule(self, schedule: "Schedule") -> bool:
         """Checks whether the given schedule is included in this path."""
         if schedule is self.root_schedule:
             return True
-        for rule in self.rules:
+        for rule in self.iter_rules_reversed():
             if isinstance(rule, SubScheduleRule) and rule.sub_schedule is schedule:
                 return True
         return False
 
+    def shares_prefix(self, other: "RulePath", size: int) -> bool:
+        """Returns whether this path starts with the first size rules of the
+        other path, which has at least that many rules."""
+
+        if size == 0:
+            return True
+        if self._node is None or other._node is None:
+            return False
+        node = self._node.ancestor(size)
+        other_node = other._node.ancestor(size)
+        if node is None:
+            return False
+        while node is not other_node:
+            if node is None or other_node is None or node.rule is not other_node.rule:
+                return False
+            node = node.parent
+            other_node = other_node.parent
+        return True
+
     def check_constraints(self, date: datetime.date) -> bool:
         """Checks constraints of all rules along this path against the
         given date and returns whether they are all fulfilled."""
 
-        for rule in self.rules:
+        if self._node is None:
+            return True
+        for rule in self._node.constrained_rules:
             if not rule.check_constraints(date):
                 return False
         return True
@@ -312,87 +544,99 @@ class RulePath:
             return True
         return False
 
-    @cached_property
+    @property
     def is_always_active(self) -> bool:
         """Whether this path is always active (no constraints and spans >= 1 day)."""
 
-        for rule in self.rules:
-            if rule.constraints:
-                return False
+        if self._node is None:
+            return True
+        return self._node.is_always_active
+
+    @property
+    def is_transparent(self) -> bool:
+        """Whether no rule of this path has times, constraints, an expression or
+        a value, meaning that the path has no influence on the evaluation of the
+        rules following it."""
 
-        start_time, _, end_time, end_plus_days = self.times
-        return bool(end_plus_days > 1 or end_plus_days == 1 and end_time >= start_time)
+        return self._node is None or self._node.is_transparent
 
     @property
     def is_final(self) -> bool:
         """Returns whether the last rule in the path is no SubScheduleRule."""
 
-        if not self.rules:
+        if self._node is None:
             return False
-        return not isinstance(self.rules[-1], SubScheduleRule)
+        return not isinstance(self._node.rule, SubScheduleRule)
+
+    @property
+    def depth(self) -> int:
+        """The number of rules in the path."""
 
-    def pop(self, clear_cache: bool = True) -> Rule:
+        return 0 if self._node is None else self._node.depth
+
+    def pop(self) -> Rule:
         """Removes and returns the rightmost rule of this path.
         IndexError is raised when there is no rule to pop."""
 
-        try:
-            rule = self.rules.pop()
-        except IndexError:
+        node = self._node
+        if node is None:
             raise IndexError("no rule to pop")
-        if clear_cache:
-            self._clear_cache()
-        return rule
+        self._node = node.parent
+        return node.rule
+
+    @property
+    def last_rule(self) -> T.Optional[Rule]:
+        """The rightmost rule of the path, None if it's empty."""
+
+        return None if self._node is None else self._node.rule
+
+    def iter_rules_reversed(self) -> T.Iterator[Rule]:
+        """Yields the rules of the path from right to left, without building
+        a tuple of them like rules does."""
 
-    @cached_property
+        if self._node is not None:
+            yield from self._node.iter_rules()
+
+    @property
+    def constrained_rules(self) -> T.Tuple[Rule, ...]:
+        """The rules of the path with constraints, from left to right."""
+
+        return () if self._node is None else self._node.constrained_rules
+
+    @property
+    def rules(self) -> T.Tuple[Rule, ...]:
+        """The rules of the path, from the root schedule's rule on."""
+
+        if self._node is None:
+            return ()
+        return self._node.rules
+
+    @property
     def rules_with_expr_or_value(self) -> T.Tuple[Rule, ...]:
         """A tuple with rules of the path containing an expression or value,
         sorted from left to right."""
 
-        return tuple(
-            filter(lambda r: r.expr is not None or r.value is not None, self.rules)
-        )
+        if self._node is None:
+            return ()
+        return self._node.rules_with_expr_or_value
 
-    @cached_property
+    @property
     def times(self) -> T.Tuple[datetime.time, int, datetime.time, int]:
         """Returns (start_time, start_plus_days, end_time, end_plus_days) for this
         path. Rules are searched for these values from right to left.
         Missing times are assumed to be midnight. If not set explicitly, end_plus_days
         is 1 if start <= end else 0."""
 
-        for rule in reversed(self.rules):
-            if rule.start_time is not None:
-                start_time = rule.start_time
-                break
-        else:
-            start_time = datetime.time(0, 0)
-
-        for rule in reversed(self.rules):
-            if rule.start_plus_days is not None:
-                start_plus_days = rule.start_plus_days
-                break
-        else:
-            start_plus_days = 0
-
-        for rule in reversed(self.rules):
-            if rule.end_time is not None:
-                end_time = rule.end_time
-                break
-        else:
-            end_time = datetime.time(0, 0)
-
-        for rule in reversed(self.rules):
-            if rule.end_plus_days is not None:
-                end_plus_days = rule.end_plus_days
-                break
-        else:
-            end_plus_days = 1 if start_time >= end_time else 0
-
-        return start_time, start_plus_days, end_time, end_plus_days
+        if self._node is None:
+            return datetime.time(0, 0), 0, datetime.time(0, 0), 1
+        return self._node.times
 
 
 class SubScheduleRule(Rule):
     """A schedule rule with a sub-schedule attached."""
 
+    __slots__ = ("sub_schedule",)
+
     def __init__(self, sub_schedule: "Schedule", *args: T.Any, **kwargs: T.Any) -> None:
         super().__init__(*args, **kwargs)
 
@@ -406,125 +650,540 @@ class SubScheduleRule(Rule):
         return tokens
 
 
+# Kinds of outcomes of walking a list of rule paths
+_RESULT = 0
+_ABORT = 1
+_BREAK = 2
+_EXHAUSTED = 3
+
+
+class _Outcome(T.NamedTuple):
+    """The outcome of walking a list of rule paths. value and rule are set for
+    _RESULT, levels is the number of levels still to break out of for _BREAK.
+    tested_paths is None when an expression was evaluated and memoizable is
+    False when the outcome depends on the room."""
+
+    kind: int
+    value: T.Any
+    rule: T.Optional[Rule]
+    postprocessors: T.Tuple["expression.types.Postprocessor", ...]
+    markers: T.FrozenSet[str]
+    levels: int
+    tested_paths: T.Optional[T.Tuple[RulePath, ...]]
+    memoizable: bool
+
+
+class _EvaluationContext:
+    """State shared by all parts of a single schedule evaluation."""
+
+    __slots__ = ("room", "when", "trace", "expr_cache", "expr_env", "_env_cache")
+
+    def __init__(
+        self,
+        room: "Room",
+        when: datetime.datetime,
+        env_cache: T.List[T.Dict[str, T.Any]] = None,
+        trace: T.List["tracing.TraceEventType"] = None,
+    ) -> None:
+        self.room = room
+        self.when = when
+        # Events of the evaluation are appended here when it's traced
+        self.trace = trace
+        self.expr_cache = {}  # type: T.Dict[types.CodeType, T.Any]
+        self.expr_env = None  # type: T.Optional[T.Dict[str, T.Any]]
+        self._env_cache = env_cache
+
+    def get_expr_env(self) -> T.Dict[str, T.Any]:
+        """Returns the environment for evaluating expressions, building it
+        on first use. When an env_cache list is given, the environment is
+        derived from the one stored there by a previous evaluation for the
+        same room, which is then replaced."""
+
+        if self.expr_env is None:
+            env_cache = self._env_cache
+            if env_cache:
+                self.expr_env = expression.rebase_expr_env(
+                    env_cache[0], self.room, self.when
+                )
+            else:
+                self.expr_env = expression.build_expr_env(self.room, self.when)
+            if env_cache is not None:
+                env_cache[:] = [self.expr_env]
+        return self.expr_env
+
+
+class ScheduleBatchResult(T.NamedTuple):
+    """Results of evaluating a schedule at many points in time, as returned
+    by Schedule.evaluate_many(). values and rule_indices are parallel to the
+    evaluated datetimes. A rule index refers to the matching rule in rules,
+    -1 means that no result was found."""
+
+    values: T.List[T.Any]
+    rule_indices: "array.array"
+    rules: T.List["Rule"]
+
+
 class Schedule:
-    """Holds the schedule for a room with all its rules."""
+    """Holds the schedule for a room with all its rules.
+    A shared schedule is included into the schedules of several rooms, its
+    evaluation results are then reused between them where possible."""
+
+    __slots__ = (
+        "name",
+        "_rules",
+        "shared",
+        "memoize",
+        "_shared_memo",
+        "_compiled",
+        "_unfolded",
+        "_reachable",
+    )
 
-    def __init__(self, name: str = None, rules: T.Iterable[Rule] = None) -> None:
+    def __init__(
+        self, name: str = None, rules: T.Iterable[Rule] = None, shared: bool = False
+    ) -> None:
         self.name = name
-        self.rules = []  # type: T.List[Rule]
+        self.shared = shared
+        # Cleared when expressions may read names whose values differ by room
+        # without is_room_independent() noticing, e.g. ones set by the
+        # expression_environment script
+        self.memoize = True
+        self._shared_memo = None  # type: T.Optional[T.Tuple[datetime.datetime, _Outcome]]
+        self._compiled = _UNSET  # type: T.Any
+        self._unfolded = None  # type: T.Optional[T.Tuple[RulePath, ...]]
+        self._reachable = None  # type: T.Optional[T.Tuple[RulePath, ...]]
+        self._rules = ()  # type: T.Tuple[Rule, ...]
         if rules is not None:
-            self.rules.extend(rules)
+            self.rules = rules  # type: ignore
+
+    @property
+    def rules(self) -> T.Tuple[Rule, ...]:
+        """The rules of the schedule. They can only be replaced as a whole,
+        which drops the paths and results derived from the old ones. Schedules
+        including this one must not have unfolded their paths yet."""
+
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules: T.Iterable[Rule]) -> None:
+        self._rules = tuple(rules)
+        self._shared_memo = None
+        self._compiled = _UNSET
+        self._unfolded = None
+        self._reachable = None
 
     def __add__(self, other: "Schedule") -> "Schedule":
         if not isinstance(other, Schedule):
             return NotImplemented
-        return Schedule(name=self.name, rules=self.rules + other.rules)
+        return Schedule(name=self.name, rules=[*self.rules, *other.rules])
 
     def __repr__(self) -> str:
         if self.name is None:
             return "<Schedule of {} rules>".format(len(self.rules))
         return "<Schedule {} of {} rules>".format(repr(self.name), len(self.rules))
 
-    async def evaluate(  # pylint: disable=too-many-branches,too-many-locals,too-many-statements
-        self, room: "Room", when: datetime.datetime
-    ) -> T.Optional[ScheduleEvaluationResultType]:
+    async def evaluate(
+        self, room: "Room", when: datetime.datetime, with_validity: bool = False
+    ) -> T.Any:
+        """Asynchronous variant of evaluate_sync()."""
+
+        return self.evaluate_sync(room, when, with_validity)
+
+    def evaluate_sync(
+        self, room: "Room", when: datetime.datetime, with_validity: bool = False
+    ) -> T.Any:
         """Evaluates the schedule, computing the value for the time the
         given datetime object represents. The resulting value, a set of
         markers applied to the value and the matching rule are returned.
         If no value could be found in the schedule (e.g. all rules
-        evaluate to Next()), None is returned."""
+        evaluate to Next()), None is returned.
+        If with_validity is True, a tuple (result, valid_until) is returned
+        instead, where valid_until is the point in time until which the
+        result is known to stay the same (see get_valid_until())."""
+
+        if not with_validity:
+            return self._evaluate(room, when)[0]
+        return self._evaluate_with_validity(room, when)[:2]
+
+    def evaluate_many(
+        self, room: "Room", datetimes: T.Iterable[datetime.datetime]
+    ) -> ScheduleBatchResult:
+        """Evaluates the schedule at each of the given points in time, which
+        should be in ascending order to benefit from the batching.
+        A result is reused for following datetimes as long as it is known to
+        stay valid, so paths are only walked again when a rule may have become
+        active or inactive. Expression environments are derived from each
+        other instead of being built from scratch for every evaluation.
+        Markers of the results aren't included."""
+
+        values = []  # type: T.List[T.Any]
+        rule_indices = array.array("i")
+        rules = []  # type: T.List[Rule]
+        rule_index_map = {}  # type: T.Dict[int, int]
+        env_cache = []  # type: T.List[T.Dict[str, T.Any]]
+
+        evaluated_at = None  # type: T.Optional[datetime.datetime]
+        valid_until = None  # type: ScheduleValidityType
+        value = None  # type: T.Any
+        rule_index = -1
+        for when in datetimes:
+            if (
+                evaluated_at is None
+                or when < evaluated_at
+                or valid_until is not None
+                and when >= valid_until
+            ):
+                result, valid_until, _ = self._evaluate_with_validity(
+                    room, when, env_cache
+                )
+                evaluated_at = when
+                if result is None:
+                    value, rule_index = None, -1
+                else:
+                    value, _, rule = result
+                    if id(rule) not in rule_index_map:
+                        rule_index_map[id(rule)] = len(rules)
+                        rules.append(rule)
+                    rule_index = rule_index_map[id(rule)]
+            values.append(value)
+            rule_indices.append(rule_index)
+        return ScheduleBatchResult(values, rule_indices, rules)
+
+    def evaluate_range(
+        self,
+        room: "Room",
+        start: datetime.datetime,
+        end: datetime.datetime,
+        step: datetime.timedelta = datetime.timedelta(minutes=1),
+    ) -> ScheduleBatchResult:
+        """Evaluates the schedule at every step from start (inclusive) to end
+        (exclusive), see evaluate_many()."""
+
+        if step <= datetime.timedelta(0):
+            raise ValueError("step must be positive, not {!r}".format(step))
+
+        def gen() -> T.Generator[datetime.datetime, None, None]:
+            when = start
+            while when < end:
+                yield when
+                when += step
+
+        return self.evaluate_many(room, gen())
+
+    def _evaluate_with_validity(
+        self,
+        room: "Room",
+        when: datetime.datetime,
+        env_cache: T.List[T.Dict[str, T.Any]] = None,
+        trace: T.List["tracing.TraceEventType"] = None,
+    ) -> T.Tuple[
+        T.Optional[ScheduleEvaluationResultType], ScheduleValidityType, T.Optional[int]
+    ]:
+        """Evaluates the schedule and returns the result together with the
+        point in time until which it stays valid and the number of paths
+        that were checked for activity, None once an expression was evaluated."""
+
+        result, tested_paths = self._evaluate(room, when, env_cache, trace)
+        if tested_paths is None:
+            # The result depends on an expression, it's only valid right now
+            return result, when, None
+        return result, self.get_valid_until(when, tested_paths), len(tested_paths)
+
+    def _evaluate(
+        self,
+        room: "Room",
+        when: datetime.datetime,
+        env_cache: T.List[T.Dict[str, T.Any]] = None,
+        trace: T.List["tracing.TraceEventType"] = None,
+    ) -> T.Tuple[
+        T.Optional[ScheduleEvaluationResultType], T.Optional[T.List[RulePath]]
+    ]:
+        """Implements evaluate(). Returns the result together with the list
+        of paths that were checked for activity. Once an expression has been
+        evaluated, the result doesn't only depend on time and None is returned
+        instead of that list. env_cache and trace are passed on to
+        _EvaluationContext. Compiled schedules are evaluated by their compiled
+        function, all others, and all that are traced, by the interpreter."""
+
+        compiled = self.compiled
+        if compiled is not None and trace is None:
+            result, tested_paths = compiled.evaluate(room, when)
+            return result, list(tested_paths)
+        return self._interpret(room, when, env_cache, trace)
+
+    def _interpret(
+        self,
+        room: "Room",
+        when: datetime.datetime,
+        env_cache: T.List[T.Dict[str, T.Any]] = None,
+        trace: T.List["tracing.TraceEventType"] = None,
+    ) -> T.Tuple[
+        T.Optional[ScheduleEvaluationResultType], T.Optional[T.List[RulePath]]
+    ]:
+        """Evaluates the schedule by walking its paths, see _evaluate()."""
+
+        context = _EvaluationContext(room, when, env_cache, trace)
+        outcome = self._walk(context, self.reachable, ())
+        tested_paths = None if outcome.tested_paths is None else list(outcome.tested_paths)
+        if outcome.kind != _RESULT:
+            #_log.debug("Found no result.")
+            return None, tested_paths
+
+        markers = set(outcome.markers)
+        result = self._apply_postprocessors(room, outcome, markers)
+        if result is None:
+            #_log.error("Aborting schedule evaluation.")
+            return None, tested_paths
+
+        # _log.debug(
+        #     "Final result: {!r}, markers: {}".format(result, markers),
+        #
+        # )
+        return (result, markers, outcome.rule), tested_paths
 
-        def log(msg: str, path: RulePath, *args: T.Any, **kwargs: T.Any) -> None:
-            """Wrapper around _LOGGER.debug that prefixes spaces to the
-            message based on the length of the rule path."""
-            pass
-            # prefix = " " * 4 * max(0, len(path.rules) - 1) #+ "\u251c\u2500"
-            # _log.debug("{} {}".format(prefix, msg))
+    @staticmethod
+    def _apply_postprocessors(
+        room: "Room", outcome: "_Outcome", markers: T.Set[str]
+    ) -> T.Any:
+        """Validates the value found and applies the postprocessors collected
+        before it. Markers added by postprocessors are added to markers.
+        None is returned when a value or postprocessor is rejected by the room,
+        meaning the evaluation has to be aborted."""
 
-        # _log("Assuming it to be {}.".format(when))
+        postprocessors = []
+        for postprocessor in outcome.postprocessors:
+            if isinstance(postprocessor, expression.types.PostprocessorValueMixin):
+                value = room.validate_value(postprocessor.value)
+                if value is None:
+                    # _log.debug("Aborting schedule evaluation.")
+                    return None
+                if value is not postprocessor.value:
+                    # Postprocessors may be shared between rooms, don't modify them
+                    postprocessor = copy.copy(postprocessor)
+                    postprocessor.value = value
+            postprocessors.append(postprocessor)
+
+        postprocessor_markers = set()  # type: T.Set[str]
+        result = room.validate_value(outcome.value)
+        if result is None:
+            pass
+            # _log.warning(
+            #     "Maybe this is an expression? If so, set it "
+            #     "as the rule's 'expression' parameter "
+            #     "rather than as 'value'.",
+            # )
+        elif postprocessors:
+            # _log.debug("Applying postprocessors.")
+            for postprocessor in postprocessors:
+                if result is None:
+                    break
+                markers.update(postprocessor_markers)
+                postprocessor_markers.clear()
+                #_log.debug("+ {}".format(repr(postprocessor)))
+                try:
+                    result = postprocessor.apply(result)
+                except expression.types.PostprocessingError as err:
+                    # _log.debug(
+                    #     "Error while applying {} to result {}: {}".format(
+                    #         repr(postprocessor), repr(result), err
+                    #     ),
+                    # )
+                    result = None
+                    break
+                #_log.debug("= {}".format(repr(result)))
+                if isinstance(result, expression.types.Mark):
+                    result = result.unwrap(postprocessor_markers)
+                result = room.validate_value(result)
 
-        expr_cache = {}  # type: T.Dict[types.CodeType, T.Any]
-        expr_env = None
+        if result is not None:
+            markers.update(postprocessor_markers)
+        return result
+
+    def _evaluate_shared(
+        self, context: "_EvaluationContext", ancestors: T.Tuple["Schedule", ...]
+    ) -> "_Outcome":
+        """Walks the paths of this shared schedule, as reached through a
+        transparent SubScheduleRule. The outcome is memoized for the point in time
+        being evaluated, so that all rooms including this schedule share the work,
+        unless it depends on the room the schedule is evaluated for."""
+
+        memo = self._shared_memo
+        if memo is not None and memo[0] == context.when:
+            if context.trace is not None:
+                context.trace.append((tracing.MEMO, None, memo[1].value))
+            return memo[1]
+        outcome = self._walk(context, self.reachable, ancestors, nested=True)
+        if self.memoize and outcome.memoizable:
+            self._shared_memo = (context.when, outcome)
+        return outcome
+
+    def _walk(  # pylint: disable=too-many-branches,too-many-locals,too-many-statements
+        self,
+        context: "_EvaluationContext",
+        paths: T.Iterable[RulePath],
+        ancestors: T.Tuple["Schedule", ...],
+        nested: bool = False,
+    ) -> "_Outcome":
+        """Walks the given paths in order until one of them provides a value or
+        aborts the evaluation. Postprocessors found on the way are collected.
+        When nested is True, the paths are those of a shared sub-schedule and
+        Break() results leaving it are passed up to the caller instead of being
+        handled here. ancestors are the schedules that include the walked ones."""
+
+        room = context.room
+        # Steps are only recorded while the room is traced, see tracing
+        trace = context.trace
+        when = context.when
+        expr_cache = context.expr_cache
+        tested_paths = []  # type: T.Optional[T.List[RulePath]]
+        memoizable = True
         markers = set()  # type: T.Set[str]
-        postprocessors = []
-        paths = list(self.unfolded)
+        postprocessors = []  # type: T.List[expression.types.Postprocessor]
+
+        def outcome(
+            kind: int, value: T.Any = None, rule: Rule = None, levels: int = 0
+        ) -> _Outcome:
+            return _Outcome(
+                kind,
+                value,
+                rule,
+                tuple(postprocessors),
+                frozenset(markers),
+                levels,
+                None if tested_paths is None else tuple(tested_paths),
+                memoizable,
+            )
+
+        paths = list(paths)
         path_idx = 0
         while path_idx < len(paths):
             path = paths[path_idx]
             path_idx += 1
 
-            last_rule = path.rules[-1]
+            last_rule = path.last_rule
             if isinstance(last_rule, SubScheduleRule):
-                log("[SUB]  {}".format(path), path)
-                continue
-            if not path.is_active(when):
-                log("[INA]  {}".format(path), path)
-                continue
-            log("[ACT]  {}".format(path), path)
-
-            result = None
-            for rule in reversed(path.rules_with_expr_or_value):
-                if rule.expr is not None:
-                    plain_value = False
-                    try:
-                        result = expr_cache[rule.expr]
-                    except KeyError:
-                        if expr_env is None:
-                            expr_env = expression.build_expr_env(room, when)
-                        result = room.eval_expr(rule.expr, expr_env)
-                        expr_cache[rule.expr] = result
-                        log("=> {}".format(repr(result)), path)
+                if not (last_rule.sub_schedule.shared and path.is_transparent):
+                    if trace is not None:
+                        trace.append((tracing.SUB, path, None))
+                    continue
+                if trace is not None:
+                    trace.append((tracing.SHARED, path, None))
+                # The schedules of the path, from its root, without the shared one
+                included = [
+                    r.sub_schedule  # type: ignore
+                    for r in itertools.islice(path.iter_rules_reversed(), 1, None)
+                ]
+                included.append(path.root_schedule)
+                included.reverse()
+                shared = last_rule.sub_schedule._evaluate_shared(  # pylint: disable=protected-access
+                    context, ancestors + tuple(included)
+                )
+                # The paths of the shared schedule have been walked already
+                size = path.depth
+                while (
+                    path_idx < len(paths)
+                    and paths[path_idx].root_schedule == path.root_schedule
+                    and paths[path_idx].shares_prefix(path, size)
+                ):
+                    path_idx += 1
+                markers.update(shared.markers)
+                postprocessors.extend(shared.postprocessors)
+                if shared.tested_paths is None:
+                    tested_paths = None
+                elif tested_paths is not None:
+                    tested_paths.extend(shared.tested_paths)
+                memoizable = memoizable and shared.memoizable
+                if shared.kind == _RESULT:
+                    return outcome(_RESULT, shared.value, shared.rule)
+                if shared.kind == _EXHAUSTED:
+                    continue
+                if shared.kind == _ABORT:
+                    result = expression.types.Abort()
+                else:
+                    result = expression.types.Break(shared.levels)
+            else:
+                if tested_paths is not None:
+                    tested_paths.append(path)
+                if not path.is_active(when):
+                    if trace is not None:
+                        trace.append((tracing.INACTIVE, path, None))
+                    continue
+                if trace is not None:
+                    trace.append((tracing.ACTIVE, path, None))
+
+                result = None
+                for rule in path.iter_rules_reversed():
+                    if rule.expr is None and rule.value is None:
+                        continue
+                    if rule.expr is not None:
+                        tested_paths = None
+                        if memoizable and not expression.is_room_independent(rule.expr):
+                            memoizable = False
+                        try:
+                            result = expr_cache[rule.expr]
+                        except KeyError:
+                            result = room.eval_expr(rule.expr, context.get_expr_env())
+                            expr_cache[rule.expr] = result
+                            if trace is not None:
+                                trace.append((tracing.EXPR, path, result))
+                        else:
+                            if trace is not None:
+                                trace.append((tracing.EXPR_CACHED, path, result))
                         # Unwrap a result with markers
                         if isinstance(result, expression.types.Mark):
                             result = result.unwrap(markers)
+                        if isinstance(result, Exception):
+                            room.log_limited.error("Failed expression: %r", rule.expr_raw, key=rule)
+                    elif rule.value is not None:
+                        result = rule.value
+                        if trace is not None:
+                            trace.append((tracing.VALUE, path, result))
+                        # Values of folded constant expressions may have markers
+                        if isinstance(result, expression.types.Mark):
+                            result = result.unwrap(markers)
+
+                    if isinstance(
+                        result, expression.types.IncludeSchedule
+                    ) and (
+                        path.includes_schedule(result.schedule)
+                        or result.schedule in ancestors
+                    ):
+                        # Prevent reusing IncludeSchedule results that would
+                        # lead to a cycle. This happens when a rule of an
+                        # included schedule returns Inherit() and the search
+                        # then reaches the IncludeSchedule within the parent.
+                        if trace is not None:
+                            trace.append((tracing.SKIP, path, None))
+                        if not path.includes_schedule(result.schedule):
+                            # Depends on where this schedule has been included
+                            memoizable = False
+                        result = None
+                    elif result is None or isinstance(result, expression.types.Inherit):
+                        if trace is not None:
+                            trace.append((tracing.SKIP, path, None))
+                        result = None
                     else:
-                        log(
-                            "=> {}  [cache-hit]".format(repr(result)),
-                            path
-                        )
-                    if isinstance(result, Exception):
-                        _log.error("Failed expression: {}".format(repr(rule.expr_raw)))
-                elif rule.value is not None:
-                    plain_value = True
-                    result = rule.value
-                    log("=> {}".format(repr(result)), path)
-
-                if isinstance(
-                    result, expression.types.IncludeSchedule
-                ) and path.includes_schedule(result.schedule):
-                    # Prevent reusing IncludeSchedule results that would
-                    # lead to a cycle. This happens when a rule of an
-                    # included schedule returns Inherit() and the search
-                    # then reaches the IncludeSchedule within the parent.
-                    log(
-                        "==   skipping in favour of parent to prevent cycle",
-                        path,
-                    )
-                    result = None
-                elif result is None or isinstance(result, expression.types.Inherit):
-                    log("==   skipping in favour of parent", path)
-                    result = None
-                else:
-                    break
+                        break
 
             if result is None:
-                _log.warning(
-                    "No expression/value definition found, skipping {}.".format(path),
+                room.log_limited.warning(
+                    "No expression/value definition found, skipping %s.", path, key=last_rule
                 )
             elif isinstance(result, Exception):
-                _log.warning(
-                    "Evaluation failed, skipping {}.".format(path)
-                )
+                room.log_limited.warning("Evaluation failed, skipping %s.", path, key=last_rule)
             elif isinstance(result, expression.types.Abort):
-                break
+                return outcome(_ABORT)
             elif isinstance(result, expression.types.Break):
-                prefix_size = max(0, len(path.rules) - result.levels)
-                prefix = path.rules[:prefix_size]
-                log("== breaking out of {}".format(prefix), path)
+                if nested and result.levels > path.depth:
+                    # Breaking out of the shared schedule, the caller handles that
+                    return outcome(_BREAK, levels=result.levels - path.depth)
+                prefix_size = max(0, path.depth - result.levels)
+                if trace is not None:
+                    trace.append((tracing.BREAK, path, result))
                 while (
                     path_idx < len(paths)
                     and paths[path_idx].root_schedule == path.root_schedule
-                    and paths[path_idx].rules[:prefix_size] == prefix
+                    and paths[path_idx].shares_prefix(path, prefix_size)
                 ):
                     del paths[path_idx]
             elif isinstance(result, expression.types.IncludeSchedule):
@@ -534,64 +1193,47 @@ class Schedule:
                 _path.pop()
                 _path.append(SubScheduleRule(result.schedule))
                 paths.insert(path_idx, _path)
-                for i, sub_path in enumerate(result.schedule.unfolded):
+                for i, sub_path in enumerate(result.schedule.reachable):
                     paths.insert(path_idx + i + 1, _path + sub_path)
             elif isinstance(result, expression.types.Postprocessor):
-                if isinstance(result, expression.types.PostprocessorValueMixin):
-                    value = room.validate_value(result.value)
-                    if value is None:
-                        # _log.debug("Aborting schedule evaluation.")
-                        break
-                    result.value = value
                 postprocessors.append(result)
             elif isinstance(result, expression.types.Next):
                 continue
             else:
-                postprocessor_markers = set()  # type: T.Set[str]
-                result = room.validate_value(result)
-                if result is None and plain_value:
-                    pass
-                    # _log.warning(
-                    #     "Maybe this is an expression? If so, set it "
-                    #     "as the rule's 'expression' parameter "
-                    #     "rather than as 'value'.",
-                    # )
-                elif postprocessors:
-                    # _log.debug("Applying postprocessors.")
-                    for postprocessor in postprocessors:
-                        if result is None:
-                            break
-                        markers.update(postprocessor_markers)
-                        postprocessor_markers.clear()
-                        #_log.debug("+ {}".format(repr(postprocessor)))
-                        try:
-                            result = postprocessor.apply(result)
-                        except expression.types.PostprocessingError as err:
-                            # _log.debug(
-                            #     "Error while applying {} to result {}: {}".format(
-                            #         repr(postprocessor), repr(result), err
-                            #     ),
-                            # )
-                            result = None
-                            break
-                        #_log.debug("= {}".format(repr(result)))
-                        if isinstance(result, expression.types.Mark):
-                            result = result.unwrap(postprocessor_markers)
-                        result = room.validate_value(result)
+                return outcome(_RESULT, result, last_rule)
 
-                if result is None:
-                    #_log.error("Aborting schedule evaluation.")
-                    break
-                markers.update(postprocessor_markers)
+        return outcome(_EXHAUSTED)
 
-                # _log.debug(
-                #     "Final result: {!r}, markers: {}".format(result, markers),
-                #
-                # )
-                return result, markers, last_rule
+    @staticmethod
+    def get_valid_until(
+        now: datetime.datetime, paths: T.Iterable[RulePath]
+    ) -> ScheduleValidityType:
+        """Returns the point in time until which an evaluation result obtained
+        at now by testing the given paths stays valid. This is the earliest
+        upcoming start or end of any of the paths, but no later than the
+        next midnight if one of them has date constraints.
+        None is returned when no upcoming change can be found."""
 
-        #_log.debug("Found no result.")
-        return None
+        current_time = now.time()
+        today = now.date()
+        tomorrow = today + datetime.timedelta(days=1)
+        valid_until = None  # type: ScheduleValidityType
+        for path in paths:
+            if path.is_always_active:
+                continue
+            start_time, _, end_time, _ = path.times
+            times = [start_time, end_time]
+            if path.constrained_rules:
+                times.append(datetime.time(0, 0))
+            for _time in times:
+                if _time <= current_time:
+                    # midnight transition
+                    until = datetime.datetime.combine(tomorrow, _time, now.tzinfo)
+                else:
+                    until = datetime.datetime.combine(today, _time, now.tzinfo)
+                if valid_until is None or until < valid_until:
+                    valid_until = until
+        return valid_until
 
     def get_next_scheduling_datetime(
         self, now: datetime.datetime
@@ -628,31 +1270,70 @@ class Schedule:
         at. Rules of sub-schedules are considered as well."""
 
         times = set()  # type: T.Set[datetime.time]
-        for path in self.unfolded:
+        for path in self.reachable:
             if not path.is_always_active:
                 start_time, _, end_time, _ = path.times
                 times.update((start_time, end_time))
         return times
 
     def unfolded_gen(self) -> T.Generator[RulePath, None, None]:
-        """Implements recursive building of RulePath objects as a generator.
+        """Implements building of RulePath objects as a generator.
         It's like the unfolded property, but without being cached."""
 
-        for rule in self.rules:
-            path = RulePath(self)
-            path.append(rule)
+        # Depth-first traversal with an explicit stack of rule iterators, each
+        # path is built from its parent in constant time
+        root = RulePath(self)
+        stack = [(root, iter(self.rules))]
+        while stack:
+            parent, rules = stack[-1]
+            rule = next(rules, None)
+            if rule is None:
+                stack.pop()
+                continue
+            path = parent.child(rule)
             yield path
             if isinstance(rule, SubScheduleRule):
-                for sub_path in rule.sub_schedule.unfolded_gen():
-                    yield path + sub_path
+                stack.append((path, iter(rule.sub_schedule.rules)))
+
+    @property
+    def compiled(self) -> T.Optional[codegen.CompiledSchedule]:
+        """The schedule compiled into a Python function, or None if it can't be
+        compiled because it contains expressions.
+        NOTE: This property is only evaluated once, the result is kept."""
+
+        if self._compiled is _UNSET:
+            self._compiled = codegen.compile_schedule(self)
+        return self._compiled
 
-    @cached_property
+    @property
+    def reachable(self) -> T.Tuple[RulePath, ...]:
+        """The unfolded rule paths without those that can never provide a
+        result (see analysis.find_dead_paths()). These are the paths walked
+        when evaluating the schedule, unfolded still holds all of them.
+        NOTE: This property is only evaluated once, the result is kept."""
+
+        if self._reachable is None:
+            dead = {id(path) for path, _ in self.find_dead_paths()}
+            self._reachable = tuple(
+                path for path in self.unfolded if id(path) not in dead
+            )
+        return self._reachable
+
+    def find_dead_paths(self) -> T.List[T.Tuple[RulePath, str]]:
+        """Returns the unfolded paths that can never provide a result, each
+        together with the reason."""
+
+        return analysis.find_dead_paths(self)
+
+    @property
     def unfolded(self) -> T.Tuple[RulePath, ...]:
         """Returns a tuple of rule paths.
         The last rule of a path may either be a SubScheduleRule (meaning
         the path leads to a node) or a Rule (meaning the path leads to
         a leaf). A node is returned first, followed by it's successors
         (like in depth-first search).
-        NOTE: This is a cached property and only evaluated once."""
+        NOTE: This property is only evaluated once, the result is kept."""
 
-        return tuple(self.unfolded_gen())
\ No newline at end of file
+        if self._unfolded is None:
+            self._unfolded = tuple(self.unfolded_gen())
+        return self._unfolded
\ No newline at end of file
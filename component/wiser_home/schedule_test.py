@@ -0,0 +1,430 @@
+import datetime
+import gc
+import logging
+import tracemalloc
+
+import pytest
+
+from . import expression, schedule, util
+from .util import RangingSet
+
+
+class Room:
+    """Minimal room, counting the expressions it evaluates."""
+
+    def __init__(self, name="test"):
+        self.name = name
+        self.evaluated = []
+        self.log_limited = util.RateLimitedLogger(logging.getLogger(__name__))
+
+    def validate_value(self, value):
+        return value
+
+    def eval_expr(self, expr, env):
+        self.evaluated.append(expr)
+        return expression.eval_expr(expr, env)
+
+
+def expr_rule(expr_raw, **kwargs):
+    return schedule.Rule(expr=util.compile_expression(expr_raw), expr_raw=expr_raw, **kwargs)
+
+
+def room_schedule(shared, value):
+    return schedule.Schedule(rules=[schedule.SubScheduleRule(shared), schedule.Rule(value=value)])
+
+
+@pytest.fixture
+def workday_schedule():
+    return schedule.Schedule(name="test", rules=[
+        schedule.Rule(
+            value=20,
+            start_time=datetime.time(6, 0),
+            end_time=datetime.time(8, 30),
+            constraints={"weekdays": RangingSet(range(1, 6))}
+        ),
+        schedule.Rule(
+            value=18,
+            start_time=datetime.time(17, 0),
+            end_time=datetime.time(22, 0),
+        ),
+        schedule.Rule(value=16),
+    ])
+
+
+@pytest.mark.asyncio
+async def test_evaluate_value(workday_schedule):
+    # 2020-06-01 is a Monday
+    result = await workday_schedule.evaluate(Room(), datetime.datetime(2020, 6, 1, 7, 0))
+    value, markers, rule = result
+    assert value == 20
+    assert not markers
+    assert rule is workday_schedule.rules[0]
+
+
+@pytest.mark.asyncio
+async def test_evaluate_valid_until_end_of_active_rule(workday_schedule):
+    result, valid_until = await workday_schedule.evaluate(
+        Room(), datetime.datetime(2020, 6, 1, 7, 0), with_validity=True)
+    assert result[0] == 20
+    assert valid_until == datetime.datetime(2020, 6, 1, 8, 30)
+
+
+@pytest.mark.asyncio
+async def test_evaluate_valid_until_next_start(workday_schedule):
+    result, valid_until = await workday_schedule.evaluate(
+        Room(), datetime.datetime(2020, 6, 1, 12, 0), with_validity=True)
+    assert result[0] == 16
+    assert valid_until == datetime.datetime(2020, 6, 1, 17, 0)
+
+
+@pytest.mark.asyncio
+async def test_evaluate_valid_until_capped_at_midnight(workday_schedule):
+    # Saturday late evening, the weekday constraint may change at midnight
+    result, valid_until = await workday_schedule.evaluate(
+        Room(), datetime.datetime(2020, 6, 6, 23, 0), with_validity=True)
+    assert result[0] == 16
+    assert valid_until == datetime.datetime(2020, 6, 7, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_evaluate_valid_until_unbounded():
+    sched = schedule.Schedule(rules=[schedule.Rule(value=16)])
+    result, valid_until = await sched.evaluate(
+        Room(), datetime.datetime(2020, 6, 1, 12, 0), with_validity=True)
+    assert result[0] == 16
+    assert valid_until is None
+
+
+@pytest.mark.asyncio
+async def test_shared_schedule_evaluated_once_per_tick():
+    shared = schedule.Schedule(rules=[expr_rule("Add(1)")], shared=True)
+    room = Room()
+    when = datetime.datetime(2020, 6, 1, 7, 0)
+    assert (await room_schedule(shared, 20).evaluate(room, when))[0] == 21
+    assert (await room_schedule(shared, 18).evaluate(room, when))[0] == 19
+    assert len(room.evaluated) == 1
+    await room_schedule(shared, 18).evaluate(room, when + datetime.timedelta(minutes=1))
+    assert len(room.evaluated) == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_schedule_room_dependent_not_reused():
+    shared = schedule.Schedule(rules=[expr_rule("Add(len(room_name))")], shared=True)
+    room_a = Room("a")
+    room_b = Room("bb")
+    when = datetime.datetime(2020, 6, 1, 7, 0)
+    assert (await room_schedule(shared, 20).evaluate(room_a, when))[0] == 21
+    assert (await room_schedule(shared, 20).evaluate(room_b, when))[0] == 22
+    assert len(room_a.evaluated) == 1
+    assert len(room_b.evaluated) == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_schedule_environment_access_not_reused():
+    shared = schedule.Schedule(rules=[expr_rule("Add(len(eval('room_name')))")], shared=True)
+    when = datetime.datetime(2020, 6, 1, 7, 0)
+    assert (await room_schedule(shared, 20).evaluate(Room("a"), when))[0] == 21
+    assert (await room_schedule(shared, 20).evaluate(Room("bb"), when))[0] == 22
+
+
+@pytest.mark.asyncio
+async def test_shared_schedule_not_memoized():
+    shared = schedule.Schedule(rules=[expr_rule("Add(1)")], shared=True)
+    shared.memoize = False
+    room = Room()
+    when = datetime.datetime(2020, 6, 1, 7, 0)
+    await room_schedule(shared, 20).evaluate(room, when)
+    await room_schedule(shared, 18).evaluate(room, when)
+    assert len(room.evaluated) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("expr_raw,expected", [
+    ("Break()", 20),
+    ("Break(2)", None),
+    ("Inherit()", 16),
+    ("Next()", 16),
+    ("Abort()", None),
+])
+async def test_shared_schedule_control_results(expr_raw, expected):
+    when = datetime.datetime(2020, 6, 1, 7, 0)
+    for is_shared in (False, True):
+        shared = schedule.Schedule(
+            rules=[expr_rule(expr_raw), schedule.Rule(value=16)], shared=is_shared)
+        result = await room_schedule(shared, 20).evaluate(Room(), when)
+        assert (result and result[0]) == expected
+
+
+@pytest.mark.asyncio
+async def test_folded_constant_with_markers():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(
+            expr_raw="Mark(20, Mark.OVERLAY)",
+            value=expression.types.Mark(20, expression.types.Mark.OVERLAY)
+        ),
+    ])
+    room = Room()
+    value, markers, _ = await sched.evaluate(room, datetime.datetime(2020, 6, 1, 7, 0))
+    assert value == 20
+    assert markers == {"OVERLAY"}
+    assert not room.evaluated
+
+
+def test_evaluate_sync(workday_schedule):
+    value, _, rule = workday_schedule.evaluate_sync(Room(), datetime.datetime(2020, 6, 1, 18, 0))
+    assert value == 18
+    assert rule is workday_schedule.rules[1]
+
+
+def test_schedule_helper_evaluate(workday_schedule):
+    when = datetime.datetime(2020, 6, 1, 7, 0)
+    env = expression.build_expr_env(Room(), when)
+    assert env["schedule"].evaluate(workday_schedule)[0] == 20
+
+
+def test_schedule_helper_next_results(workday_schedule):
+    when = datetime.datetime(2020, 6, 1, 7, 0)
+    env = expression.build_expr_env(Room(), when)
+    results = env["schedule"].next_results(
+        workday_schedule, end=datetime.datetime(2020, 6, 1, 23, 0))
+    assert [(when.time(), result[0]) for when, result in results] == [
+        (datetime.time(7, 0), 20),
+        (datetime.time(8, 30), 16),
+        (datetime.time(17, 0), 18),
+        (datetime.time(22, 0), 16),
+        (datetime.time(23, 0), 16),
+    ]
+
+
+def test_evaluate_many_matches_evaluate_sync(workday_schedule):
+    room = Room()
+    start = datetime.datetime(2020, 6, 5, 0, 0)
+    times = [start + datetime.timedelta(minutes=17 * i) for i in range(400)]
+    batch = workday_schedule.evaluate_many(room, times)
+    assert len(batch.values) == len(batch.rule_indices) == len(times)
+    for when, value, index in zip(times, batch.values, batch.rule_indices):
+        value_sync, _, rule = workday_schedule.evaluate_sync(room, when)
+        assert value == value_sync
+        assert batch.rules[index] is rule
+
+
+def test_evaluate_range_reuses_valid_results(workday_schedule, monkeypatch):
+    calls = []
+    evaluate_with_validity = schedule.Schedule._evaluate_with_validity
+
+    def counting(*args, **kwargs):
+        calls.append(args[2])
+        return evaluate_with_validity(*args, **kwargs)
+
+    monkeypatch.setattr(schedule.Schedule, "_evaluate_with_validity", counting)
+    start = datetime.datetime(2020, 6, 1, 0, 0)
+    batch = workday_schedule.evaluate_range(Room(), start, start + datetime.timedelta(days=1))
+    assert len(batch.values) == 24 * 60
+    assert batch.values[7 * 60] == 20
+    assert batch.values[18 * 60] == 18
+    assert batch.values[12 * 60] == 16
+    assert [when.time() for when in calls] == [
+        datetime.time(0, 0),
+        datetime.time(6, 0),
+        datetime.time(8, 30),
+        datetime.time(17, 0),
+        datetime.time(22, 0),
+    ]
+
+
+def test_evaluate_range_with_expression():
+    sched = schedule.Schedule(rules=[expr_rule("now.hour + 0.5 * (date.day - 1)")])
+    room = Room()
+    start = datetime.datetime(2020, 6, 1, 0, 0)
+    batch = sched.evaluate_range(
+        room, start, start + datetime.timedelta(days=2), datetime.timedelta(hours=1))
+    assert batch.values == [hour + 0.5 * day for day in range(2) for hour in range(24)]
+    assert list(batch.rule_indices) == [0] * 48
+    assert batch.rules == [sched.rules[0]]
+    assert len(room.evaluated) == 48
+
+
+def test_evaluate_range_rejects_non_positive_step(workday_schedule):
+    start = datetime.datetime(2020, 6, 1, 0, 0)
+    with pytest.raises(ValueError):
+        workday_schedule.evaluate_range(Room(), start, start, datetime.timedelta(0))
+
+
+def test_evaluate_many_no_result():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(value=20, start_time=datetime.time(6, 0), end_time=datetime.time(7, 0)),
+    ])
+    batch = sched.evaluate_many(Room(), [
+        datetime.datetime(2020, 6, 1, 5, 0),
+        datetime.datetime(2020, 6, 1, 6, 30),
+    ])
+    assert batch.values == [None, 20]
+    assert list(batch.rule_indices) == [-1, 0]
+
+
+def test_unfolded_paths_share_prefixes():
+    inner = schedule.Schedule(rules=[
+        schedule.Rule(value=20, start_time=datetime.time(6, 0)),
+        schedule.Rule(value=18),
+    ])
+    outer = schedule.Schedule(rules=[
+        schedule.SubScheduleRule(
+            inner,
+            end_time=datetime.time(9, 0),
+            constraints={"weekdays": RangingSet({1})},
+        ),
+        schedule.Rule(value=16),
+    ])
+    node_path, first, second, last = outer.unfolded
+    assert first.rules == (outer.rules[0], inner.rules[0])
+    assert first.times == (datetime.time(6, 0), 0, datetime.time(9, 0), 0)
+    assert second.times == (datetime.time(0, 0), 0, datetime.time(9, 0), 0)
+    assert not second.is_always_active
+    assert last.is_always_active
+    assert node_path.is_transparent is False
+    assert first.rules[:1] == node_path.rules
+    # Monday and Tuesday
+    assert first.is_active(datetime.datetime(2020, 6, 1, 7, 0))
+    assert not first.is_active(datetime.datetime(2020, 6, 2, 7, 0))
+
+
+def test_deeply_nested_unfolding():
+    sched = schedule.Schedule(rules=[schedule.Rule(value=1)])
+    for _ in range(500):
+        sched = schedule.Schedule(rules=[schedule.SubScheduleRule(sched)])
+    paths = sched.unfolded
+    assert len(paths) == 501
+    assert paths[-1].depth == 501
+    assert paths[-1].rules_with_expr_or_value[-1].value == 1
+    assert sched.evaluate_sync(Room(), datetime.datetime(2020, 6, 1))[0] == 1
+
+
+def _evaluation_memory(depth):
+    sched = schedule.Schedule(rules=[schedule.Rule(value=1)])
+    for _ in range(depth):
+        sched = schedule.Schedule(rules=[schedule.SubScheduleRule(sched)])
+    sched.unfolded  # pylint: disable=pointless-statement
+    gc.collect()
+    tracemalloc.start()
+    try:
+        sched.evaluate_sync(Room(), datetime.datetime(2020, 6, 1), with_validity=True)
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current
+
+
+def test_evaluation_memory_linear_in_depth():
+    # Quadratic growth would quadruple it
+    assert _evaluation_memory(800) < 3 * _evaluation_memory(400)
+
+
+def test_rule_path_prefixes():
+    inner = schedule.Schedule(rules=[schedule.Rule(value=20), schedule.Rule(value=18)])
+    sub_rule = schedule.SubScheduleRule(inner)
+    outer = schedule.Schedule(rules=[sub_rule])
+    node_path, first, second = outer.unfolded
+    assert first.last_rule is inner.rules[0]
+    assert schedule.RulePath(outer).last_rule is None
+    assert first.shares_prefix(second, 1)
+    assert first.shares_prefix(node_path, 1)
+    assert not first.shares_prefix(second, 2)
+    assert not node_path.shares_prefix(first, 2)
+    assert first.shares_prefix(second, 0)
+    # Separately built paths with the same rules
+    copy = schedule.RulePath(outer)
+    copy.extend([sub_rule, inner.rules[0]])
+    assert copy.shares_prefix(first, 2)
+    assert list(first.iter_rules_reversed()) == [inner.rules[0], sub_rule]
+    assert first.includes_schedule(inner)
+    assert not node_path.includes_schedule(schedule.Schedule())
+
+
+def test_rule_path_editing():
+    sub = schedule.Schedule(rules=[schedule.Rule(value=20)])
+    sub_rule = schedule.SubScheduleRule(sub)
+    path = schedule.RulePath(schedule.Schedule(rules=[sub_rule]))
+    path.append(sub_rule)
+    copied = path.copy()
+    copied.append(sub.rules[0])
+    assert path.rules == (sub_rule,)
+    assert copied.rules == (sub_rule, sub.rules[0])
+    with pytest.raises(ValueError):
+        copied.extend([sub.rules[0]])
+    assert copied.depth == 2
+    with pytest.raises(ValueError):
+        path.extend([sub.rules[0], sub.rules[0]])
+    assert path.rules == (sub_rule,)
+    assert path.pop() is sub_rule
+    with pytest.raises(IndexError):
+        path.pop()
+
+
+def date_rule(**constraints):
+    return schedule.Rule(value=20, constraints=constraints)
+
+
+def days_matching(rule, year):
+    day = datetime.date(year, 1, 1)
+    matching = []
+    while day.year == year:
+        if rule.check_constraints(day):
+            matching.append(day)
+        day += datetime.timedelta(days=1)
+    return matching
+
+
+def test_date_range_within_year():
+    rule = date_rule(start_date={"month": 3, "day": 10}, end_date={"month": 3, "day": 12})
+    assert days_matching(rule, 2020) == [
+        datetime.date(2020, 3, 10), datetime.date(2020, 3, 11), datetime.date(2020, 3, 12)]
+
+
+def test_date_range_wraps_around_new_year():
+    rule = date_rule(start_date={"month": 12, "day": 30}, end_date={"month": 1, "day": 2})
+    assert days_matching(rule, 2021) == [
+        datetime.date(2021, 1, 1), datetime.date(2021, 1, 2),
+        datetime.date(2021, 12, 30), datetime.date(2021, 12, 31)]
+
+
+def test_date_range_with_years_doesnt_wrap():
+    rule = date_rule(
+        start_date={"year": 2021, "month": 12, "day": 30},
+        end_date={"year": 2021, "month": 1, "day": 2})
+    assert days_matching(rule, 2021) == []
+
+
+def test_date_range_invalid_dates_move_inwards():
+    rule = date_rule(start_date={"month": 2, "day": 29}, end_date={"month": 2, "day": 30})
+    assert days_matching(rule, 2021) == []
+    assert days_matching(rule, 2020) == [datetime.date(2020, 2, 29)]
+    rule = date_rule(start_date={"month": 2, "day": 29})
+    assert days_matching(rule, 2021)[0] == datetime.date(2021, 3, 1)
+
+
+def test_partial_date_range_uses_checked_date():
+    rule = date_rule(start_date={"day": 28})
+    assert rule.check_constraints(datetime.date(2021, 2, 28))
+    assert rule.check_constraints(datetime.date(2021, 5, 30))
+    assert not rule.check_constraints(datetime.date(2021, 5, 27))
+
+
+def test_date_range_checked_once(monkeypatch):
+    calls = []
+    check_date_range = schedule.Rule._check_date_range
+
+    def counting(self, date):
+        calls.append(date)
+        return check_date_range(self, date)
+
+    monkeypatch.setattr(schedule.Rule, "_check_date_range", counting)
+    rule = date_rule(
+        start_date={"month": 3, "day": 10}, end_date={"month": 3, "day": 12},
+        weekdays=RangingSet(range(1, 8)))
+    assert rule.check_constraints(datetime.date(2020, 3, 11))
+    assert calls == [datetime.date(2020, 3, 11)]
+    # Other constraints are checked first
+    rule = date_rule(start_date={"month": 3, "day": 10}, weekdays=RangingSet())
+    assert not rule.check_constraints(datetime.date(2020, 3, 11))
+    assert len(calls) == 1
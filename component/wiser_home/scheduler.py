@@ -0,0 +1,224 @@
+"""
+This module runs the control loops of all WiserHome entities sharing a clock
+from a single timer. Entities register with the HouseScheduler of their hass
+and clock, which keeps them in a heap ordered by the time they are due next
+and only arms a timer for the earliest of them.
+
+An entity is due every interval. Entities registered one after another are
+offset from each other by STAGGER_STEP, cycling through STAGGER_SLOTS offsets,
+so that the ticks of many houses don't all land on the same boundary. Those
+that are due at the same time run one after the other, yielding to the event
+loop in between. An entity can also ask to run earlier than its interval,
+when the schedule of one of its rooms is about to change its result.
+"""
+import typing as T
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+
+from homeassistant.util import dt as dt_util
+
+from .clock import Clock, TimerAction
+from .const import DOMAIN, SCHEDULE_INTERVAL
+
+_log = logging.getLogger(__name__)
+
+# Number of offsets the due times of entities are spread over
+STAGGER_SLOTS = 10
+
+# Time between two offsets, shortened for intervals too short to fit them
+STAGGER_STEP = datetime.timedelta(seconds=1)
+
+DEFAULT_INTERVAL = datetime.timedelta(minutes=SCHEDULE_INTERVAL)
+
+NextDueType = T.Callable[[], T.Optional[datetime.datetime]]
+
+
+class _Entry:
+    """An entity's action registered with a HouseScheduler."""
+
+    __slots__ = ("action", "interval", "next_due", "interval_due", "cancelled")
+
+    def __init__(
+        self,
+        action: TimerAction,
+        interval: datetime.timedelta,
+        next_due: T.Optional[NextDueType],
+        interval_due: datetime.datetime,
+    ) -> None:
+        self.action = action
+        self.interval = interval
+        self.next_due = next_due
+        # The next due time following the interval, in UTC
+        self.interval_due = interval_due
+        self.cancelled = False
+
+
+class HouseScheduler:
+    """Runs the actions registered with it when they are due, with one
+    timer of the clock armed at a time. Due times are kept in UTC, so that
+    those of clocks with and without time zone can be compared."""
+
+    __slots__ = (
+        "_hass",
+        "_clock",
+        "_on_empty",
+        "_entries",
+        "_counter",
+        "_registered",
+        "_timer_remove",
+        "_timer_due",
+        "_running",
+    )
+
+    def __init__(
+        self, hass: T.Any, clock: Clock, on_empty: T.Callable[[], None] = None
+    ) -> None:
+        self._hass = hass
+        self._clock = clock
+        # Called when the last entry has been removed
+        self._on_empty = on_empty
+        # (due, sequence number, entry), the sequence number keeps entries due
+        # at the same time in the order they were pushed
+        self._entries = []  # type: T.List[T.Tuple[datetime.datetime, int, _Entry]]
+        self._counter = itertools.count()
+        # Counts registrations, giving out the offsets in turn
+        self._registered = itertools.count()
+        self._timer_remove = None  # type: T.Optional[T.Callable[[], None]]
+        self._timer_due = None  # type: T.Optional[datetime.datetime]
+        self._running = False
+
+    def __repr__(self) -> str:
+        return "<HouseScheduler of {} entries>".format(len(self))
+
+    def __len__(self) -> int:
+        return sum(1 for _, _, entry in self._entries if not entry.cancelled)
+
+    def register(
+        self,
+        action: TimerAction,
+        interval: datetime.timedelta = DEFAULT_INTERVAL,
+        next_due: NextDueType = None,
+    ) -> T.Callable[[], None]:
+        """Calls action every interval from now on, with the time it is
+        called at. After each call, next_due is asked for an earlier time
+        to call action at, times that aren't between now and the next
+        interval are ignored. Returns a function cancelling the calls."""
+
+        if interval <= datetime.timedelta(0):
+            raise ValueError("interval must be positive, not {!r}".format(interval))
+        step = min(STAGGER_STEP, interval / STAGGER_SLOTS)
+        offset = step * (next(self._registered) % STAGGER_SLOTS)
+        entry = _Entry(action, interval, next_due, dt_util.as_utc(self._clock.now()) + interval + offset)
+        self._push(entry, entry.interval_due)
+
+        def remove() -> None:
+            entry.cancelled = True
+            self._arm()
+            if self._on_empty is not None and not len(self):
+                self._on_empty()
+
+        return remove
+
+    @property
+    def next_due(self) -> T.Optional[datetime.datetime]:
+        """The time, in UTC, the next entry is due at, None if there is none."""
+
+        while self._entries and self._entries[0][2].cancelled:
+            heapq.heappop(self._entries)
+        return self._entries[0][0] if self._entries else None
+
+    def _push(self, entry: _Entry, due: datetime.datetime) -> None:
+        heapq.heappush(self._entries, (due, next(self._counter), entry))
+        self._arm()
+
+    def _arm(self) -> None:
+        """Arms the timer for the earliest entry, unless it already is or
+        due entries are being run."""
+
+        if self._running:
+            return
+        due = self.next_due
+        if due == self._timer_due:
+            return
+        if self._timer_remove is not None:
+            self._timer_remove()
+        self._timer_remove = self._timer_due = None
+        if due is not None:
+            self._timer_remove = self._clock.track_point_in_time(
+                self._hass, self._async_run, self._to_clock_time(due)
+            )
+            self._timer_due = due
+
+    def _to_clock_time(self, when: datetime.datetime) -> datetime.datetime:
+        """Converts a time in UTC to the local time without time zone if
+        the clock has none."""
+
+        if self._clock.now().tzinfo is None:
+            return dt_util.as_local(when).replace(tzinfo=None)
+        return when
+
+    async def _async_run(self, now: datetime.datetime) -> None:
+        """Timer action running the entries due at now, one after the other."""
+
+        self._timer_remove = self._timer_due = None
+        self._running = True
+        try:
+            now_utc = dt_util.as_utc(now)
+            ran = False
+            while self._entries and self._entries[0][0] <= now_utc:
+                _, _, entry = heapq.heappop(self._entries)
+                if entry.cancelled:
+                    continue
+                if ran:
+                    # Let other work run between the houses due at once
+                    await asyncio.sleep(0)
+                    if entry.cancelled:
+                        continue
+                ran = True
+                try:
+                    await entry.action(now)
+                except Exception:  # pylint: disable=broad-except
+                    _log.exception("Error running %r", entry.action)
+                if not entry.cancelled:
+                    heapq.heappush(
+                        self._entries, (self._get_due(entry, now_utc), next(self._counter), entry)
+                    )
+        finally:
+            self._running = False
+            self._arm()
+
+    @staticmethod
+    def _get_due(entry: _Entry, now_utc: datetime.datetime) -> datetime.datetime:
+        """Returns the time an entry that ran at now is due next."""
+
+        while entry.interval_due <= now_utc:
+            entry.interval_due += entry.interval
+        due = entry.interval_due
+        if entry.next_due is not None:
+            early = entry.next_due()
+            if early is not None:
+                early = dt_util.as_utc(early)
+                if now_utc < early < due:
+                    due = early
+        return due
+
+
+def get_scheduler(hass: T.Any, clock: Clock) -> HouseScheduler:
+    """Returns the scheduler shared by the entities of hass running on the
+    given clock, creating it on first use. It is dropped again once the
+    last entry registered with it has been removed."""
+
+    schedulers = hass.data.setdefault(DOMAIN, {}).setdefault("schedulers", {})
+    scheduler = schedulers.get(clock)
+    if scheduler is None:
+
+        def drop() -> None:
+            if schedulers.get(clock) is scheduler:
+                del schedulers[clock]
+
+        scheduler = schedulers[clock] = HouseScheduler(hass, clock, drop)
+    return scheduler
@@ -0,0 +1,201 @@
+import asyncio
+import datetime
+import types
+
+import pytest
+
+from .clock import VirtualClock
+from .const import DOMAIN
+from .scheduler import STAGGER_SLOTS, STAGGER_STEP, get_scheduler
+
+START = datetime.datetime(2020, 1, 1)
+MINUTE = datetime.timedelta(minutes=1)
+
+
+def _recorder(calls, name):
+    async def action(now):
+        calls.append((name, now))
+    return action
+
+
+def _armed_timers(clock):
+    return [timer for _, _, timer in clock._timers if not timer.cancelled]
+
+
+def _setup():
+    clock = VirtualClock(START)
+    hass = types.SimpleNamespace(data={})
+    return clock, get_scheduler(hass, clock)
+
+
+def test_get_scheduler_shared_per_clock():
+    hass = types.SimpleNamespace(data={})
+    clock = VirtualClock(START)
+    assert get_scheduler(hass, clock) is get_scheduler(hass, clock)
+    assert get_scheduler(hass, clock) is not get_scheduler(hass, VirtualClock(START))
+
+
+def test_get_scheduler_dropped_when_empty():
+    hass = types.SimpleNamespace(data={})
+    clock = VirtualClock(START)
+    scheduler = get_scheduler(hass, clock)
+    remove_first = scheduler.register(_recorder([], "first"))
+    remove_second = scheduler.register(_recorder([], "second"))
+    remove_first()
+    assert get_scheduler(hass, clock) is scheduler
+    remove_second()
+    assert clock not in hass.data[DOMAIN]["schedulers"]
+    new_scheduler = get_scheduler(hass, clock)
+    assert new_scheduler is not scheduler
+    remove_new = new_scheduler.register(_recorder([], "new"))
+    # Removing twice leaves the new scheduler alone
+    remove_second()
+    assert get_scheduler(hass, clock) is new_scheduler
+    remove_new()
+
+
+@pytest.mark.asyncio
+async def test_one_timer_for_all_entries():
+    clock, scheduler = _setup()
+    calls = []
+    for index in range(20):
+        scheduler.register(_recorder(calls, index))
+    assert len(scheduler) == 20
+    assert len(_armed_timers(clock)) == 1
+    await clock.async_advance(3 * MINUTE + STAGGER_SLOTS * STAGGER_STEP)
+    assert len(calls) == 3 * 20
+    assert len(_armed_timers(clock)) == 1
+
+
+@pytest.mark.asyncio
+async def test_entries_staggered():
+    clock, scheduler = _setup()
+    calls = []
+    for index in range(STAGGER_SLOTS + 1):
+        scheduler.register(_recorder(calls, index))
+    await clock.async_advance(MINUTE + STAGGER_SLOTS * STAGGER_STEP)
+    # Offsets are reused once all have been given out
+    assert calls[:2] == [(0, START + MINUTE), (STAGGER_SLOTS, START + MINUTE)]
+    assert calls[2:] == [
+        (index, START + MINUTE + index * STAGGER_STEP) for index in range(1, STAGGER_SLOTS)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stagger_fits_short_interval():
+    clock, scheduler = _setup()
+    calls = []
+    interval = datetime.timedelta(seconds=5)
+    for index in range(STAGGER_SLOTS):
+        scheduler.register(_recorder(calls, index), interval)
+    await clock.async_advance(interval)
+    assert len(calls) == 1
+    await clock.async_advance(interval)
+    assert len(calls) == STAGGER_SLOTS + 1
+    assert all(when < START + 2 * interval for _, when in calls[:STAGGER_SLOTS])
+
+
+@pytest.mark.asyncio
+async def test_next_due_runs_earlier():
+    clock, scheduler = _setup()
+    calls = []
+    change = START + datetime.timedelta(seconds=90)
+    scheduler.register(_recorder(calls, "house"), MINUTE, lambda: change)
+    await clock.async_advance(3 * MINUTE)
+    assert [when for _, when in calls] == [
+        START + MINUTE, change, START + 2 * MINUTE, START + 3 * MINUTE
+    ]
+
+
+@pytest.mark.asyncio
+async def test_next_due_outside_interval_ignored():
+    clock, scheduler = _setup()
+    calls = []
+    scheduler.register(_recorder(calls, "past"), MINUTE, lambda: START)
+    scheduler.register(_recorder(calls, "far"), MINUTE, lambda: START + datetime.timedelta(days=1))
+    await clock.async_advance(2 * MINUTE + STAGGER_STEP)
+    assert [name for name, _ in calls] == ["past", "far", "past", "far"]
+
+
+@pytest.mark.asyncio
+async def test_cancel():
+    clock, scheduler = _setup()
+    calls = []
+    remove = scheduler.register(_recorder(calls, "a"))
+    await clock.async_advance(2 * MINUTE)
+    remove()
+    assert len(scheduler) == 0
+    assert not _armed_timers(clock)
+    await clock.async_advance(2 * MINUTE)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cancel_while_running():
+    clock, scheduler = _setup()
+    calls = []
+
+    async def first(now):
+        calls.append("first")
+        remove_second()
+
+    scheduler.register(first, datetime.timedelta(seconds=30))
+    remove_second = scheduler.register(_recorder(calls, "second"), datetime.timedelta(seconds=30))
+    await clock.async_advance(2 * MINUTE)
+    assert calls == ["first"] * 4
+    assert len(_armed_timers(clock)) == 1
+
+
+@pytest.mark.asyncio
+async def test_yields_between_entries():
+    clock, scheduler = _setup()
+    calls = []
+
+    async def first(now):
+        calls.append("first")
+        asyncio.get_running_loop().call_soon(calls.append, "other")
+
+    scheduler.register(first)
+    for _ in range(STAGGER_SLOTS - 1):
+        scheduler.register(_recorder([], "staggered"))
+    # Gets the same offset as the first
+    scheduler.register(_recorder(calls, "second"))
+    await clock.async_advance(MINUTE)
+    assert calls == ["first", "other", ("second", START + MINUTE)]
+
+
+@pytest.mark.asyncio
+async def test_error_does_not_stop_others():
+    clock, scheduler = _setup()
+    calls = []
+
+    async def failing(now):
+        raise RuntimeError("failed")
+
+    scheduler.register(failing, datetime.timedelta(seconds=10))
+    scheduler.register(_recorder(calls, "other"), datetime.timedelta(seconds=10))
+    await clock.async_advance(MINUTE + STAGGER_STEP)
+    assert len(calls) == 6
+
+
+@pytest.mark.asyncio
+async def test_armed_after_cancelled_action():
+    clock, scheduler = _setup()
+    calls = []
+
+    async def cancelled(now):
+        raise asyncio.CancelledError
+
+    scheduler.register(cancelled)
+    scheduler.register(_recorder(calls, "other"))
+    with pytest.raises(asyncio.CancelledError):
+        await clock.async_advance(MINUTE)
+    assert len(_armed_timers(clock)) == 1
+    await clock.async_advance(MINUTE)
+    assert calls == [("other", START + MINUTE + STAGGER_STEP)]
+
+
+def test_interval_must_be_positive():
+    _, scheduler = _setup()
+    with pytest.raises(ValueError):
+        scheduler.register(_recorder([], "a"), datetime.timedelta(0))
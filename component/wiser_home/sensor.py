@@ -2,6 +2,7 @@
 import asyncio
 import datetime
 import logging
+import time as _time
 from enum import Enum
 
 import voluptuous as vol
@@ -21,25 +22,38 @@ from homeassistant.helpers.config_validation import (
     PLATFORM_SCHEMA_BASE,
 )
 from homeassistant.core import DOMAIN as HA_DOMAIN, callback
-from homeassistant.helpers.event import (
-    async_track_time_interval,
-)
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.helpers.typing import ConfigType, HomeAssistantType, ServiceDataType
 from homeassistant.util.temperature import convert as convert_temperature
 
 from .const import (
     ATTR_AWAY_MODE,
+    ATTR_COUNT,
+    ATTR_ENABLED,
+    ATTR_ROOM,
+    ATTR_SIZE,
     CONF_BOILER,
+    CONF_DIAGNOSTICS,
     DEFAULT_AWAY_TEMP,
     DOMAIN,
+    EVENT_DIAGNOSTICS,
+    EVENT_TRACES,
     SCHEDULE_INTERVAL,
     SERVICE_SET_AWAY_TEMP,
     SERVICE_SET_AWAY_MODE,
     SERVICE_BOOST_ALL,
     SERVICE_CANCEL_OVERRIDES,
+    SERVICE_GET_TRACES,
+    SERVICE_GET_DIAGNOSTICS,
+    SERVICE_SET_DIAGNOSTICS,
+    SERVICE_SET_TRACE,
 )
-from .config import parse_rooms, CONFIG_SCHEMA
+from .clock import SYSTEM_CLOCK
+from .config import intern_config, parse_rooms, CONFIG_SCHEMA
+from .diagnostics import Diagnostics
+from .scheduler import get_scheduler
+from .tracing import DEFAULT_SIZE, TraceBuffer
+from .util import get_suppressed_log_counts
 
 _log = logging.getLogger(__name__)
 
@@ -53,15 +67,33 @@ SET_AWAY_TEMPERATURE_SCHEMA = make_entity_service_schema(
 SET_AWAY_MODE_SCHEMA = make_entity_service_schema(
     {vol.Exclusive(ATTR_AWAY_MODE, "away_mode"): cv.boolean}
 )
+SET_DIAGNOSTICS_SCHEMA = make_entity_service_schema(
+    {vol.Optional(ATTR_ENABLED, default=True): cv.boolean}
+)
+SET_TRACE_SCHEMA = make_entity_service_schema(
+    {
+        vol.Required(ATTR_ROOM): cv.string,
+        vol.Optional(ATTR_ENABLED, default=True): cv.boolean,
+        vol.Optional(ATTR_SIZE, default=DEFAULT_SIZE): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    }
+)
+GET_TRACES_SCHEMA = make_entity_service_schema(
+    {
+        vol.Required(ATTR_ROOM): cv.string,
+        vol.Optional(ATTR_COUNT): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    }
+)
 
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Wiser Home platform."""
     name = config.get(CONF_NAME)
     boiler = config.get(CONF_BOILER)
+    rule_stats = intern_config(config)
     rooms = parse_rooms(config)
     config_unique_id = config.get(CONF_UNIQUE_ID)
-    entity = WiserHome(name, config_unique_id, boiler, rooms)
+    entity = WiserHome(name, config_unique_id, boiler, rooms, rule_stats)
+    entity.set_diagnostics(config.get(CONF_DIAGNOSTICS))
     async_add_entities([entity])
 
     async def handle_away_temp_service(call):
@@ -82,6 +114,25 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         """Handle the service."""
         await entity.async_cancel_overrides(call)
 
+    async def handle_set_diagnostics_service(call):
+        """Handle the service."""
+        entity.set_diagnostics(call.data[ATTR_ENABLED])
+
+    async def handle_get_diagnostics_service(call):
+        """Handle the service."""
+        diagnostics = entity.get_diagnostics()
+        hass.bus.async_fire(EVENT_DIAGNOSTICS, {ATTR_ENTITY_ID: entity.entity_id, "diagnostics": diagnostics})
+
+    async def handle_set_trace_service(call):
+        """Handle the service."""
+        entity.set_trace(call.data[ATTR_ROOM], call.data[ATTR_ENABLED], call.data[ATTR_SIZE])
+
+    async def handle_get_traces_service(call):
+        """Handle the service."""
+        traces = entity.get_traces(call.data[ATTR_ROOM], call.data.get(ATTR_COUNT))
+        hass.bus.async_fire(
+            EVENT_TRACES, {ATTR_ENTITY_ID: entity.entity_id, ATTR_ROOM: call.data[ATTR_ROOM], "traces": traces})
+
     hass.services.async_register(
         DOMAIN, SERVICE_SET_AWAY_TEMP, handle_away_temp_service, SET_AWAY_TEMPERATURE_SCHEMA)
     hass.services.async_register(
@@ -90,6 +141,14 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         DOMAIN, SERVICE_BOOST_ALL, handle_boost_all_service, make_entity_service_schema({}))
     hass.services.async_register(
         DOMAIN, SERVICE_CANCEL_OVERRIDES, handle_cancel_overrides_service, make_entity_service_schema({}))
+    hass.services.async_register(
+        DOMAIN, SERVICE_SET_DIAGNOSTICS, handle_set_diagnostics_service, SET_DIAGNOSTICS_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_GET_DIAGNOSTICS, handle_get_diagnostics_service, make_entity_service_schema({}))
+    hass.services.async_register(
+        DOMAIN, SERVICE_SET_TRACE, handle_set_trace_service, SET_TRACE_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_GET_TRACES, handle_get_traces_service, GET_TRACES_SCHEMA)
     _log.debug("Sensor setup done")
     return True
 
@@ -119,7 +178,7 @@ class WiserHome(RestoreEntity):
 
     """
     
-    def __init__(self, name, config_unique_id, boiler, rooms):
+    def __init__(self, name, config_unique_id, boiler, rooms, rule_stats=None, clock=None):
         self._name = name
         self._mode = HeatingMode.AUTO
         self.boiler_entity_id = boiler
@@ -130,6 +189,15 @@ class WiserHome(RestoreEntity):
         self._away_temp = DEFAULT_AWAY_TEMP
         self._boost_all = False
         self._boost_timer_remove = None
+        self._rule_stats = rule_stats
+        if rule_stats is not None:
+            self._attributes['rules'] = rule_stats.as_dict()
+        self._diagnostics = None
+        # Provides the time and runs timers for the entity and its rooms, see the clock module
+        self._clock = clock if clock is not None else SYSTEM_CLOCK
+        self._control_remove = None
+        for room in rooms:
+            room.clock = self._clock
 
     @property
     def name(self):
@@ -184,38 +252,119 @@ class WiserHome(RestoreEntity):
                 for room in self.rooms:
                     await room.restore(state.attributes)
 
-        async_track_time_interval(self.hass, self._async_control_heater, datetime.timedelta(minutes=SCHEDULE_INTERVAL))
+        # All entities share one timer, see the scheduler module
+        self._control_remove = get_scheduler(self.hass, self._clock).register(
+            self._async_control_heater,
+            datetime.timedelta(minutes=SCHEDULE_INTERVAL),
+            self._next_schedule_change)
+
+    async def async_will_remove_from_hass(self):
+        """Stop the control loop when the entity is removed."""
+        if self._control_remove is not None:
+            self._control_remove()
+            self._control_remove = None
+
+    def _next_schedule_change(self):
+        """
+        Return the earliest time the schedule of a room changes its result at, None if unknown.
+        The scheduler runs the control loop then if it is earlier than the next interval.
+        """
+        changes = [room.schedule_valid_until for room in self.rooms if room.schedule_valid_until is not None]
+        return min(changes, default=None)
 
     async def _async_control_heater(self, time, away=False):
         """
-        Timer method called every SCHEDULE_INTERVAL.
+        Timer method called every SCHEDULE_INTERVAL, and when the schedule of a room changes.
         Requests all rooms to evaluate their schedule.
         :param time:
         :param away:
         :return:
         """
+        diagnostics = self._diagnostics
+        if diagnostics is not None:
+            started = _time.perf_counter()
         for room in self.rooms:
             await room.async_tick(time)
 
         self._attributes['rooms'] = [room.attributes() for room in self.rooms]
+        suppressed_logs = get_suppressed_log_counts(room.log_limited for room in self.rooms)
+        if suppressed_logs:
+            self._attributes['suppressed_logs'] = suppressed_logs
+        # Only changes are logged, this runs on every tick
         if any(room.demands_heat() for room in self.rooms):
-            _log.debug("At least one room needs heat, setting boiler on")
+            if self._attributes.get('boiler') != 'On':
+                _log.debug("At least one room needs heat, setting boiler on")
             await self._async_heater_turn_on()
         else:
-            _log.debug("No room needs heat, setting boiler off")
+            if self._attributes.get('boiler') != 'Off':
+                _log.debug("No room needs heat, setting boiler off")
             await self._async_heater_turn_off()
+        if diagnostics is not None:
+            diagnostics.add("tick", _time.perf_counter() - started)
+
+    def set_diagnostics(self, enabled):
+        """
+        Start collecting diagnostics from scratch, or stop collecting them.
+        :param enabled: True to start collecting, False to stop.
+        """
+        self._diagnostics = Diagnostics() if enabled else None
+        for room in self.rooms:
+            room.diagnostics = self._diagnostics
+
+    def get_diagnostics(self):
+        """
+        Return the diagnostics collected so far, they are only built on request rather than on every tick.
+        An empty dict is returned while no diagnostics are collected.
+        """
+        if self._diagnostics is None:
+            return {}
+        return self._diagnostics.as_dict(self._rule_stats)
+
+    def _get_room(self, name):
+        """Return the room of the given name, raising a ValueError if there is none."""
+        for room in self.rooms:
+            if room.name == name:
+                return room
+        raise ValueError(f"No room named {name}")
+
+    def set_trace(self, room_name, enabled, size=DEFAULT_SIZE):
+        """
+        Start tracing the schedule evaluations of a room from scratch, or stop tracing them.
+        :param room_name: the name of the room.
+        :param enabled: True to start tracing, False to stop.
+        :param size: the number of evaluations to keep traces of.
+        """
+        self._get_room(room_name).tracer = TraceBuffer(size) if enabled else None
+
+    def get_traces(self, room_name, count=None):
+        """
+        Return the latest traces of a room's schedule evaluations, oldest first.
+        :param room_name: the name of the room.
+        :param count: the number of traces to return, all if None.
+        """
+        tracer = self._get_room(room_name).tracer
+        if tracer is None:
+            return []
+        return tracer.get_latest(count)
+
+    async def _async_call(self, domain, service, data):
+        """Call a service, through the diagnostics if they are collected."""
+        if self._diagnostics is not None:
+            await self._diagnostics.async_call(self.hass, domain, service, data)
+        else:
+            await self.hass.services.async_call(domain, service, data)
 
     async def _async_heater_turn_on(self):
         """Turn heater toggleable device on."""
         data = {ATTR_ENTITY_ID: self.boiler_entity_id}
         self._attributes['boiler'] = 'On'
-        await self.hass.services.async_call(HA_DOMAIN, SERVICE_TURN_ON, data)
+        await self._async_call(HA_DOMAIN, SERVICE_TURN_ON, data)
 
     async def _async_heater_turn_off(self):
         """Turn heater toggleable device off."""
         data = {ATTR_ENTITY_ID: self.boiler_entity_id}
         self._attributes['boiler'] = 'Off'
-        await self.hass.services.async_call(HA_DOMAIN, SERVICE_TURN_OFF, data)
+        await self._async_call(HA_DOMAIN, SERVICE_TURN_OFF, data)
 
     async def async_set_away_temp(self, *args, **kwargs) -> None:
         """Set new target temperature."""
@@ -226,7 +375,7 @@ class WiserHome(RestoreEntity):
         _log.debug("Wiser Home away temp set to %s", temperature)
         self._attributes['away_temp'] = self._away_temp
         if self._away:
-            await self._async_control_heater(time=datetime.datetime.now(), away=True)
+            await self._async_control_heater(time=self._clock.now(), away=True)
 
     async def async_set_away_mode(self, *args, **kwargs):
         """Set away mode."""
@@ -245,7 +394,7 @@ class WiserHome(RestoreEntity):
         Register a timer for one hour and tell all rooms to boost
         """
         self._boost_all = True
-        self._boost_timer_remove = async_track_time_interval(
+        self._boost_timer_remove = self._clock.track_time_interval(
             self.hass,
             self._async_boost_end,
             datetime.timedelta(hours=1))
@@ -0,0 +1,164 @@
+"""
+This module simulates schedules over long periods of time.
+Value-only schedules (see codegen.get_leaves()) are evaluated for all points in
+time at once: every leaf path becomes a boolean mask over a minute-resolution
+time axis and the first active path in schedule order provides the value.
+NumPy is needed for this, but not for anything else in the component, so it is
+imported on first use only.
+"""
+import typing as T
+
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    import numpy
+    from .schedule import RulePath, Schedule
+
+import datetime
+
+from . import codegen
+from .const import OFF_VALUE
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class SimulationResult(T.NamedTuple):
+    """Set-points of several schedules over a period of time.
+    setpoints has one row per entry of names and one column per minute,
+    starting at start. Minutes without a result from the schedule are NaN."""
+
+    names: T.List[str]
+    start: datetime.datetime
+    setpoints: "numpy.ndarray"
+
+    def get_datetime(self, column: int) -> datetime.datetime:
+        """Returns the point in time a column of setpoints belongs to."""
+
+        return self.start + datetime.timedelta(minutes=column)
+
+
+def _import_numpy() -> T.Any:
+    """Imports NumPy, raising a RuntimeError with a hint when it's missing."""
+
+    try:
+        import numpy  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    except ImportError as err:
+        raise RuntimeError("Schedule simulation requires numpy to be installed") from err
+    return numpy
+
+
+def _seconds(_time: datetime.time) -> int:
+    """Returns the seconds since midnight of the given time."""
+
+    return _time.hour * 3600 + _time.minute * 60 + _time.second
+
+
+def _to_number(value: T.Any, off_value: float) -> float:
+    """Converts a schedule value to a set-point."""
+
+    if value == OFF_VALUE:
+        return off_value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError("Value {!r} is no set-point".format(value))
+
+
+def path_mask(np: T.Any, path: "RulePath", start: datetime.date, days: int) -> T.Any:
+    """Returns a boolean array of shape (days, MINUTES_PER_DAY), telling for
+    each minute from start on whether the path is active.
+    This follows RulePath.is_active(): the path is active when it started
+    days_back days ago, with 0 <= days_back <= end_plus_days, and its
+    constraints are fulfilled at the date it started."""
+
+    # pylint: disable=too-many-locals
+
+    if path.is_always_active:
+        return np.ones((days, MINUTES_PER_DAY), dtype=bool)
+
+    start_time, start_plus_days, end_time, end_plus_days = path.times
+    seconds = np.arange(MINUTES_PER_DAY) * 60
+    after_start = seconds >= _seconds(start_time)
+    before_end = seconds < _seconds(end_time)
+
+    # Constraints are checked once per date, covering all dates the path may
+    # have started on
+    min_shift = start_plus_days
+    max_shift = end_plus_days + start_plus_days
+    first_date = start - datetime.timedelta(days=max_shift)
+    constrained = any(rule.constraints for rule in path.rules)
+    if constrained:
+        date_ok = np.fromiter(
+            (
+                path.check_constraints(first_date + datetime.timedelta(days=index))
+                for index in range(days + max_shift - min_shift)
+            ),
+            dtype=bool,
+        )
+    else:
+        date_ok = np.ones(days + max_shift - min_shift, dtype=bool)
+
+    mask = np.zeros((days, MINUTES_PER_DAY), dtype=bool)
+    for days_back in range(end_plus_days + 1):
+        time_ok = np.ones(MINUTES_PER_DAY, dtype=bool)
+        if days_back == end_plus_days:
+            time_ok &= before_end
+        if days_back == 0:
+            time_ok &= after_start
+        offset = max_shift - days_back - start_plus_days
+        mask |= date_ok[offset:offset + days, None] & time_ok[None, :]
+    return mask
+
+
+def simulate_schedule(
+    schedule: "Schedule",
+    start: datetime.date,
+    days: int,
+    off_value: float = float("nan"),
+) -> "numpy.ndarray":
+    """Returns the set-points of the given schedule for every minute of the
+    given number of days from start on, as a one-dimensional float array.
+    The OFF value is replaced by off_value. A ValueError is raised for
+    schedules containing expressions or non-numeric values."""
+
+    np = _import_numpy()
+
+    leaves = codegen.get_leaves(schedule)
+    if leaves is None:
+        raise ValueError("{!r} contains expressions and can't be simulated".format(schedule))
+
+    setpoints = np.full(days * MINUTES_PER_DAY, np.nan)
+    if not leaves:
+        return setpoints
+
+    values = np.array(
+        [_to_number(path.rules_with_expr_or_value[-1].value, off_value) for path in leaves]
+        + [np.nan]
+    )
+    masks = np.empty((len(leaves) + 1, days * MINUTES_PER_DAY), dtype=bool)
+    for index, path in enumerate(leaves):
+        masks[index] = path_mask(np, path, start, days).ravel()
+    # A final row that's always active selects NaN where no path is active
+    masks[-1] = True
+    # argmax returns the first maximum, which is the first active path
+    setpoints[:] = values[masks.argmax(axis=0)]
+    return setpoints
+
+
+def simulate(
+    schedules: T.Mapping[str, "Schedule"],
+    start: datetime.date,
+    days: int,
+    off_value: float = float("nan"),
+) -> SimulationResult:
+    """Simulates the given schedules, usually one per room, for the given
+    number of days from midnight of start on. See simulate_schedule()."""
+
+    np = _import_numpy()
+
+    names = list(schedules)
+    setpoints = np.empty((len(names), days * MINUTES_PER_DAY))
+    for row, name in enumerate(names):
+        setpoints[row] = simulate_schedule(schedules[name], start, days, off_value)
+    return SimulationResult(
+        names, datetime.datetime.combine(start, datetime.time(0, 0)), setpoints
+    )
@@ -0,0 +1,73 @@
+import datetime
+import math
+
+import pytest
+
+from testing import Room, random_schedule
+
+from . import schedule, simulation, util
+
+np = pytest.importorskip("numpy")
+
+
+def as_setpoint(result):
+    if result is None:
+        return math.nan
+    if result[0] == "OFF":
+        return -1.0
+    return float(result[0])
+
+
+def same(a, b):
+    return a == b or math.isnan(a) and math.isnan(b)
+
+
+@pytest.mark.parametrize("seed", range(15))
+def test_simulation_matches_evaluate(seed):
+    sched = random_schedule(seed)
+    start = datetime.date(2019, 12, 28)
+    setpoints = simulation.simulate_schedule(sched, start, 10, off_value=-1.0)
+    assert setpoints.shape == (10 * 24 * 60,)
+    room = Room()
+    begin = datetime.datetime.combine(start, datetime.time(0, 0))
+    for minute in range(0, 10 * 24 * 60, 7):
+        when = begin + datetime.timedelta(minutes=minute)
+        expected = as_setpoint(sched.evaluate_sync(room, when))
+        assert same(setpoints[minute], expected), (when, sched.compiled.source)
+
+
+def test_simulate_rooms():
+    schedules = {
+        "living": schedule.Schedule(rules=[
+            schedule.Rule(value=21, start_time=datetime.time(7, 0), end_time=datetime.time(22, 0)),
+            schedule.Rule(value=16),
+        ]),
+        "bath": schedule.Schedule(rules=[
+            schedule.Rule(
+                value=23,
+                start_time=datetime.time(22, 0),
+                end_time=datetime.time(1, 0),
+                constraints={"weekdays": util.RangingSet({6})},
+            ),
+        ]),
+    }
+    # 2020-06-06 is a Saturday
+    result = simulation.simulate(schedules, datetime.date(2020, 6, 6), 2)
+    assert result.names == ["living", "bath"]
+    assert result.setpoints.shape == (2, 2 * 24 * 60)
+    assert result.get_datetime(60) == datetime.datetime(2020, 6, 6, 1, 0)
+    living, bath = result.setpoints
+    assert living[7 * 60] == 21
+    assert living[22 * 60] == 16
+    assert bath[22 * 60] == 23
+    assert bath[24 * 60 + 59] == 23
+    assert math.isnan(bath[25 * 60])
+    assert math.isnan(bath[21 * 60])
+
+
+def test_simulate_rejects_expressions():
+    sched = schedule.Schedule(rules=[
+        schedule.Rule(expr=util.compile_expression("now.hour"), expr_raw="now.hour"),
+    ])
+    with pytest.raises(ValueError):
+        simulation.simulate_schedule(sched, datetime.date(2020, 6, 1), 1)
@@ -0,0 +1,126 @@
+"""
+This module records traces of schedule evaluations, explaining why a room got
+its set-point. While a room has a TraceBuffer attached, every evaluation of its
+schedule is interpreted rule path by rule path and each step is recorded as a
+compact (kind, path, payload) tuple. Traces are kept in a ring buffer of fixed
+size and only formatted into text when they are read.
+"""
+import typing as T
+
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    from .room import Room
+    from .schedule import RulePath, ScheduleEvaluationResultType, ScheduleValidityType
+
+import collections
+import datetime
+
+# Kinds of trace events, the payload is given in parentheses
+SUB = 0  # sub-schedule whose paths follow (None)
+SHARED = 1  # shared sub-schedule, evaluated on its own (None)
+MEMO = 2  # outcome of the shared sub-schedule reused (its value)
+INACTIVE = 3  # path isn't active (None)
+ACTIVE = 4  # path is active (None)
+EXPR = 5  # expression evaluated (its result)
+EXPR_CACHED = 6  # expression result reused (the result)
+VALUE = 7  # value of a rule (the value)
+SKIP = 8  # result skipped in favour of the parent rule (None)
+BREAK = 9  # breaking out of sub-schedules (the Break() result)
+
+LABELS = {
+    SUB: "[SUB]",
+    SHARED: "[SHR]",
+    MEMO: "=> {!r}  [memo]",
+    INACTIVE: "[INA]",
+    ACTIVE: "[ACT]",
+    EXPR: "=> {!r}",
+    EXPR_CACHED: "=> {!r}  [cache-hit]",
+    VALUE: "=> {!r}",
+    SKIP: "==   skipping in favour of parent",
+    BREAK: "== {!r}",
+}
+
+TraceEventType = T.Tuple[int, T.Optional["RulePath"], T.Any]
+
+DEFAULT_SIZE = 50
+
+
+class Trace(T.NamedTuple):
+    """The trace of one evaluation. events is empty when the result of an
+    earlier evaluation was reused."""
+
+    when: datetime.datetime
+    result: T.Optional["ScheduleEvaluationResultType"]
+    events: T.Tuple[TraceEventType, ...]
+    reused: bool = False
+
+
+def format_event(event: TraceEventType) -> str:
+    """Returns a line of text describing a trace event, indented by the
+    depth of its path."""
+
+    kind, path, payload = event
+    label = LABELS[kind]
+    if kind in (SUB, SHARED, INACTIVE, ACTIVE):
+        label = "{}  {}".format(label, path)
+    else:
+        label = label.format(payload)
+    depth = path.depth if path is not None else 1
+    return "{}{}".format(" " * 4 * max(0, depth - 1), label)
+
+
+def format_trace(trace: Trace) -> T.Dict[str, T.Any]:
+    """Returns a trace in a form suitable for event data."""
+
+    if trace.result is None:
+        value = rule = None
+    else:
+        value, _, rule = trace.result
+    return {
+        "time": trace.when.isoformat(),
+        "value": repr(value),
+        "rule": repr(rule),
+        "reused": trace.reused,
+        "events": [format_event(event) for event in trace.events],
+    }
+
+
+class TraceBuffer:
+    """Keeps the traces of the latest evaluations of a room's schedule."""
+
+    __slots__ = ("traces",)
+
+    def __init__(self, size: int = DEFAULT_SIZE) -> None:
+        self.traces = collections.deque(maxlen=size)  # type: T.Deque[Trace]
+
+    def __repr__(self) -> str:
+        return "<TraceBuffer of {}/{} traces>".format(len(self.traces), self.traces.maxlen)
+
+    def evaluate_schedule(
+        self, room: "Room", when: datetime.datetime
+    ) -> T.Tuple[T.Any, "ScheduleValidityType", T.Optional[int]]:
+        """Evaluates the room's schedule like Schedule._evaluate_with_validity()
+        does, recording a trace of it."""
+
+        events = []  # type: T.List[TraceEventType]
+        result, valid_until, tested_count = room.schedule._evaluate_with_validity(  # pylint: disable=protected-access
+            room, when, trace=events
+        )
+        self.traces.append(Trace(when, result, tuple(events)))
+        return result, valid_until, tested_count
+
+    def add_reused(
+        self, when: datetime.datetime, result: T.Optional["ScheduleEvaluationResultType"]
+    ) -> None:
+        """Records that the result of an earlier evaluation was reused."""
+
+        self.traces.append(Trace(when, result, (), True))
+
+    def get_latest(self, count: int = None) -> T.List[T.Dict[str, T.Any]]:
+        """Returns the given number of latest traces, oldest first, formatted
+        by format_trace()."""
+
+        traces = list(self.traces)
+        if count is not None:
+            traces = traces[-count:] if count > 0 else []
+        return [format_trace(trace) for trace in traces]
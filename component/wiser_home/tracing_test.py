@@ -0,0 +1,82 @@
+import datetime
+
+from . import schedule, tracing, util
+from .room import Room
+
+
+def _schedule():
+    return schedule.Schedule(rules=[
+        schedule.SubScheduleRule(
+            schedule.Schedule(rules=[schedule.Rule(value=22)]),
+            start_time=datetime.time(6),
+            end_time=datetime.time(8),
+        ),
+        schedule.Rule(
+            expr=util.compile_expression("Next()"), expr_raw="Next()"
+        ),
+        schedule.Rule(value=18),
+    ])
+
+
+def test_trace_events():
+    sched = _schedule()
+    room = Room(name="kitchen", schedule=sched)
+    events = []
+    when = datetime.datetime(2020, 1, 1, 9)
+    result, _ = sched._evaluate(room, when, trace=events)
+    assert result == sched.evaluate_sync(room, when)
+    assert [kind for kind, _, _ in events] == [
+        tracing.SUB,
+        tracing.INACTIVE,
+        tracing.ACTIVE,
+        tracing.EXPR,
+        tracing.ACTIVE,
+        tracing.VALUE,
+    ]
+    assert events[-1][2] == 18
+
+
+def test_trace_compiled_schedule_interpreted():
+    sched = schedule.Schedule(rules=[schedule.Rule(value=18)])
+    assert sched.compiled is not None
+    events = []
+    sched._evaluate(Room(name="kitchen", schedule=sched), datetime.datetime(2020, 1, 1), trace=events)
+    assert [kind for kind, _, _ in events] == [tracing.ACTIVE, tracing.VALUE]
+
+
+def test_room_traced():
+    room = Room(name="kitchen", schedule=_schedule())
+    room.tracer = tracing.TraceBuffer(2)
+    for hour in (5, 7, 9):
+        room.evaluate_schedule(datetime.datetime(2020, 1, 1, hour))
+    traces = room.tracer.get_latest()
+    assert len(traces) == 2
+    assert traces[0]["time"] == "2020-01-01T07:00:00"
+    assert traces[0]["value"] == "22"
+    assert traces[0]["events"][0].startswith("[SUB]")
+    assert traces[0]["events"][-1] == "    => 22"
+    assert traces[1]["value"] == "18"
+
+
+def test_room_traced_reused():
+    room = Room(name="kitchen", schedule=schedule.Schedule(rules=[schedule.Rule(value=18)]))
+    room.tracer = tracing.TraceBuffer()
+    room.evaluate_schedule(datetime.datetime(2020, 1, 1, 5))
+    room.evaluate_schedule(datetime.datetime(2020, 1, 1, 6))
+    traces = room.tracer.get_latest(1)
+    assert traces == [{
+        "time": "2020-01-01T06:00:00",
+        "value": "18",
+        "rule": traces[0]["rule"],
+        "reused": True,
+        "events": [],
+    }]
+
+
+def test_get_latest_count():
+    buffer = tracing.TraceBuffer()
+    for minute in range(3):
+        buffer.add_reused(datetime.datetime(2020, 1, 1, 0, minute), None)
+    assert [trace["time"] for trace in buffer.get_latest(2)] == [
+        "2020-01-01T00:01:00", "2020-01-01T00:02:00"]
+    assert buffer.get_latest(0) == []
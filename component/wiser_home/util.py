@@ -7,10 +7,16 @@ import types
 import typing as T
 
 import collections
+import collections.abc
 import datetime
+import logging
 import re
 import voluptuous as vol
 
+from homeassistant.util import dt as dt_util
+
+from .clock import SYSTEM_CLOCK, Clock
+
 
 # matches any character not allowed in Python variable names
 INVALID_VAR_NAME_CHAR_PATTERN = re.compile(r"[^0-9a-z_]", re.I)
@@ -34,30 +40,144 @@ RULE_TIME_REGEXP = re.compile(
 # used instead of vol.Extra to ensure keys are strings
 CONF_STR_KEY = vol.Coerce(str)
 
-
-class RangingSet(set):
-    """A set for integers that forms nice ranges in its __repr__,
-    perfectly suited for the expansion of range strings."""
+# Compiled expressions, shared process-wide and keyed by (source, mode),
+# least recently used first
+_COMPILED_EXPRESSIONS = (
+    collections.OrderedDict()
+)  # type: T.MutableMapping[T.Tuple[str, str], types.CodeType]
+
+# Maximum number of compiled expressions kept, the least recently used ones
+# are dropped beyond it
+EXPRESSION_CACHE_SIZE = 512
+
+
+class RangingSet(collections.abc.Set):
+    """An immutable set of non-negative integers that forms nice ranges in its
+    __repr__, perfectly suited for the expansion of range strings.
+    The numbers are stored as the bits of a single int, which makes membership
+    tests and set operations between RangingSet objects cheap. Being hashable,
+    equal sets can be shared and used as cache keys."""
+
+    __slots__ = ("_mask", "_hash_value", "_repr")
+
+    def __init__(self, numbers: T.Iterable[int] = ()) -> None:
+        mask = 0
+        for num in numbers:
+            if num < 0:
+                raise ValueError("RangingSet can't hold negative numbers: {}".format(num))
+            mask |= 1 << num
+        self._mask = mask
+        self._hash_value = None  # type: T.Optional[int]
+        self._repr = None  # type: T.Optional[str]
+
+    @classmethod
+    def from_mask(cls, mask: int) -> "RangingSet":
+        """Creates a set containing the numbers whose bits are set in mask."""
+
+        if mask < 0:
+            raise ValueError("mask must not be negative")
+        numbers = cls()
+        numbers._mask = mask  # pylint: disable=protected-access
+        return numbers
+
+    @classmethod
+    def from_range(cls, start: int, end: int, step: int = 1) -> "RangingSet":
+        """Creates a set containing the numbers from start to end (inclusive)
+        with the given step."""
+
+        if start > end:
+            return cls()
+        if step == 1:
+            return cls.from_mask((1 << (end + 1)) - (1 << start))
+        return cls(range(start, end + 1, step))
+
+    @classmethod
+    def _from_iterable(cls, numbers: T.Iterable[int]) -> "RangingSet":
+        return cls(numbers)
+
+    @property
+    def mask(self) -> int:
+        """The int whose bits are set for the numbers in this set."""
+
+        return self._mask
+
+    def __contains__(self, value: object) -> bool:
+        if not isinstance(value, int):
+            # Like in a set of ints, equal numbers such as 2.0 are members too
+            try:
+                if value != int(value):  # type: ignore
+                    return False
+            except (TypeError, ValueError, OverflowError):
+                return False
+            value = int(value)  # type: ignore
+        return value >= 0 and bool(self._mask >> value & 1)
+
+    def __iter__(self) -> T.Iterator[int]:
+        mask = self._mask
+        while mask:
+            lowest = mask & -mask
+            yield lowest.bit_length() - 1
+            mask ^= lowest
+
+    def __len__(self) -> int:
+        return bin(self._mask).count("1")
+
+    def __bool__(self) -> bool:
+        return bool(self._mask)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RangingSet):
+            return self._mask == other._mask
+        return super().__eq__(other)
+
+    def __hash__(self) -> int:
+        # Equal to the hash of a frozenset with the same numbers, like equality
+        if self._hash_value is None:
+            self._hash_value = self._hash()
+        return self._hash_value
+
+    def __and__(self, other: T.AbstractSet) -> T.AbstractSet:  # type: ignore
+        if isinstance(other, RangingSet):
+            return RangingSet.from_mask(self._mask & other._mask)
+        return super().__and__(other)
+
+    def __or__(self, other: T.AbstractSet) -> T.AbstractSet:  # type: ignore
+        if isinstance(other, RangingSet):
+            return RangingSet.from_mask(self._mask | other._mask)
+        return super().__or__(other)
+
+    def __sub__(self, other: T.AbstractSet) -> T.AbstractSet:  # type: ignore
+        if isinstance(other, RangingSet):
+            return RangingSet.from_mask(self._mask & ~other._mask)
+        return super().__sub__(other)
+
+    def __xor__(self, other: T.AbstractSet) -> T.AbstractSet:  # type: ignore
+        if isinstance(other, RangingSet):
+            return RangingSet.from_mask(self._mask ^ other._mask)
+        return super().__xor__(other)
+
+    def invert(self, min_value: int, max_value: int) -> "RangingSet":
+        """Returns the numbers from min_value to max_value not in this set.
+        Numbers of this set outside of these bounds are left out as well."""
+
+        return RangingSet.from_mask(
+            RangingSet.from_range(min_value, max_value).mask & ~self._mask
+        )
 
     def __repr__(self) -> str:
+        if self._repr is not None:
+            return self._repr
         if not self:
             return "{}"
 
-        # fall back to legacy representation when non-ints are found
-        for item in self:
-            if not isinstance(item, int):
-                return super().__repr__()
-
-        nums = sorted(self)  # type: T.List[int]
         ranges = collections.OrderedDict()  # type: T.Dict[int, int]
-        range_start = nums[0]
-        ranges[range_start] = range_start
-        for num in nums[1:]:
-            if num - 1 != ranges[range_start]:
+        range_start = -2
+        for num in self:
+            if num - 1 != ranges.get(range_start):
                 range_start = num
             ranges[range_start] = num
 
-        return "{{{}}}".format(
+        self._repr = "{{{}}}".format(
             ", ".join(
                 [
                     str(start) if start == end else "{}-{}".format(start, end)
@@ -65,6 +185,76 @@ class RangingSet(set):
                 ]
             )
         )
+        return self._repr
+
+
+class RateLimitedLogger:
+    """Wraps a logger for messages that would otherwise be repeated on every
+    tick. A message is emitted at most once per interval (in seconds) for
+    the same format string and key, measured by the time of the given clock.
+    The number of messages suppressed in between is appended to the next one
+    emitted, and the total numbers per format string are kept in suppressed.
+    Each room has its own instance, so that the totals of a WiserHome entity
+    only cover its rooms."""
+
+    __slots__ = ("logger", "interval", "clock", "suppressed", "_emitted")
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        interval: float = 3600,
+        clock: Clock = None,
+    ) -> None:
+        self.logger = logger
+        self.interval = interval
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.suppressed = collections.Counter()  # type: T.Counter[str]
+        # (time emitted, suppressed since) per (msg, key)
+        self._emitted = {}  # type: T.Dict[T.Tuple[str, T.Hashable], T.Tuple[datetime.datetime, int]]
+
+    def __repr__(self) -> str:
+        return "<RateLimitedLogger {} every {}s>".format(self.logger.name, self.interval)
+
+    def log(self, level: int, msg: str, *args: T.Any, key: T.Hashable = None) -> bool:
+        """Logs msg % args like logging.Logger.log() does, unless it has been
+        logged with the same key less than interval seconds ago.
+        Returns whether the message was emitted."""
+
+        if not self.logger.isEnabledFor(level):
+            return False
+        # In UTC, so that times of clocks with and without time zone compare
+        now = dt_util.as_utc(self.clock.now())
+        emitted = self._emitted.get((msg, key))
+        if emitted is not None and (now - emitted[0]).total_seconds() < self.interval:
+            self._emitted[msg, key] = (emitted[0], emitted[1] + 1)
+            self.suppressed[msg] += 1
+            return False
+        self._emitted[msg, key] = (now, 0)
+        if emitted is not None and emitted[1]:
+            self.logger.log(level, msg + " (%d similar messages suppressed)", *args, emitted[1])
+        else:
+            self.logger.log(level, msg, *args)
+        return True
+
+    def warning(self, msg: str, *args: T.Any, key: T.Hashable = None) -> bool:
+        """Logs a rate-limited message with level WARNING."""
+
+        return self.log(logging.WARNING, msg, *args, key=key)
+
+    def error(self, msg: str, *args: T.Any, key: T.Hashable = None) -> bool:
+        """Logs a rate-limited message with level ERROR."""
+
+        return self.log(logging.ERROR, msg, *args, key=key)
+
+
+def get_suppressed_log_counts(loggers: T.Iterable[RateLimitedLogger]) -> T.Dict[str, int]:
+    """Returns the numbers of messages suppressed by the given
+    RateLimitedLogger instances so far, by format string."""
+
+    counts = collections.Counter()  # type: T.Counter[str]
+    for logger in loggers:
+        counts.update(logger.suppressed)
+    return dict(counts)
 
 
 def build_date_from_constraint(
@@ -112,20 +302,43 @@ def compile_expression(expr: str) -> types.CodeType:
     Strings containing one or more newlines are assumed to contain
     whole statements. Others are treated as simple expressions and
     "result = " is prepended to them before compilation is done as a
-    single statement."""
+    single statement.
+    Expressions are normalized before compilation and the same code
+    object is returned for the same normalized expression, so that caches
+    keyed by code objects see identical expressions as one. Up to
+    EXPRESSION_CACHE_SIZE of the most recently used ones are kept."""
 
+    expr = normalize_expression(expr)
     if "\n" in expr:
         mode = "exec"
     else:
         expr = "result = {}".format(expr)
         mode = "single"
 
-    compiled = compile(
-        expr, "expression", mode, dont_inherit=True
-    )  # type: types.CodeType
+    key = (expr, mode)
+    try:
+        compiled = _COMPILED_EXPRESSIONS[key]
+    except KeyError:
+        pass
+    else:
+        _COMPILED_EXPRESSIONS.move_to_end(key)
+        return compiled
+
+    compiled = compile(expr, "expression", mode, dont_inherit=True)  # type: types.CodeType
+    _COMPILED_EXPRESSIONS[key] = compiled
+    if len(_COMPILED_EXPRESSIONS) > EXPRESSION_CACHE_SIZE:
+        _COMPILED_EXPRESSIONS.popitem(last=False)
     return compiled
 
 
+def normalize_expression(expr: str) -> str:
+    """Normalizes line endings and strips whitespace surrounding an
+    expression, which doesn't change its meaning. Whitespace within it
+    is kept, it may be part of a string literal."""
+
+    return expr.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
 def deep_merge_dicts(source: dict, dest: dict) -> None:
     """Updates items of dest with those of source, descending into and
     merging child dictionaries as well. Child lists are combined as
@@ -156,7 +369,7 @@ def escape_var_name(name: str) -> str:
 
 def expand_range_spec(
     spec: T.Union[int, str], min_value: int, max_value: int
-) -> T.Set[int]:
+) -> RangingSet:
     """Expands strings of the range specification format to RangingSet
     objects containing the individual numbers.
     Any whitespace is ignored. If an int is given instead of a string,
@@ -198,11 +411,10 @@ def expand_range_spec(
                 start, end = end, start
         step = int(_step or 1)
 
-        for i in range(start, end + 1, step):
-            numbers.add(i)
+        numbers |= RangingSet.from_range(start, end, step)
 
     if invert:
-        numbers.symmetric_difference_update(range(min_value, max_value + 1))
+        numbers = numbers.invert(min_value, max_value)
 
     return numbers
 
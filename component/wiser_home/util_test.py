@@ -0,0 +1,147 @@
+import asyncio
+import datetime
+import logging
+
+import pytest
+
+from . import util
+from .clock import VirtualClock
+
+
+@pytest.fixture
+def compiled_expressions():
+    util._COMPILED_EXPRESSIONS.clear()
+    yield util._COMPILED_EXPRESSIONS
+    util._COMPILED_EXPRESSIONS.clear()
+
+
+def test_compile_expression_shared(compiled_expressions):
+    assert util.compile_expression("Add(2)") is util.compile_expression(" Add(2)  ")
+
+
+def test_compile_expression_statements_shared(compiled_expressions):
+    first = util.compile_expression("x = 2\nresult = x  ")
+    assert first is util.compile_expression("x = 2\r\nresult = x\n")
+
+
+def test_compile_expression_modes_not_mixed(compiled_expressions):
+    assert util.compile_expression("1") is not util.compile_expression("result = 1\n")
+
+
+def test_compile_expression_keeps_string_literals(compiled_expressions):
+    env = {}
+    exec(util.compile_expression('x = """a  \nb"""\nresult = x'), env)
+    assert env["result"] == "a  \nb"
+
+
+def test_compile_expression_cache_bounded(compiled_expressions, monkeypatch):
+    monkeypatch.setattr(util, "EXPRESSION_CACHE_SIZE", 3)
+    first = util.compile_expression("Add(0)")
+    for value in range(1, 3):
+        util.compile_expression("Add({})".format(value))
+    # Using it makes it the most recently used, the next oldest is dropped
+    assert util.compile_expression("Add(0)") is first
+    util.compile_expression("Add(3)")
+    assert len(compiled_expressions) == 3
+    assert ("result = Add(1)", "single") not in compiled_expressions
+    assert util.compile_expression("Add(0)") is first
+
+
+@pytest.mark.parametrize("spec,expected", [
+    ("1-5", "{1-5}"),
+    ("1-2,4,6-7", "{1-2, 4, 6-7}"),
+    ("*/2", "{1, 3, 5, 7}"),
+    ("!2-3", "{1, 4-7}"),
+    ("!*", "{}"),
+    (4, "{4}"),
+])
+def test_expand_range_spec(spec, expected):
+    assert repr(util.expand_range_spec(spec, 1, 7)) == expected
+
+
+def test_expand_range_spec_out_of_range():
+    with pytest.raises(ValueError):
+        util.expand_range_spec("0-3", 1, 7)
+
+
+def test_ranging_set_years():
+    years = util.expand_range_spec("2020-2099/10", 1970, 2099)
+    assert list(years) == list(range(2020, 2100, 10))
+    assert 2090 in years
+    assert 2091 not in years
+    assert -1 not in years
+    assert "2020" not in years
+
+
+def test_ranging_set_contains_equal_numbers():
+    numbers = util.RangingSet({1, 2})
+    assert 2.0 in numbers
+    assert 2.5 not in numbers
+    assert True in numbers
+    assert -1.0 not in numbers
+    assert float("nan") not in numbers
+    assert float("inf") not in numbers
+
+
+def test_ranging_set_operations():
+    weekdays = util.RangingSet(range(1, 6))
+    weekend = util.RangingSet({6, 7})
+    assert weekdays | weekend == util.RangingSet.from_range(1, 7)
+    assert not weekdays & weekend
+    assert weekdays - {1} == {2, 3, 4, 5}
+    assert isinstance(weekdays ^ weekend, util.RangingSet)
+    assert weekend.invert(1, 7) == weekdays
+    # Numbers outside of the bounds are dropped, not kept like with ^
+    assert util.RangingSet({0, 3, 9}).invert(1, 5) == {1, 2, 4, 5}
+    assert len(weekdays) == 5
+
+
+def test_ranging_set_hashable():
+    first = util.expand_range_spec("1-5", 1, 7)
+    second = util.RangingSet([5, 4, 3, 2, 1])
+    assert first == second
+    assert {first: True}[second]
+    assert hash(first) == hash(frozenset(range(1, 6)))
+    assert first == set(range(1, 6))
+    with pytest.raises(ValueError):
+        util.RangingSet({-1})
+
+
+def test_rate_limited_logger(caplog):
+    clock = VirtualClock(datetime.datetime(2020, 1, 1))
+    logger = util.RateLimitedLogger(logging.getLogger("rate_limited_test"), 60, clock)
+    for _ in range(3):
+        logger.warning("Room %s is cold", "kitchen", key="kitchen")
+    assert logger.warning("Room %s is cold", "bath", key="bath")
+    assert [r.getMessage() for r in caplog.records] == ["Room kitchen is cold", "Room bath is cold"]
+    assert logger.suppressed == {"Room %s is cold": 2}
+
+    caplog.clear()
+    asyncio.run(clock.async_advance(datetime.timedelta(seconds=60)))
+    assert logger.warning("Room %s is cold", "kitchen", key="kitchen")
+    assert not logger.warning("Room %s is cold", "kitchen", key="kitchen")
+    assert [r.getMessage() for r in caplog.records] == [
+        "Room kitchen is cold (2 similar messages suppressed)"
+    ]
+    assert util.get_suppressed_log_counts([logger])["Room %s is cold"] == 3
+
+
+def test_suppressed_log_counts_per_logger():
+    first = util.RateLimitedLogger(logging.getLogger("rate_limited_test_first"))
+    second = util.RateLimitedLogger(logging.getLogger("rate_limited_test_second"))
+    for _ in range(3):
+        first.warning("Room is cold")
+    second.warning("Room is cold")
+    second.warning("Valve is offline")
+    second.warning("Valve is offline")
+    assert util.get_suppressed_log_counts([first]) == {"Room is cold": 2}
+    assert util.get_suppressed_log_counts([second]) == {"Valve is offline": 1}
+    assert util.get_suppressed_log_counts([first, second]) == {"Room is cold": 2, "Valve is offline": 1}
+
+
+def test_rate_limited_logger_disabled_level(caplog):
+    logger = util.RateLimitedLogger(logging.getLogger("rate_limited_test_disabled"))
+    logger.logger.setLevel(logging.ERROR)
+    assert not logger.warning("ignored")
+    assert not logger.suppressed
+    assert not caplog.records